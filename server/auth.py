@@ -1,6 +1,6 @@
 """Optional bearer token authentication middleware.
 
-If HAMEM_API_TOKEN is set, all requests (except /health) must include:
+If HAMEM_API_TOKEN is set, all requests (except /health and /metrics) must include:
     Authorization: Bearer <token>
 
 If HAMEM_API_TOKEN is empty (default), no authentication is required.
@@ -23,8 +23,8 @@ class BearerTokenMiddleware(BaseHTTPMiddleware):
         if not settings.api_token:
             return await call_next(request)
 
-        # Always allow health checks without auth
-        if request.url.path == "/health":
+        # Always allow health checks and metrics scrapes without auth
+        if request.url.path in ("/health", "/metrics"):
             return await call_next(request)
 
         # Check Authorization header
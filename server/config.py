@@ -11,10 +11,66 @@ class Settings(BaseSettings):
     db_user: str = "hamem"
     db_password: str = "hamem"
 
-    # Ollama
+    # Schema changes are versioned migrations, run with `python -m server.migrations`.
+    # At startup the service only checks the schema; if it is behind, auto_migrate
+    # applies the missing steps, otherwise startup fails until migrations are run.
+    auto_migrate: bool = True
+
+    # Ollama — a comma-separated list of URLs spreads embedding requests across
+    # hosts; a host that errors or times out sits out for ollama_eject_seconds
     ollama_url: str = "http://localhost:11434"
+    ollama_eject_seconds: float = 30.0
     embed_model: str = "nomic-embed-text"
 
+    # Embedding backend: "ollama" (HTTP API above), "onnx" (in-process CPU
+    # inference of a local ONNX export; needs the [onnx] extra) or "hashing"
+    # (deterministic feature hashing for tests and benchmarks; not semantic)
+    embed_backend: str = "ollama"
+    onnx_model_path: str = ""
+    onnx_tokenizer_path: str = ""
+    onnx_threads: int = 4
+    onnx_max_tokens: int = 512
+
+    # Embedding cache — size 0 disables it. If embed_cache_path is set, the cache
+    # is loaded from that file at startup and written back on shutdown.
+    embed_cache_size: int = 2048
+    embed_cache_ttl: float = 86400.0
+    embed_cache_path: str = ""
+
+    # Concurrent embed() calls arriving within this window are sent to Ollama as
+    # one batched request (0 disables coalescing).
+    embed_batch_window_ms: float = 5.0
+    embed_batch_max_size: int = 32
+
+    # /memory/set_batch embeds items in chunks of this many texts per Ollama call
+    set_batch_chunk_size: int = 64
+
+    # Rows fetched per cursor round trip by /memory/export and written per COPY
+    # by /memory/import
+    transfer_chunk_size: int = 1000
+    # Allow /memory/import?defer_index=true, which drops the ANN index until the
+    # import finishes. Off by default, since any client could then leave vector
+    # search without its index; turn it on for restores.
+    import_allow_defer_index: bool = False
+
+    # How embeddings are stored and indexed: "vector" (float32 + HNSW),
+    # "halfvec" (float16 + HNSW) or "binary" (float32 + HNSW over binary-quantized
+    # vectors, with exact re-ranking of binary_rerank_factor x candidates).
+    # Changing it converts the table on the next migration run.
+    vector_storage: str = "vector"
+    binary_rerank_factor: int = 4
+    # HNSW build parameters. Changing them rebuilds the ANN index CONCURRENTLY on
+    # the next migration run.
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+
+    # Stored embedding dimension. nomic-embed-text is a Matryoshka model, so its
+    # 768-dim output can be truncated (and re-normalized) to e.g. 512 or 256.
+    # Changing it migrates existing rows in the background on next startup,
+    # reindex_batch_size rows at a time.
+    embed_dim: int = 768
+    reindex_batch_size: int = 500
+
     # Server
     host: str = "0.0.0.0"
     port: int = 8920
@@ -23,11 +79,105 @@ class Settings(BaseSettings):
     # Optional API token — if set, all requests must include Authorization: Bearer <token>
     api_token: str = ""
 
+    # Admission control — at most admission_max_concurrent memory requests run at
+    # once, bulk requests (set_batch, import, export) at most
+    # admission_bulk_max_concurrent of them; queued interactive requests go
+    # first. Each lane queues up to admission_queue_size requests (then 429) for
+    # up to admission_queue_timeout seconds (then 503).
+    admission_max_concurrent: int = 8
+    admission_bulk_max_concurrent: int = 2
+    admission_queue_size: int = 64
+    admission_queue_timeout: float = 5.0
+
+    # Read-through cache for /memory/get (size 0 disables it)
+    memory_cache_size: int = 1024
+    memory_cache_ttl: float = 300.0
+
+    # Seconds between bulk writes of buffered last_used_at updates
+    touch_flush_interval: float = 30.0
+
+    # Write-behind /memory/set: store the row at once and embed it in the
+    # background. embed_workers batches of embed_worker_batch_size rows are
+    # embedded concurrently; the worker also polls every embed_worker_interval
+    # seconds for rows left pending by a restart.
+    write_behind: bool = False
+    embed_worker_interval: float = 5.0
+    embed_worker_batch_size: int = 64
+    embed_workers: int = 2
+
+    # Expired-row reaper: every reap_interval seconds (0 disables), delete expired
+    # memories reap_batch_size rows at a time. A pass that deletes at least
+    # reap_vacuum_threshold rows is followed by VACUUM so the HNSW and GIN
+    # indexes drop the dead entries (0 leaves it to autovacuum).
+    reap_interval: float = 3600.0
+    reap_batch_size: int = 1000
+    reap_vacuum_threshold: int = 10000
+
+    # Row quotas, enforced every quota_interval seconds (0 disables). A user may
+    # keep at most quota_max_rows_per_user memories (0 = unlimited);
+    # quota_scope_limits caps single scopes per user, e.g. "user=2000,session=200".
+    # The least recently used rows over a cap are deleted, or moved to
+    # memories_archive if quota_archive is set.
+    quota_interval: float = 300.0
+    quota_max_rows_per_user: int = 0
+    quota_scope_limits: str = ""
+    quota_archive: bool = False
+    quota_batch_size: int = 1000
+
+    # Near-duplicate consolidation (opt-in). A new key at least dedup_threshold
+    # cosine similar to another memory of the same user and scope is merged into
+    # it on /memory/set unless force_new is set (0 disables). Every dedup_interval
+    # seconds (0 disables) a background pass removes existing duplicates,
+    # keeping the more recently used row, dedup_batch_size rows per statement;
+    # dedup_archive copies removed rows into memories_archive.
+    dedup_threshold: float = 0.0
+    dedup_interval: float = 0.0
+    dedup_batch_size: int = 500
+    dedup_archive: bool = False
+
+    # Longest a search waits for its query embedding (ms) before falling back to
+    # trigram-only matching and flagging the response as degraded (0 = no limit)
+    search_budget_ms: float = 1500.0
+
+    # Slow-search sampler (opt-in): searches slower than slow_search_ms are re-run
+    # under EXPLAIN (ANALYZE, BUFFERS) at slow_search_sample_rate and the last
+    # slow_search_buffer_size plans are served at /admin/slow_searches (0 = off)
+    slow_search_ms: float = 0.0
+    slow_search_sample_rate: float = 0.1
+    slow_search_buffer_size: int = 50
+
     # Search tuning
     vector_threshold: float = 0.35
     trigram_weight: float = 0.15
     trigram_threshold: float = 0.1
 
+    # "hybrid" pulls candidates from both the HNSW and trigram GIN indexes;
+    # "vector" only uses HNSW candidates and applies trigram as a boost.
+    search_mode: str = "hybrid"
+    # How hybrid candidates are ranked: "weighted" (vec + trigram_weight * trgm)
+    # or "rrf" (reciprocal rank fusion with constant rrf_k).
+    search_fusion: str = "weighted"
+    rrf_k: int = 60
+    # Candidates taken from each channel, as a multiple of the result limit
+    vector_depth_factor: int = 3
+    trigram_depth_factor: int = 3
+    # Similarity a row needs to enter the trigram channel (pg_trgm % operator).
+    # Kept above trigram_threshold so the GIN scan stays selective.
+    trigram_candidate_threshold: float = 0.3
+    # Word similarity a row needs to be returned by the trigram-only fallback
+    # search used when the query embedding misses its budget (pg_trgm <%).
+    lexical_fallback_threshold: float = 0.5
+
+    # Users/scopes with fewer live rows than this get an exact brute-force vector
+    # scan; larger ones use the HNSW index. Row counts refresh on this interval.
+    exact_search_threshold: int = 2000
+    planner_refresh_interval: float = 60.0
+    # HNSW search settings for the index path. iterative_scan (pgvector >= 0.8)
+    # keeps walking the graph until enough rows pass the user/scope filter;
+    # set it to "" to leave the server default.
+    hnsw_ef_search: int = 100
+    hnsw_iterative_scan: str = "relaxed_order"
+
     @property
     def dsn(self) -> str:
         if self.db_password:
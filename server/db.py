@@ -1,50 +1,50 @@
+from contextlib import asynccontextmanager
+
 import asyncpg
 from pgvector.asyncpg import register_vector
 
+from server import metrics, migrations
 from server.config import settings
 
 pool: asyncpg.Pool | None = None
 
-SCHEMA_SQL = """
-CREATE EXTENSION IF NOT EXISTS vector;
-CREATE EXTENSION IF NOT EXISTS pg_trgm;
-
-CREATE TABLE IF NOT EXISTS memories (
-    id              BIGSERIAL PRIMARY KEY,
-    key             TEXT NOT NULL,
-    value           TEXT NOT NULL,
-    scope           TEXT NOT NULL DEFAULT 'user',
-    user_id         TEXT NOT NULL DEFAULT 'default',
-    tags            TEXT NOT NULL DEFAULT '',
-    tags_search     TEXT NOT NULL DEFAULT '',
-    embedding       vector(768),
-    search_text     TEXT NOT NULL DEFAULT '',
-    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-    last_used_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-    expires_at      TIMESTAMPTZ,
-    UNIQUE (key, user_id)
-);
-
-CREATE INDEX IF NOT EXISTS idx_memories_embedding_hnsw ON memories
-    USING hnsw (embedding vector_cosine_ops) WITH (m=16, ef_construction=64);
-CREATE INDEX IF NOT EXISTS idx_memories_key ON memories (key);
-CREATE INDEX IF NOT EXISTS idx_memories_scope ON memories (scope);
-CREATE INDEX IF NOT EXISTS idx_memories_user_id ON memories (user_id);
-CREATE INDEX IF NOT EXISTS idx_memories_search_text_trgm ON memories
-    USING gin (search_text gin_trgm_ops);
-"""
+# Dimension of the embedding column as it exists in the database. Normally
+# settings.embed_dim; differs only while reindex_service migrates to a new one.
+embedding_dim = settings.embed_dim
+
+
+def _server_settings() -> dict[str, str]:
+    """Session settings for search, passed at connect time so they survive the
+    pool's RESET ALL on release."""
+    server_settings = {
+        # Threshold for the pg_trgm % operator used by the trigram search channel
+        "pg_trgm.similarity_threshold": str(settings.trigram_candidate_threshold),
+        # Threshold for the <% operator used by the trigram-only fallback search
+        "pg_trgm.word_similarity_threshold": str(settings.lexical_fallback_threshold),
+        "hnsw.ef_search": str(settings.hnsw_ef_search),
+    }
+    if settings.hnsw_iterative_scan:
+        server_settings["hnsw.iterative_scan"] = settings.hnsw_iterative_scan
+    return server_settings
 
 
 async def init_pool() -> asyncpg.Pool:
-    global pool
+    global pool, embedding_dim
+    # A plain connection first: register_vector in _init_connection fails until
+    # migrations have created the vector extension on a fresh database
+    conn = await asyncpg.connect(dsn=settings.dsn)
+    try:
+        await migrations.ensure_schema(conn)
+        embedding_dim = await migrations.column_dim(conn)
+    finally:
+        await conn.close()
     pool = await asyncpg.create_pool(
         dsn=settings.dsn,
         min_size=2,
         max_size=10,
         init=_init_connection,
+        server_settings=_server_settings(),
     )
-    async with pool.acquire() as conn:
-        await conn.execute(SCHEMA_SQL)
     return pool
 
 
@@ -63,3 +63,30 @@ async def get_pool() -> asyncpg.Pool:
     if pool is None:
         raise RuntimeError("Database pool not initialized")
     return pool
+
+
+@asynccontextmanager
+async def acquire():
+    """Check out a pool connection for request-path SQL.
+
+    The wait for a free connection is recorded as the pool_wait stage and the
+    time it is held as the query stage, so callers should do nothing but SQL
+    inside the block.
+    """
+    pool = await get_pool()
+    with metrics.stage("pool_wait"):
+        conn = await pool.acquire()
+    try:
+        with metrics.stage("query"):
+            yield conn
+    finally:
+        await pool.release(conn)
+
+
+def get_embedding_dim() -> int:
+    return embedding_dim
+
+
+def set_embedding_dim(dim: int) -> None:
+    global embedding_dim
+    embedding_dim = dim
@@ -0,0 +1,317 @@
+"""Embedding backends: where vectors actually come from.
+
+server.embeddings puts caching, request coalescing and dimension truncation in
+front of whichever backend HAMEM_EMBED_BACKEND selects:
+
+  ollama  — the Ollama HTTP API (default)
+  onnx    — an ONNX export of the model run in-process on CPU, skipping the
+            JSON/HTTP round trip per batch (needs the [onnx] extra)
+  hashing — deterministic feature hashing; no model or network, for tests and
+            benchmarks. Texts sharing words get similar vectors, nothing more.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBackend(ABC):
+    """Turns a batch of texts into L2-normalized float32 vectors."""
+
+    #: Short name reported by /health, e.g. "ollama"
+    name: str
+    #: Identity of the model producing the vectors. Stored with each row and
+    #: used in cache keys, so it must change whenever the vectors would.
+    model: str
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def embed(self, texts: list[str]) -> list[np.ndarray]:
+        ...
+
+    @abstractmethod
+    async def check_health(self) -> bool:
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+
+class OllamaEndpoint:
+    """One Ollama host, with its own connection pool, load and latency counters."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client: httpx.AsyncClient | None = None
+        self.in_flight = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def record(self, elapsed_ms: float) -> None:
+        self.requests += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def eject(self, seconds: float) -> None:
+        self.failures += 1
+        self.ejections += 1
+        self.ejected_until = time.monotonic() + seconds
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "ejected": not self.available(time.monotonic()),
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "avg_ms": round(self.total_ms / self.requests, 3) if self.requests else 0.0,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class OllamaBackend(EmbeddingBackend):
+    """Ollama HTTP API spread over one or more hosts.
+
+    Each request goes to the available host with the fewest calls in flight.
+    A host that errors or times out is ejected for eject_seconds and the
+    request is retried on the next one. If every host is ejected, the one due
+    back soonest is tried anyway rather than failing outright.
+    """
+
+    name = "ollama"
+
+    def __init__(self, urls: list[str], model: str, eject_seconds: float = 30.0):
+        if not urls:
+            raise ValueError("At least one Ollama URL is required")
+        self.endpoints = [OllamaEndpoint(url) for url in urls]
+        self.model = model
+        self.eject_seconds = eject_seconds
+
+    async def start(self) -> None:
+        for endpoint in self.endpoints:
+            endpoint.client = httpx.AsyncClient(base_url=endpoint.url, timeout=30.0)
+
+    async def close(self) -> None:
+        for endpoint in self.endpoints:
+            if endpoint.client:
+                await endpoint.client.aclose()
+                endpoint.client = None
+
+    def _pick(self, exclude: list[OllamaEndpoint]) -> OllamaEndpoint | None:
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if not candidates:
+            return None
+        available = [e for e in candidates if e.available(now)]
+        if not available:
+            return min(candidates, key=lambda e: e.ejected_until)
+        return min(available, key=lambda e: (e.in_flight, e.requests))
+
+    async def embed(self, texts: list[str]) -> list[np.ndarray]:
+        tried: list[OllamaEndpoint] = []
+        while (endpoint := self._pick(tried)) is not None:
+            tried.append(endpoint)
+            endpoint.in_flight += 1
+            started = time.perf_counter()
+            try:
+                resp = await endpoint.client.post(
+                    "/api/embed",
+                    json={"model": self.model, "input": texts},
+                )
+                resp.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                # A 4xx is about the request (e.g. unknown model), not the host
+                if e.response.status_code < 500:
+                    raise
+                error = e
+            except httpx.HTTPError as e:
+                error = e
+            else:
+                endpoint.record((time.perf_counter() - started) * 1000)
+                data = resp.json()
+                return [np.array(v, dtype=np.float32) for v in data["embeddings"]]
+            finally:
+                endpoint.in_flight -= 1
+            endpoint.eject(self.eject_seconds)
+            logger.warning("Ejecting Ollama host %s for %.0fs: %r", endpoint.url, self.eject_seconds, error)
+        raise error
+
+    async def _probe(self, endpoint: OllamaEndpoint) -> bool:
+        try:
+            resp = await endpoint.client.post(
+                "/api/embed",
+                json={"model": self.model, "input": "health check"},
+                timeout=10.0,
+            )
+            return resp.status_code == 200
+        except Exception:
+            return False
+
+    async def check_health(self) -> bool:
+        """Check that at least one Ollama host is reachable and has the model.
+
+        Hosts that pass the probe are let back in before their ejection expires.
+        """
+        if any(e.client is None for e in self.endpoints):
+            return False
+        results = await asyncio.gather(*(self._probe(e) for e in self.endpoints))
+        for endpoint, ok in zip(self.endpoints, results):
+            if ok:
+                endpoint.ejected_until = 0.0
+        return any(results)
+
+    def stats(self) -> dict:
+        return {"endpoints": {e.url: e.stats() for e in self.endpoints}}
+
+
+def onnx_model_id(model_path: str, tokenizer_path: str) -> str:
+    """Model identity for an ONNX export: its file name plus a digest of the model
+    and tokenizer contents, so two different exports named model.onnx never share
+    cached or stored embeddings."""
+    digest = hashlib.sha256()
+    for path in (model_path, tokenizer_path):
+        with open(path, "rb") as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+    return f"onnx:{Path(model_path).name}:{digest.hexdigest()[:16]}"
+
+
+class OnnxBackend(EmbeddingBackend):
+    """Runs an ONNX sentence-embedding model with mean pooling on CPU.
+
+    Inference happens on a worker thread (onnxruntime releases the GIL), so the
+    event loop keeps serving requests while a batch is embedded.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, tokenizer_path: str, threads: int, max_tokens: int):
+        self.model_path = model_path
+        self.tokenizer_path = tokenizer_path
+        self.threads = threads
+        self.max_tokens = max_tokens
+        self.model = f"onnx:{Path(model_path).name}"
+        self._session = None
+        self._tokenizer = None
+        self._input_names: set[str] = set()
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def start(self) -> None:
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError(
+                "The onnx embedding backend needs onnxruntime and tokenizers "
+                "(pip install -e '.[onnx]')"
+            ) from e
+        if not self.model_path or not self.tokenizer_path:
+            raise RuntimeError("HAMEM_ONNX_MODEL_PATH and HAMEM_ONNX_TOKENIZER_PATH must be set")
+
+        self.model = await asyncio.to_thread(onnx_model_id, self.model_path, self.tokenizer_path)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        self._session = ort.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(self.tokenizer_path)
+        self._tokenizer.enable_truncation(max_length=self.max_tokens)
+        self._tokenizer.enable_padding()
+        # One batch at a time; onnxruntime parallelizes within it
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="onnx-embed")
+        logger.info("Loaded ONNX embedding model %s from %s", self.model, self.model_path)
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._session = None
+
+    def _run(self, texts: list[str]) -> list[np.ndarray]:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self._session.run(None, feeds)[0]
+
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.linalg.norm(pooled, axis=1, keepdims=True)
+        return list(pooled.astype(np.float32))
+
+    async def embed(self, texts: list[str]) -> list[np.ndarray]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, texts)
+
+    async def check_health(self) -> bool:
+        return self._session is not None
+
+
+class HashingBackend(EmbeddingBackend):
+    """Deterministic signed feature hashing over words and character trigrams."""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            padded = f" {word} "
+            features = [word] + [padded[i : i + 3] for i in range(len(padded) - 2)]
+            for feature in features:
+                h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                vec[h % self.dim] += 1.0 if h >> 63 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    async def embed(self, texts: list[str]) -> list[np.ndarray]:
+        return [self._embed_one(t) for t in texts]
+
+    async def check_health(self) -> bool:
+        return True
+
+
+def create_backend() -> EmbeddingBackend:
+    """Build the backend selected by HAMEM_EMBED_BACKEND."""
+    if settings.embed_backend == "ollama":
+        urls = [url.strip() for url in settings.ollama_url.split(",") if url.strip()]
+        return OllamaBackend(urls, settings.embed_model, settings.ollama_eject_seconds)
+    if settings.embed_backend == "onnx":
+        return OnnxBackend(
+            settings.onnx_model_path,
+            settings.onnx_tokenizer_path,
+            settings.onnx_threads,
+            settings.onnx_max_tokens,
+        )
+    if settings.embed_backend == "hashing":
+        return HashingBackend(max(768, settings.embed_dim))
+    raise ValueError(f"Unknown embedding backend: {settings.embed_backend!r}")
@@ -1,61 +1,331 @@
-import httpx
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from pathlib import Path
+
 import numpy as np
 
 from server.config import settings
+from server.embedding_backends import EmbeddingBackend, create_backend
+
+logger = logging.getLogger(__name__)
+
+_backend: EmbeddingBackend | None = None
+
+
+def _normalize(text: str) -> str:
+    """Normalize text for cache lookups.
+
+    Collapses whitespace and lowercases. nomic-embed-text uses an uncased
+    tokenizer, so "Where do I park" and "where do I  park" embed identically.
+    """
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """Size-bounded LRU cache with a TTL, keyed by (embed_model, normalized text)."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], tuple[float, np.ndarray]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, model: str, text: str) -> np.ndarray | None:
+        key = (model, _normalize(text))
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, vec = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vec
+
+    def put(self, model: str, text: str, vec: np.ndarray, expires_at: float | None = None) -> None:
+        if self.max_size <= 0:
+            return
+        key = (model, _normalize(text))
+        # Cached vectors are shared between callers, so make them read-only
+        vec.flags.writeable = False
+        self._entries[key] = (expires_at or time.time() + self.ttl, vec)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def save(self, path: str | Path) -> int:
+        """Write unexpired entries to an .npz file. Returns the number saved."""
+        now = time.time()
+        live = [(k, e) for k, e in self._entries.items() if e[0] > now]
+        if not live:
+            return 0
+        np.savez(
+            path,
+            models=np.array([k[0] for k, _ in live]),
+            texts=np.array([k[1] for k, _ in live]),
+            expires_at=np.array([e[0] for _, e in live], dtype=np.float64),
+            vectors=np.stack([e[1] for _, e in live]).astype(np.float32),
+        )
+        return len(live)
+
+    def load(self, path: str | Path) -> int:
+        """Load entries saved by save(), skipping expired ones. Returns the number loaded."""
+        now = time.time()
+        loaded = 0
+        with np.load(path, allow_pickle=False) as data:
+            for model, text, expires_at, vec in zip(
+                data["models"], data["texts"], data["expires_at"], data["vectors"]
+            ):
+                if expires_at > now:
+                    self.put(str(model), str(text), vec.copy(), float(expires_at))
+                    loaded += 1
+        return loaded
+
+
+class EmbedBatcher:
+    """Coalesces concurrent embed() calls into batched /api/embed requests.
+
+    The first caller opens a window; every text submitted before it closes (or
+    before max_size distinct texts are queued) goes out in one request. Identical
+    texts in the same window share a single slot in the batch.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending: dict[str, tuple[str, asyncio.Future]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.texts = 0
+        self.deduplicated = 0
+
+    async def submit(self, text: str) -> np.ndarray:
+        key = _normalize(text)
+        entry = self._pending.get(key)
+        if entry is not None:
+            self.deduplicated += 1
+            fut = entry[1]
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[key] = (text, fut)
+            if len(self._pending) >= self.max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        # Shield so one cancelled caller doesn't fail everyone sharing the slot
+        return await asyncio.shield(fut)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = list(self._pending.values())
+        self._pending = {}
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.texts += len(batch)
+        try:
+            vectors = await _request_embeddings([text for text, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+                    # Mark retrieved in case every caller was cancelled
+                    fut.exception()
+            return
+        for (_, fut), vec in zip(batch, vectors):
+            if not fut.done():
+                fut.set_result(vec)
 
-_client: httpx.AsyncClient | None = None
+    async def drain(self) -> None:
+        """Send anything still queued and wait for in-flight batches."""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "deduplicated": self.deduplicated,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+_cache = EmbeddingCache(settings.embed_cache_size, settings.embed_cache_ttl)
+_batcher: EmbedBatcher | None = None
+# Dimension embed() returns; trails settings.embed_dim while a re-index is running
+_output_dim = settings.embed_dim
+
+
+def set_output_dim(dim: int) -> None:
+    global _output_dim
+    _output_dim = dim
+
+
+def _truncate(vec: np.ndarray, dim: int) -> np.ndarray:
+    """Matryoshka truncation: keep the first dim components and re-normalize.
+
+    The cache holds full model output, so the same entry serves any dimension.
+    """
+    if len(vec) == dim:
+        return vec
+    if len(vec) < dim:
+        raise ValueError(f"{model_id()} returns {len(vec)} dims, fewer than {dim}")
+    head = vec[:dim]
+    return head / np.linalg.norm(head)
+
+
+def _cache_file() -> Path | None:
+    if not settings.embed_cache_path:
+        return None
+    path = Path(settings.embed_cache_path)
+    # np.savez appends .npz when missing; normalize so load finds the same file
+    return path if path.suffix == ".npz" else path.with_suffix(".npz")
+
+
+def model_id() -> str:
+    """Identity of the active embedding model, stored alongside each row."""
+    return _backend.model if _backend is not None else settings.embed_model
+
+
+def backend_name() -> str:
+    return _backend.name if _backend is not None else settings.embed_backend
 
 
 async def init_client() -> None:
-    global _client
-    _client = httpx.AsyncClient(base_url=settings.ollama_url, timeout=30.0)
+    global _backend, _cache, _batcher
+    _backend = create_backend()
+    await _backend.start()
+    _cache = EmbeddingCache(settings.embed_cache_size, settings.embed_cache_ttl)
+    _batcher = None
+    if settings.embed_batch_window_ms > 0:
+        _batcher = EmbedBatcher(settings.embed_batch_window_ms / 1000, settings.embed_batch_max_size)
+    path = _cache_file()
+    if path and path.exists():
+        try:
+            count = _cache.load(path)
+            logger.info("Loaded %d cached embeddings from %s", count, path)
+        except Exception:
+            logger.exception("Failed to load embedding cache from %s", path)
 
 
 async def close_client() -> None:
-    global _client
-    if _client:
-        await _client.aclose()
-        _client = None
+    global _backend, _batcher
+    if _batcher is not None:
+        await _batcher.drain()
+        _batcher = None
+    path = _cache_file()
+    if path:
+        try:
+            count = _cache.save(path)
+            logger.info("Saved %d cached embeddings to %s", count, path)
+        except Exception:
+            logger.exception("Failed to save embedding cache to %s", path)
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+def stats() -> dict:
+    """Counters for the embedding cache, request batcher and backend."""
+    return {
+        "cache": _cache.stats(),
+        "batcher": _batcher.stats() if _batcher is not None else None,
+        "backend": _backend.stats() if _backend is not None else None,
+    }
+
+
+async def _request_embeddings(texts: list[str]) -> list[np.ndarray]:
+    vectors = await _backend.embed(texts)
+    # Results are matched to texts by position, so a short response can't be used
+    if len(vectors) != len(texts):
+        raise RuntimeError(f"Embedding backend returned {len(vectors)} vectors for {len(texts)} texts")
+    return vectors
 
 
 async def embed(text: str) -> np.ndarray:
-    """Get embedding vector for a text string. Returns 768-dim numpy array."""
-    if _client is None:
+    """Get embedding vector for a text string, truncated to the stored dimension."""
+    if _backend is None:
         raise RuntimeError("Embedding client not initialized")
     if not text or not text.strip():
         raise ValueError("Cannot embed empty text")
-    resp = await _client.post(
-        "/api/embed",
-        json={"model": settings.embed_model, "input": text},
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return np.array(data["embeddings"][0], dtype=np.float32)
-
-
-async def embed_batch(texts: list[str]) -> list[np.ndarray]:
-    """Get embeddings for multiple texts in a single request."""
-    if _client is None:
+    model = _backend.model
+    vec = _cache.get(model, text)
+    if vec is None:
+        if _batcher is not None:
+            vec = await _batcher.submit(text)
+        else:
+            vec = (await _request_embeddings([text]))[0]
+        _cache.put(model, text, vec)
+    return _truncate(vec, _output_dim)
+
+
+async def embed_batch(
+    texts: list[str], cache: bool = True, dim: int | None = None
+) -> list[np.ndarray]:
+    """Get embeddings for multiple texts in a single request.
+
+    Only texts missing from the cache are sent to Ollama, each at most once.
+    Pass cache=False for bulk loads so they don't evict hot query embeddings.
+    dim overrides the output dimension (used by the re-index job).
+    """
+    if _backend is None:
         raise RuntimeError("Embedding client not initialized")
-    resp = await _client.post(
-        "/api/embed",
-        json={"model": settings.embed_model, "input": texts},
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return [np.array(v, dtype=np.float32) for v in data["embeddings"]]
+    model = _backend.model
+    results: list[np.ndarray | None] = [_cache.get(model, t) for t in texts]
+    missing: dict[str, list[int]] = {}
+    for i, (text, vec) in enumerate(zip(texts, results)):
+        if vec is None:
+            missing.setdefault(_normalize(text), []).append(i)
+    if missing:
+        first = [texts[idxs[0]] for idxs in missing.values()]
+        vectors = await _request_embeddings(first)
+        for text, idxs, vec in zip(first, missing.values(), vectors):
+            if cache:
+                _cache.put(model, text, vec)
+            for i in idxs:
+                results[i] = vec
+    dim = dim or _output_dim
+    return [_truncate(vec, dim) for vec in results]
 
 
 async def check_health() -> bool:
-    """Check if Ollama is reachable and the model is available."""
-    if _client is None:
-        return False
-    try:
-        resp = await _client.post(
-            "/api/embed",
-            json={"model": settings.embed_model, "input": "health check"},
-            timeout=10.0,
-        )
-        return resp.status_code == 200
-    except Exception:
+    """Check if the embedding backend is ready to serve requests."""
+    if _backend is None:
         return False
+    return await _backend.check_health()
@@ -1,13 +1,25 @@
 import logging
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
 from server.auth import BearerTokenMiddleware
 from server.config import settings
 from server.db import close_pool, init_pool
 from server.embeddings import close_client, init_client
-from server.routers import escalation, health, memory
+from server.metrics import MetricsMiddleware
+from server.routers import admin, escalation, health, memory, metrics
+from server.services import (
+    admission,
+    consolidate_service,
+    embed_worker,
+    quota_service,
+    reaper_service,
+    reindex_service,
+    search_planner,
+    touch_service,
+)
 
 logging.basicConfig(
     level=getattr(logging, settings.log_level.upper()),
@@ -25,9 +37,23 @@ async def lifespan(app: FastAPI):
         logger.info("API token authentication DISABLED (set HAMEM_API_TOKEN to enable)")
     await init_pool()
     await init_client()
+    await touch_service.start()
+    await search_planner.start()
+    await embed_worker.start()
+    await reaper_service.start()
+    await quota_service.start()
+    await consolidate_service.start()
+    await reindex_service.start()
     logger.info("Database pool and embedding client ready")
     yield
     logger.info("Shutting down")
+    await reindex_service.stop()
+    await consolidate_service.stop()
+    await quota_service.stop()
+    await reaper_service.stop()
+    await embed_worker.stop()
+    await search_planner.stop()
+    await touch_service.stop()
     await close_client()
     await close_pool()
 
@@ -39,9 +65,24 @@ app = FastAPI(
 )
 
 app.add_middleware(BearerTokenMiddleware)
+# Added last so it is outermost and also counts requests rejected by auth
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(admission.Overloaded)
+async def overloaded_handler(request: Request, exc: admission.Overloaded):
+    logger.warning("Shedding %s %s: %s", request.method, request.url.path, exc.detail)
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 app.include_router(memory.router)
 app.include_router(health.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
 app.include_router(escalation.router)
 
 
@@ -0,0 +1,178 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Kept deliberately small: counters and histograms are plain dicts keyed by
+label values, updated without locks (everything runs on the event loop), and
+only turned into text when /metrics is scraped. Observing a value is a dict
+lookup and a bisect, cheap enough to leave on in production.
+
+Per-request stage timings (embed, pool_wait, query, serialize) go into one
+histogram labelled by stage. MetricsMiddleware counts every HTTP request by
+endpoint, status and a hashed user_id bucket, keeping label cardinality bounded
+no matter how many users there are.
+"""
+
+import time
+import zlib
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import Response
+from pydantic import BaseModel
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+USER_BUCKETS = 16
+
+# Every Counter and Histogram registers itself here for render()
+REGISTRY: list = []
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple[str, ...], list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_labels((*self.labels, 'le'), (*values, le))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+stage_seconds = Histogram("hamem_stage_seconds", "Time spent per request stage", ("stage",))
+request_seconds = Histogram("hamem_request_seconds", "HTTP request duration", ("endpoint",))
+requests_total = Counter(
+    "hamem_requests_total",
+    "HTTP requests by endpoint, status and user_id bucket",
+    ("endpoint", "status", "user_bucket"),
+)
+
+# Filled in by the route handling the request; a dict so the update is visible
+# to MetricsMiddleware even when an inner middleware runs the route in another task
+_request_labels: ContextVar[dict | None] = ContextVar("hamem_request_labels", default=None)
+
+
+def user_bucket(user_id: str) -> str:
+    return f"{zlib.crc32(user_id.encode()) % USER_BUCKETS:02d}"
+
+
+def set_user(user_id: str) -> None:
+    """Attribute the current request to user_id's bucket."""
+    labels = _request_labels.get()
+    if labels is not None:
+        labels["user_bucket"] = user_bucket(user_id)
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, name)
+
+
+def serialize(model: BaseModel) -> Response:
+    """Render a response model to JSON, timed as the serialize stage."""
+    with stage("serialize"):
+        body = model.model_dump_json()
+    return Response(body, media_type="application/json")
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels: dict = {}
+        token = _request_labels.set(labels)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_labels.reset(token)
+            # The router stores the matched route in scope; unmatched paths share one label
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "other")
+            request_seconds.observe(time.perf_counter() - started, endpoint)
+            requests_total.inc(endpoint, str(status), labels.get("user_bucket", "none"))
+
+
+def _gauge(name: str, help: str, value: float) -> list[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+def render(pool=None) -> str:
+    """All metrics in Prometheus text format, plus pool gauges if a pool is given."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    if pool is not None:
+        size = pool.get_size()
+        lines.extend(_gauge("hamem_pool_size", "Open database connections", size))
+        lines.extend(_gauge("hamem_pool_max_size", "Maximum database connections", pool.get_max_size()))
+        lines.extend(_gauge("hamem_pool_in_use", "Database connections checked out", size - pool.get_idle_size()))
+    return "\n".join(lines) + "\n"
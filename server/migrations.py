@@ -0,0 +1,382 @@
+"""Versioned schema migrations.
+
+The schema is built by an ordered list of migrations, each recorded in the
+schema_version table once applied. Every step is idempotent (IF NOT EXISTS),
+so a run interrupted halfway is simply repeated. Indexes are built with
+CREATE INDEX CONCURRENTLY, which doesn't block writes on a live table.
+
+After the versioned steps, the embedding column and ANN index are brought in
+line with HAMEM_VECTOR_STORAGE and the HNSW build parameters. Each ANN index
+carries its definition as a COMMENT, so a parameter change is noticed and the
+index rebuilt concurrently under a temporary name, then swapped in.
+
+Run ahead of a deploy with:
+
+    python -m server.migrations          # apply pending migrations
+    python -m server.migrations status   # show what would be applied
+
+At startup the service only checks that the schema is current (see
+HAMEM_AUTO_MIGRATE).
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import NamedTuple
+
+import asyncpg
+
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Key for pg_advisory_lock so concurrent runners (e.g. two replicas starting
+# with auto_migrate) apply migrations one at a time
+_LOCK_KEY = 0x68616D656D
+
+
+class Index(NamedTuple):
+    """An index built CONCURRENTLY, outside any transaction."""
+
+    name: str
+    #: Everything after ON, e.g. "memories (key)"
+    definition: str
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    #: SQL strings and Index entries, run in order. SQL may use {embed_dim} and
+    #: {embed_model} (a quoted literal).
+    steps: tuple
+
+
+MIGRATIONS = (
+    Migration(1, "extensions", (
+        "CREATE EXTENSION IF NOT EXISTS vector",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    )),
+    Migration(2, "memories table", (
+        """
+        CREATE TABLE IF NOT EXISTS memories (
+            id              BIGSERIAL PRIMARY KEY,
+            key             TEXT NOT NULL,
+            value           TEXT NOT NULL,
+            scope           TEXT NOT NULL DEFAULT 'user',
+            user_id         TEXT NOT NULL DEFAULT 'default',
+            tags            TEXT NOT NULL DEFAULT '',
+            tags_search     TEXT NOT NULL DEFAULT '',
+            embedding       vector({embed_dim}),
+            search_text     TEXT NOT NULL DEFAULT '',
+            created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_used_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            expires_at      TIMESTAMPTZ,
+            content_hash    TEXT NOT NULL DEFAULT '',
+            embed_model     TEXT NOT NULL DEFAULT '',
+            UNIQUE (key, user_id)
+        )
+        """,
+        # Tables created before these columns existed
+        "ALTER TABLE memories ADD COLUMN IF NOT EXISTS content_hash TEXT NOT NULL DEFAULT ''",
+        "ALTER TABLE memories ADD COLUMN IF NOT EXISTS embed_model TEXT NOT NULL DEFAULT ''",
+    )),
+    Migration(3, "memories indexes", (
+        Index("idx_memories_key", "memories (key)"),
+        Index("idx_memories_scope", "memories (scope)"),
+        Index("idx_memories_user_id", "memories (user_id)"),
+        Index("idx_memories_search_text_trgm", "memories USING gin (search_text gin_trgm_ops)"),
+        Index("idx_memories_expires_at", "memories (expires_at) WHERE expires_at IS NOT NULL"),
+        Index("idx_memories_user_last_used", "memories (user_id, last_used_at)"),
+    )),
+    # Rows evicted by quota_service when HAMEM_QUOTA_ARCHIVE is set. No embedding:
+    # archived rows are never searched, and one can be recomputed on restore.
+    Migration(4, "memories archive", (
+        """
+        CREATE TABLE IF NOT EXISTS memories_archive (
+            id              BIGINT PRIMARY KEY,
+            key             TEXT NOT NULL,
+            value           TEXT NOT NULL,
+            scope           TEXT NOT NULL,
+            user_id         TEXT NOT NULL,
+            tags            TEXT NOT NULL,
+            created_at      TIMESTAMPTZ NOT NULL,
+            last_used_at    TIMESTAMPTZ NOT NULL,
+            expires_at      TIMESTAMPTZ,
+            archived_at     TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        Index("idx_memories_archive_user_key", "memories_archive (user_id, key)"),
+    )),
+    # Rows written by write-behind /memory/set wait here for embed_worker
+    Migration(5, "pending embeddings index", (
+        Index("idx_memories_pending_embedding", "memories (id) WHERE embedding IS NULL"),
+    )),
+    # Rows embedded before content_hash/embed_model were tracked were left with
+    # '' in both, so unchanged writes and imports re-embedded them. They came
+    # from the configured Ollama model; content_hash matches _content_hash().
+    Migration(6, "backfill embed_model and content_hash", (
+        """
+        UPDATE memories
+        SET embed_model = {embed_model},
+            content_hash = encode(sha256(convert_to(search_text, 'UTF8')), 'hex')
+        WHERE embedding IS NOT NULL AND embed_model = ''
+        """,
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+_SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version     INT PRIMARY KEY,
+    name        TEXT NOT NULL,
+    applied_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+# Embedding column type and ANN index per HAMEM_VECTOR_STORAGE mode:
+#   vector  — float32 column, HNSW on the full vectors (default)
+#   halfvec — float16 column, HNSW on the half-precision vectors (half the size)
+#   binary  — float32 column, HNSW on binary_quantize(embedding) only (1 bit per
+#             dimension); search takes coarse Hamming candidates from it and
+#             re-ranks them by exact cosine distance on the stored vectors
+VECTOR_STORAGE = {
+    "vector": (
+        "vector({dim})",
+        "idx_memories_embedding_hnsw",
+        "USING hnsw ({column} vector_cosine_ops) WITH (m={m}, ef_construction={ef_construction})",
+    ),
+    "halfvec": (
+        "halfvec({dim})",
+        "idx_memories_embedding_hnsw",
+        "USING hnsw ({column} halfvec_cosine_ops) WITH (m={m}, ef_construction={ef_construction})",
+    ),
+    "binary": (
+        "vector({dim})",
+        "idx_memories_embedding_bq",
+        "USING hnsw ((binary_quantize({column})::bit({dim})) bit_hamming_ops) "
+        "WITH (m={m}, ef_construction={ef_construction})",
+    ),
+}
+EMBEDDING_INDEXES = ("idx_memories_embedding_hnsw", "idx_memories_embedding_bq")
+# What the ANN index was built with before definitions were recorded
+_UNRECORDED_HNSW = {"m": 16, "ef_construction": 64}
+
+
+def storage_spec(
+    mode: str,
+    dim: int,
+    column: str = "embedding",
+    m: int | None = None,
+    ef_construction: int | None = None,
+) -> tuple[str, str, str]:
+    """Column type, index name and index definition for a storage mode and dimension.
+
+    The HNSW parameters default to HAMEM_HNSW_M and HAMEM_HNSW_EF_CONSTRUCTION.
+    """
+    if mode not in VECTOR_STORAGE:
+        raise ValueError(f"Unknown vector storage mode: {mode!r}")
+    column_type, index_name, index_def = VECTOR_STORAGE[mode]
+    index_def = index_def.format(
+        dim=dim,
+        column=column,
+        m=settings.hnsw_m if m is None else m,
+        ef_construction=settings.hnsw_ef_construction if ef_construction is None else ef_construction,
+    )
+    return column_type.format(dim=dim), index_name, index_def
+
+
+async def column_dim(conn: asyncpg.Connection, column: str = "embedding") -> int | None:
+    """Declared dimension of a vector/halfvec column on memories, or None if absent."""
+    typmod = await conn.fetchval(
+        """
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'memories'::regclass AND attname = $1 AND NOT attisdropped
+        """,
+        column,
+    )
+    return typmod if typmod is None or typmod > 0 else None
+
+
+async def _column_type(conn: asyncpg.Connection) -> str | None:
+    return await conn.fetchval(
+        """
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'memories'::regclass AND attname = 'embedding' AND NOT attisdropped
+        """
+    )
+
+
+async def _index_definition(conn: asyncpg.Connection, name: str) -> str | None:
+    """The definition recorded on a valid index, or None if there is no such index."""
+    row = await conn.fetchrow(
+        """
+        SELECT i.indisvalid AS valid, obj_description(i.indexrelid, 'pg_class') AS definition
+        FROM pg_index i WHERE i.indexrelid = to_regclass($1)
+        """,
+        name,
+    )
+    if row is None or not row["valid"]:
+        return None
+    if row["definition"] is None:
+        # Built by an older release, which always used the same parameters
+        mode = next(m for m, spec in VECTOR_STORAGE.items() if spec[1] == name)
+        return storage_spec(mode, await column_dim(conn), **_UNRECORDED_HNSW)[2]
+    return row["definition"]
+
+
+async def record_index_definition(conn: asyncpg.Connection, name: str, definition: str) -> None:
+    """Store an ANN index's definition on it, for later comparison with settings."""
+    literal = await conn.fetchval("SELECT quote_literal($1)", definition)
+    await conn.execute(f"COMMENT ON INDEX {name} IS {literal}")
+
+
+async def build_index(conn: asyncpg.Connection, name: str, definition: str) -> None:
+    """CREATE INDEX CONCURRENTLY, first dropping an invalid leftover of an interrupted build."""
+    valid = await conn.fetchval("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name)
+    if valid is False:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    if not await conn.fetchval("SELECT to_regclass('schema_version') IS NOT NULL"):
+        return 0
+    return await conn.fetchval("SELECT COALESCE(max(version), 0) FROM schema_version")
+
+
+async def _storage_problems(conn: asyncpg.Connection, mode: str) -> list[str]:
+    column_type, index_name, index_def = storage_spec(mode, await column_dim(conn))
+    problems = []
+    if await _column_type(conn) != column_type:
+        problems.append(f"embedding column is not {column_type}")
+    if await _index_definition(conn, index_name) != index_def:
+        problems.append(f"{index_name} is not {index_def}")
+    for name in EMBEDDING_INDEXES:
+        if name != index_name and await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+            problems.append(f"{name} is left over from another storage mode")
+    return problems
+
+
+async def pending(conn: asyncpg.Connection) -> list[str]:
+    """What upgrade() would do, one line per change. Empty if the schema is current."""
+    version = await current_version(conn)
+    steps = [f"{m.version}: {m.name}" for m in MIGRATIONS if m.version > version]
+    if steps:
+        # Storage can only be compared once the table exists in its final shape
+        return steps + ["vector storage"]
+    return await _storage_problems(conn, settings.vector_storage)
+
+
+async def apply_vector_storage(conn: asyncpg.Connection, mode: str) -> None:
+    """Bring the embedding column and ANN index in line with a storage mode.
+
+    Converting the column type rewrites every row in place (pgvector casts
+    between vector and halfvec), so switching modes migrates existing data.
+    A changed index definition is built CONCURRENTLY next to the old index and
+    swapped in. The dimension is left as it is; changing it is reindex_service's job.
+    """
+    column_type, index_name, index_def = storage_spec(mode, await column_dim(conn))
+    if await _column_type(conn) != column_type:
+        async with conn.transaction():
+            # An index built for the old type can't survive the conversion
+            for name in EMBEDDING_INDEXES:
+                await conn.execute(f"DROP INDEX IF EXISTS {name}")
+            await conn.execute(
+                f"ALTER TABLE memories ALTER COLUMN embedding TYPE {column_type} "
+                f"USING embedding::{column_type}"
+            )
+
+    if await _index_definition(conn, index_name) != index_def:
+        staging = f"{index_name}_new"
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {staging}")
+        logger.info("Building %s %s", index_name, index_def)
+        await build_index(conn, staging, f"memories {index_def}")
+        async with conn.transaction():
+            await conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+            await conn.execute(f"ALTER INDEX {staging} RENAME TO {index_name}")
+            await record_index_definition(conn, index_name, index_def)
+    for name in EMBEDDING_INDEXES:
+        if name != index_name:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def render_step(step: str) -> str:
+    """Fill in the settings a migration's SQL step may refer to."""
+    embed_model = "'" + settings.embed_model.replace("'", "''") + "'"
+    return step.format(embed_dim=settings.embed_dim, embed_model=embed_model)
+
+
+async def upgrade(conn: asyncpg.Connection) -> list[int]:
+    """Apply pending migrations and vector storage changes. Returns the versions applied."""
+    applied = []
+    await conn.execute("SELECT pg_advisory_lock($1)", _LOCK_KEY)
+    try:
+        await conn.execute(_SCHEMA_VERSION_SQL)
+        version = await current_version(conn)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            logger.info("Applying migration %d: %s", migration.version, migration.name)
+            for step in migration.steps:
+                if isinstance(step, Index):
+                    await build_index(conn, step.name, step.definition)
+                else:
+                    await conn.execute(render_step(step))
+            await conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES ($1, $2)",
+                migration.version,
+                migration.name,
+            )
+            applied.append(migration.version)
+        await apply_vector_storage(conn, settings.vector_storage)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_KEY)
+    return applied
+
+
+async def ensure_schema(conn: asyncpg.Connection) -> None:
+    """Startup check: migrate if allowed and needed, else fail on an outdated schema."""
+    version = await current_version(conn)
+    if version > LATEST_VERSION:
+        logger.warning(
+            "Database schema version %d is newer than this release (%d)", version, LATEST_VERSION
+        )
+    todo = await pending(conn)
+    if not todo:
+        return
+    if not settings.auto_migrate:
+        raise RuntimeError(
+            "Database schema is out of date (" + "; ".join(todo) + "). "
+            "Run `python -m server.migrations` or set HAMEM_AUTO_MIGRATE=true."
+        )
+    logger.info("Migrating database schema: %s", "; ".join(todo))
+    await upgrade(conn)
+
+
+async def _main(command: str) -> int:
+    conn = await asyncpg.connect(dsn=settings.dsn)
+    try:
+        if command == "status":
+            print(f"Schema version {await current_version(conn)} (latest {LATEST_VERSION})")
+            todo = await pending(conn)
+            for line in todo:
+                print(f"  pending: {line}")
+            return 1 if todo else 0
+        applied = await upgrade(conn)
+        print(f"Applied migrations: {applied}" if applied else "No migrations pending")
+        return 0
+    finally:
+        await conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply ha-semantic-memory schema migrations")
+    parser.add_argument("command", nargs="?", choices=("upgrade", "status"), default="upgrade")
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, settings.log_level.upper()), format="%(message)s")
+    raise SystemExit(asyncio.run(_main(args.command)))
+
+
+if __name__ == "__main__":
+    main()
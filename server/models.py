@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 
 
 # --- Request models (match original Pyscript tool interface) ---
@@ -12,6 +12,8 @@ class MemorySetRequest(BaseModel):
     tags_search: str = ""
     expiration_days: int = 180
     force_new: bool = False
+    # Store now and embed in the background; None follows HAMEM_WRITE_BEHIND
+    write_behind: bool | None = None
 
     @field_validator("tags", mode="before")
     @classmethod
@@ -21,6 +23,10 @@ class MemorySetRequest(BaseModel):
         return v
 
 
+class MemorySetBatchRequest(BaseModel):
+    items: list[MemorySetRequest]
+
+
 class MemoryGetRequest(BaseModel):
     key: str
     user_id: str = "default"
@@ -31,6 +37,7 @@ class MemorySearchRequest(BaseModel):
     scope: str = "user"
     user_id: str = "default"
     limit: int = 5
+    budget_ms: float | None = None
 
     @field_validator("query", mode="before")
     @classmethod
@@ -40,11 +47,50 @@ class MemorySearchRequest(BaseModel):
         return v
 
 
+class MemorySearchBatchRequest(BaseModel):
+    queries: list[str]
+    scope: str = "user"
+    user_id: str = "default"
+    limit: int = 5
+    budget_ms: float | None = None
+
+    @field_validator("queries")
+    @classmethod
+    def queries_not_empty(cls, v):
+        if not v:
+            raise ValueError("queries must not be empty")
+        if any(not q.strip() for q in v):
+            raise ValueError("queries must not contain empty strings")
+        return v
+
+
 class MemoryForgetRequest(BaseModel):
     key: str
     user_id: str = "default"
 
 
+class RecallTarget(BaseModel):
+    user_id: str = "default"
+    scope: str = "user"
+    limit: int = 5
+    weight: float = 1.0
+
+
+class MemoryRecallRequest(BaseModel):
+    query: str
+    # Each target adds a UNION ALL branch and five bind parameters
+    targets: list[RecallTarget] = Field(min_length=1, max_length=16)
+    limit: int | None = None
+    budget_ms: float | None = None
+
+    @field_validator("query", mode="before")
+    @classmethod
+    def query_not_empty(cls, v):
+        if isinstance(v, str) and not v.strip():
+            raise ValueError("query must not be empty")
+        return v
+
+
 # --- Response models ---
 
 class MemoryItem(BaseModel):
@@ -62,6 +108,18 @@ class MemorySetResponse(BaseModel):
     key: str
 
 
+class MemorySetBatchItem(BaseModel):
+    key: str
+    user_id: str = "default"
+    status: str
+    detail: str | None = None
+
+
+class MemorySetBatchResponse(BaseModel):
+    status: str
+    results: list[MemorySetBatchItem]
+
+
 class MemoryGetResponse(BaseModel):
     status: str
     memory: MemoryItem | None = None
@@ -70,8 +128,34 @@ class MemoryGetResponse(BaseModel):
 class MemorySearchResponse(BaseModel):
     status: str
     results: list[MemoryItem]
+    degraded: bool = False
+
+
+class MemoryRecallResponse(BaseModel):
+    status: str
+    results: list[MemoryItem]
+    degraded: bool = False
+
+
+class MemorySearchBatchResult(BaseModel):
+    query: str
+    results: list[MemoryItem]
+
+
+class MemorySearchBatchResponse(BaseModel):
+    status: str
+    results: list[MemorySearchBatchResult]
+    degraded: bool = False
 
 
 class MemoryForgetResponse(BaseModel):
     status: str
     key: str
+
+
+class MemoryImportResponse(BaseModel):
+    status: str
+    imported: int
+    reembedded: int
+    skipped: int
+    errors: list[str] = []
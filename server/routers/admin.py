@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+
+from server.services import slow_search
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/slow_searches")
+async def slow_searches():
+    """EXPLAIN (ANALYZE, BUFFERS) captures of recent slow searches, newest first."""
+    return {"status": "ok", **slow_search.stats(), "entries": slow_search.entries()}
+
+
+@router.delete("/slow_searches")
+async def clear_slow_searches():
+    slow_search.clear()
+    return {"status": "ok"}
@@ -1,14 +1,28 @@
 from fastapi import APIRouter
 
 from server.db import get_pool
-from server.embeddings import check_health as check_ollama
+from server.embeddings import backend_name
+from server.embeddings import check_health as check_embeddings
+from server.embeddings import stats as embedding_stats
+from server.services import (
+    admission,
+    consolidate_service,
+    embed_worker,
+    quota_service,
+    reaper_service,
+    reindex_service,
+    search_planner,
+)
+from server.services.memory_cache import cache as memory_cache
+from server.services.memory_service import search_stats
 
 router = APIRouter(tags=["health"])
 
 
 @router.get("/health")
 async def health():
-    checks = {"postgres": False, "ollama": False}
+    backend = backend_name()
+    checks = {"postgres": False, backend: False}
 
     try:
         pool = await get_pool()
@@ -18,7 +32,20 @@ async def health():
     except Exception:
         pass
 
-    checks["ollama"] = await check_ollama()
+    checks[backend] = await check_embeddings()
 
     ok = all(checks.values())
-    return {"status": "ok" if ok else "degraded", "checks": checks}
+    return {
+        "status": "ok" if ok else "degraded",
+        "checks": checks,
+        "embeddings": embedding_stats(),
+        "memory_cache": memory_cache.stats(),
+        "search": search_stats(),
+        "admission": admission.stats(),
+        "search_planner": search_planner.stats(),
+        "reindex": reindex_service.stats(),
+        "reaper": reaper_service.stats(),
+        "quota": quota_service.stats(),
+        "dedup": consolidate_service.stats(),
+        "embed_worker": embed_worker.stats(),
+    }
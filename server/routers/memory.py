@@ -1,22 +1,39 @@
 import logging
+from contextlib import AsyncExitStack
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
+from server import metrics
+from server.config import settings
 from server.models import (
     MemoryForgetRequest,
     MemoryForgetResponse,
     MemoryGetRequest,
     MemoryGetResponse,
+    MemoryImportResponse,
+    MemoryRecallRequest,
+    MemoryRecallResponse,
+    MemorySearchBatchRequest,
+    MemorySearchBatchResponse,
+    MemorySearchBatchResult,
     MemorySearchRequest,
     MemorySearchResponse,
+    MemorySetBatchRequest,
+    MemorySetBatchResponse,
     MemorySetRequest,
     MemorySetResponse,
 )
+from server.services import admission, transfer_service
 from server.services.memory_service import (
     memory_forget,
     memory_get,
+    memory_recall,
     memory_search,
+    memory_search_many,
     memory_set,
+    memory_set_many,
 )
 
 logger = logging.getLogger(__name__)
@@ -27,58 +44,180 @@ router = APIRouter(prefix="/memory", tags=["memory"])
 @router.post("/set", response_model=MemorySetResponse)
 async def set_memory(req: MemorySetRequest):
     logger.debug(f"SET key={req.key} user_id={req.user_id} scope={req.scope}")
-    try:
-        key = await memory_set(
-            key=req.key,
-            value=req.value,
-            scope=req.scope,
-            user_id=req.user_id,
-            tags=req.tags,
-            tags_search=req.tags_search,
-            expiration_days=req.expiration_days,
-        )
-        return MemorySetResponse(status="ok", key=key)
-    except Exception as e:
-        logger.exception("memory_set failed")
-        raise HTTPException(status_code=500, detail=str(e))
+    metrics.set_user(req.user_id)
+    async with admission.slot(admission.INTERACTIVE):
+        try:
+            key = await memory_set(
+                key=req.key,
+                value=req.value,
+                scope=req.scope,
+                user_id=req.user_id,
+                tags=req.tags,
+                tags_search=req.tags_search,
+                expiration_days=req.expiration_days,
+                write_behind=req.write_behind,
+                force_new=req.force_new,
+            )
+            # A near-duplicate of an existing memory is stored under that key
+            status = "ok" if key == req.key else "merged"
+            return metrics.serialize(MemorySetResponse(status=status, key=key))
+        except Exception as e:
+            logger.exception("memory_set failed")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/set_batch", response_model=MemorySetBatchResponse)
+async def set_memory_batch(req: MemorySetBatchRequest):
+    logger.debug(f"SET_BATCH items={len(req.items)}")
+    async with admission.slot(admission.BULK):
+        try:
+            results = await memory_set_many(req.items)
+        except Exception as e:
+            logger.exception("memory_set_many failed")
+            raise HTTPException(status_code=500, detail=str(e))
+    failed = sum(1 for r in results if r.status == "error")
+    if not failed:
+        status = "ok"
+    elif failed == len(results):
+        status = "error"
+    else:
+        status = "partial"
+    return metrics.serialize(MemorySetBatchResponse(status=status, results=results))
 
 
 @router.post("/get", response_model=MemoryGetResponse)
 async def get_memory(req: MemoryGetRequest):
     logger.debug(f"GET key={req.key} user_id={req.user_id}")
-    try:
-        item = await memory_get(req.key, user_id=req.user_id)
-        if item:
-            return MemoryGetResponse(status="ok", memory=item)
-        return MemoryGetResponse(status="not_found")
-    except Exception as e:
-        logger.exception("memory_get failed")
-        raise HTTPException(status_code=500, detail=str(e))
+    metrics.set_user(req.user_id)
+    async with admission.slot(admission.INTERACTIVE):
+        try:
+            item = await memory_get(req.key, user_id=req.user_id)
+            if item:
+                return metrics.serialize(MemoryGetResponse(status="ok", memory=item))
+            return metrics.serialize(MemoryGetResponse(status="not_found"))
+        except Exception as e:
+            logger.exception("memory_get failed")
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/search", response_model=MemorySearchResponse)
 async def search_memory(req: MemorySearchRequest):
     logger.debug(f"SEARCH query={req.query!r} user_id={req.user_id} scope={req.scope}")
-    try:
-        results = await memory_search(
-            query=req.query,
-            scope=req.scope,
-            user_id=req.user_id,
-            limit=req.limit,
-        )
-        return MemorySearchResponse(status="ok", results=results)
-    except Exception as e:
-        logger.exception("memory_search failed")
-        raise HTTPException(status_code=500, detail=str(e))
+    metrics.set_user(req.user_id)
+    async with admission.slot(admission.INTERACTIVE):
+        try:
+            results, degraded = await memory_search(
+                query=req.query,
+                scope=req.scope,
+                user_id=req.user_id,
+                limit=req.limit,
+                budget_ms=req.budget_ms,
+            )
+            return metrics.serialize(
+                MemorySearchResponse(status="ok", results=results, degraded=degraded)
+            )
+        except Exception as e:
+            logger.exception("memory_search failed")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/search_batch", response_model=MemorySearchBatchResponse)
+async def search_memory_batch(req: MemorySearchBatchRequest):
+    logger.debug(f"SEARCH_BATCH queries={req.queries!r} user_id={req.user_id} scope={req.scope}")
+    metrics.set_user(req.user_id)
+    async with admission.slot(admission.INTERACTIVE):
+        try:
+            grouped, degraded = await memory_search_many(
+                queries=req.queries,
+                scope=req.scope,
+                user_id=req.user_id,
+                limit=req.limit,
+                budget_ms=req.budget_ms,
+            )
+            return metrics.serialize(MemorySearchBatchResponse(
+                status="ok",
+                results=[
+                    MemorySearchBatchResult(query=q, results=r) for q, r in zip(req.queries, grouped)
+                ],
+                degraded=degraded,
+            ))
+        except Exception as e:
+            logger.exception("memory_search_many failed")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/recall", response_model=MemoryRecallResponse)
+async def recall_memory(req: MemoryRecallRequest):
+    targets = [(t.user_id, t.scope) for t in req.targets]
+    logger.debug(f"RECALL query={req.query!r} targets={targets}")
+    metrics.set_user(req.targets[0].user_id)
+    async with admission.slot(admission.INTERACTIVE):
+        try:
+            results, degraded = await memory_recall(
+                query=req.query,
+                targets=req.targets,
+                limit=req.limit,
+                budget_ms=req.budget_ms,
+            )
+            return metrics.serialize(
+                MemoryRecallResponse(status="ok", results=results, degraded=degraded)
+            )
+        except Exception as e:
+            logger.exception("memory_recall failed")
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/forget", response_model=MemoryForgetResponse)
 async def forget_memory(req: MemoryForgetRequest):
     logger.debug(f"FORGET key={req.key} user_id={req.user_id}")
-    try:
-        deleted = await memory_forget(req.key, user_id=req.user_id)
-        status = "ok" if deleted else "not_found"
-        return MemoryForgetResponse(status=status, key=req.key)
-    except Exception as e:
-        logger.exception("memory_forget failed")
-        raise HTTPException(status_code=500, detail=str(e))
+    metrics.set_user(req.user_id)
+    async with admission.slot(admission.INTERACTIVE):
+        try:
+            deleted = await memory_forget(req.key, user_id=req.user_id)
+            status = "ok" if deleted else "not_found"
+            return metrics.serialize(MemoryForgetResponse(status=status, key=req.key))
+        except Exception as e:
+            logger.exception("memory_forget failed")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/export")
+async def export_memories(user_id: str | None = None, scope: str | None = None):
+    """Stream memories as NDJSON, one object per line, embeddings base64-encoded."""
+    logger.debug(f"EXPORT user_id={user_id} scope={scope}")
+
+    # Take the slot before the response starts, so a full lane is a 429/503
+    # instead of a 200 with an empty body. It is held until the stream ends;
+    # the background task releases it if the body never ran.
+    slot = AsyncExitStack()
+    await slot.enter_async_context(admission.slot(admission.BULK))
+
+    async def body():
+        try:
+            async for line in transfer_service.export_lines(user_id=user_id, scope=scope):
+                yield line
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        body(), media_type="application/x-ndjson", background=BackgroundTask(slot.aclose)
+    )
+
+
+@router.post("/import", response_model=MemoryImportResponse)
+async def import_memories(request: Request, defer_index: bool = False):
+    """Load NDJSON as produced by /memory/export, re-embedding only where needed."""
+    logger.debug(f"IMPORT defer_index={defer_index}")
+    if defer_index and not settings.import_allow_defer_index:
+        raise HTTPException(
+            status_code=403,
+            detail="defer_index is disabled (set HAMEM_IMPORT_ALLOW_DEFER_INDEX=true for restores)",
+        )
+    async with admission.slot(admission.BULK):
+        try:
+            stats = await transfer_service.import_lines(request.stream(), defer_index=defer_index)
+        except Exception as e:
+            logger.exception("memory import failed")
+            raise HTTPException(status_code=500, detail=str(e))
+    status = "partial" if stats["skipped"] else "ok"
+    return metrics.serialize(MemoryImportResponse(status=status, **stats))
@@ -0,0 +1,159 @@
+"""Admission control for endpoints that embed text or hold a pool connection.
+
+Requests run in one of two lanes. Interactive requests (search, get, set,
+forget) are what the voice pipeline waits on; bulk requests (set_batch,
+import, export) can take longer without anyone noticing. Both lanes share
+admission_max_concurrent slots, bulk may hold at most
+admission_bulk_max_concurrent of them, and a freed slot always goes to a
+queued interactive request first.
+
+Each lane's queue is bounded. A request arriving at a full queue is rejected
+straight away (429), and one that waits longer than admission_queue_timeout
+gives up (503). Both carry a Retry-After estimate, so clients back off instead
+of piling more work onto an overloaded service.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from server.config import settings
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class Overloaded(Exception):
+    """Raised when a request can't be admitted. Maps to an HTTP error response."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int, bulk_max_concurrent: int, queue_size: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.bulk_max_concurrent = bulk_max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._active = {INTERACTIVE: 0, BULK: 0}
+        self._waiters: dict[str, deque[asyncio.Future]] = {INTERACTIVE: deque(), BULK: deque()}
+        self._stats = {
+            lane: {
+                "admitted": 0,
+                "rejected_full": 0,
+                "rejected_timeout": 0,
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0,
+                "total_hold_ms": 0.0,
+            }
+            for lane in (INTERACTIVE, BULK)
+        }
+
+    def _has_room(self, lane: str) -> bool:
+        if sum(self._active.values()) >= self.max_concurrent:
+            return False
+        return lane == INTERACTIVE or self._active[BULK] < self.bulk_max_concurrent
+
+    def _can_start(self, lane: str) -> bool:
+        # Don't jump the queue, and let queued interactive requests go before bulk
+        if self._waiters[lane] or (lane == BULK and self._waiters[INTERACTIVE]):
+            return False
+        return self._has_room(lane)
+
+    def _wake(self) -> None:
+        for lane in (INTERACTIVE, BULK):
+            waiters = self._waiters[lane]
+            while waiters and self._has_room(lane):
+                fut = waiters.popleft()
+                if not fut.done():
+                    self._active[lane] += 1
+                    fut.set_result(None)
+
+    def _release(self, lane: str) -> None:
+        self._active[lane] -= 1
+        self._wake()
+
+    def _retry_after(self, lane: str) -> int:
+        """Rough seconds until the current queue has drained."""
+        stat = self._stats[lane]
+        avg_hold = stat["total_hold_ms"] / stat["admitted"] / 1000 if stat["admitted"] else 1.0
+        capacity = self.max_concurrent if lane == INTERACTIVE else self.bulk_max_concurrent
+        return max(1, math.ceil(avg_hold * (len(self._waiters[lane]) + 1) / max(capacity, 1)))
+
+    async def _acquire(self, lane: str) -> None:
+        stat = self._stats[lane]
+        if self._can_start(lane):
+            self._active[lane] += 1
+            stat["admitted"] += 1
+            return
+        if len(self._waiters[lane]) >= self.queue_size:
+            stat["rejected_full"] += 1
+            raise Overloaded(429, self._retry_after(lane), f"Too many queued {lane} requests")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(fut)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # Granted a slot just as we gave up; hand it on
+                self._release(lane)
+            elif fut in self._waiters[lane]:
+                self._waiters[lane].remove(fut)
+            if isinstance(e, TimeoutError):
+                stat["rejected_timeout"] += 1
+                raise Overloaded(503, self._retry_after(lane), f"Timed out queueing {lane} request") from None
+            raise
+        waited_ms = (time.perf_counter() - started) * 1000
+        stat["admitted"] += 1
+        stat["total_wait_ms"] += waited_ms
+        stat["max_wait_ms"] = max(stat["max_wait_ms"], waited_ms)
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        """Hold one slot in lane for the duration of the block."""
+        await self._acquire(lane)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stats[lane]["total_hold_ms"] += (time.perf_counter() - started) * 1000
+            self._release(lane)
+
+    def stats(self) -> dict:
+        result = {"max_concurrent": self.max_concurrent}
+        for lane, stat in self._stats.items():
+            admitted = stat["admitted"]
+            result[lane] = {
+                "active": self._active[lane],
+                "queued": len(self._waiters[lane]),
+                "admitted": admitted,
+                "rejected_full": stat["rejected_full"],
+                "rejected_timeout": stat["rejected_timeout"],
+                "avg_wait_ms": round(stat["total_wait_ms"] / admitted, 3) if admitted else 0.0,
+                "max_wait_ms": round(stat["max_wait_ms"], 3),
+            }
+        return result
+
+
+controller = AdmissionController(
+    settings.admission_max_concurrent,
+    settings.admission_bulk_max_concurrent,
+    settings.admission_queue_size,
+    settings.admission_queue_timeout,
+)
+
+
+def slot(lane: str):
+    return controller.slot(lane)
+
+
+def stats() -> dict:
+    return controller.stats()
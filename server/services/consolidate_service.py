@@ -0,0 +1,153 @@
+"""Background consolidation of near-duplicate memories.
+
+memory_set merges a new key into a near-duplicate as it is written, but rows
+stored before that, through /memory/set_batch, an import or write-behind, or
+with force_new, can still hold the same fact under different keys. Every
+dedup_interval seconds this task walks memories in id order, dedup_batch_size
+rows per statement, and probes each row's nearest neighbour of the same user
+and scope. A pair at least dedup_threshold similar is a duplicate, and the
+row that was used less recently goes. The kept row is the one memory_get and
+search have been returning, so nothing that was in use disappears.
+
+A row is only removed if the neighbour it loses to is itself kept, so a chain
+of similar rows never collapses onto one its far end isn't similar to. With
+dedup_archive set, removed rows are copied into memories_archive first.
+"""
+
+import asyncio
+import logging
+
+from server import metrics
+from server.config import settings
+from server.db import get_pool
+from server.services import touch_service
+from server.services.memory_cache import cache as memory_cache
+from server.services.memory_service import dedup_stats
+
+logger = logging.getLogger(__name__)
+
+# Each row of the next id window with its nearest live neighbour, if that is
+# at least $3 similar. $1 is the last id seen, $2 the window size, $4 an
+# optional list of user_ids.
+_DUPLICATES_SQL = """
+    WITH batch AS (
+        SELECT id, user_id, scope, embedding, last_used_at
+        FROM memories
+        WHERE id > $1 AND ($4::text[] IS NULL OR user_id = ANY($4))
+        ORDER BY id
+        LIMIT $2
+    )
+    SELECT b.id, b.last_used_at, n.id AS dup_id, n.last_used_at AS dup_last_used_at
+    FROM batch b
+    LEFT JOIN LATERAL (
+        SELECT id, last_used_at FROM (
+            SELECT m.id, m.last_used_at, m.embedding <=> b.embedding AS distance
+            FROM memories m
+            WHERE m.user_id = b.user_id AND m.scope = b.scope AND m.id <> b.id
+              AND m.embedding IS NOT NULL
+              AND (m.expires_at IS NULL OR m.expires_at > NOW())
+            ORDER BY m.embedding <=> b.embedding
+            LIMIT 1
+        ) nearest
+        WHERE 1 - distance >= $3
+    ) n ON b.embedding IS NOT NULL
+    ORDER BY b.id
+"""
+
+_REMOVE_SQL = """
+    WITH removed AS (
+        DELETE FROM memories WHERE id = ANY($1::bigint[])
+        RETURNING id, key, value, scope, user_id, tags, created_at, last_used_at, expires_at
+    ),
+    archived AS (
+        INSERT INTO memories_archive
+            (id, key, value, scope, user_id, tags, created_at, last_used_at, expires_at)
+        SELECT id, key, value, scope, user_id, tags, created_at, last_used_at, expires_at
+        FROM removed
+        WHERE $2::boolean
+        ON CONFLICT (id) DO NOTHING
+    )
+    SELECT key, user_id FROM removed
+"""
+
+consolidated_rows = metrics.Counter(
+    "hamem_consolidated_rows_total", "Near-duplicate memories removed by consolidation", ()
+)
+
+_task: asyncio.Task | None = None
+_stats = {"passes": 0, "removed": 0, "errors": 0}
+
+
+async def consolidate(user_ids: list[str] | None = None) -> int:
+    """Remove near-duplicate memories (of all users, or just user_ids) in one pass.
+
+    Returns the number of rows removed.
+    """
+    if settings.dedup_threshold <= 0:
+        return 0
+    # Pending last_used_at updates decide which row of a pair is kept
+    await touch_service.flush()
+    pool = await get_pool()
+    batch_size = max(1, settings.dedup_batch_size)
+    losers: dict[int, int] = {}
+    last_id = 0
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                _DUPLICATES_SQL, last_id, batch_size, settings.dedup_threshold, user_ids
+            )
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        for r in rows:
+            if r["dup_id"] is not None and (r["dup_last_used_at"], r["dup_id"]) > (
+                r["last_used_at"], r["id"]
+            ):
+                losers[r["id"]] = r["dup_id"]
+
+    victims = [row_id for row_id, winner in losers.items() if winner not in losers]
+    removed = 0
+    for i in range(0, len(victims), batch_size):
+        async with pool.acquire() as conn:
+            gone = await conn.fetch(_REMOVE_SQL, victims[i : i + batch_size], settings.dedup_archive)
+        for r in gone:
+            memory_cache.invalidate(r["user_id"], r["key"])
+        removed += len(gone)
+
+    _stats["passes"] += 1
+    _stats["removed"] += removed
+    consolidated_rows.inc(amount=removed)
+    if removed:
+        logger.info("Consolidated %d near-duplicate memories", removed)
+    return removed
+
+
+async def _consolidate_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.dedup_interval)
+        try:
+            await consolidate()
+        except Exception:
+            _stats["errors"] += 1
+            logger.exception("Near-duplicate consolidation failed")
+
+
+async def start() -> None:
+    global _task
+    if _task is None and settings.dedup_interval > 0:
+        _task = asyncio.create_task(_consolidate_loop())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return {"interval": settings.dedup_interval, "write_path": dedup_stats(), **_stats}
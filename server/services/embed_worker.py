@@ -0,0 +1,144 @@
+"""Background embedding of rows stored by write-behind /memory/set.
+
+With HAMEM_WRITE_BEHIND, memory_set stores the row with a NULL embedding and
+returns. Those rows are the outbox: they survive a restart and stay visible
+to /memory/get and to the trigram side of search meanwhile. This worker finds
+them through a partial index, embeds up to embed_workers batches of
+embed_worker_batch_size texts concurrently, and fills in embedding and
+embed_model. A write wakes it straight away; otherwise it polls every
+embed_worker_interval seconds.
+
+A fill is skipped if the row's text changed after it was read, so the newer
+write is picked up on the next round. If a batch fails, its rows are retried
+one at a time, and any that still fail are left for the next pass so they
+don't hold up the rest.
+"""
+
+import asyncio
+import logging
+
+import asyncpg
+from pgvector import Vector
+
+from server import embeddings, metrics, migrations
+from server.config import settings
+from server.db import get_embedding_dim, get_pool
+
+logger = logging.getLogger(__name__)
+
+_FETCH_SQL = """
+    SELECT id, search_text, content_hash FROM memories
+    WHERE embedding IS NULL AND id <> ALL($2::bigint[])
+    ORDER BY id
+    LIMIT $1
+"""
+
+_FILL_SQL = """
+    UPDATE memories m SET embedding = t.embedding::{column_type}, embed_model = $4
+    FROM unnest($1::bigint[], $2::text[], $3::vector[]) AS t(id, content_hash, embedding)
+    WHERE m.id = t.id AND m.content_hash = t.content_hash AND m.embedding IS NULL
+"""
+
+embedded_rows = metrics.Counter(
+    "hamem_write_behind_embedded_total", "Write-behind rows given their embedding", ()
+)
+
+_wake = asyncio.Event()
+_task: asyncio.Task | None = None
+_stats = {"passes": 0, "batches": 0, "rows_embedded": 0, "rows_failed": 0, "errors": 0}
+
+
+def notify() -> None:
+    """Tell the worker a pending row was just written."""
+    _wake.set()
+
+
+async def _fill(pool: asyncpg.Pool, rows: list[asyncpg.Record]) -> int:
+    vectors = await embeddings.embed_batch([r["search_text"] for r in rows], cache=False)
+    column_type, _, _ = migrations.storage_spec(settings.vector_storage, get_embedding_dim())
+    async with pool.acquire() as conn:
+        result = await conn.execute(
+            _FILL_SQL.format(column_type=column_type),
+            [r["id"] for r in rows],
+            [r["content_hash"] for r in rows],
+            [Vector(v) for v in vectors],
+            embeddings.model_id(),
+        )
+    _stats["batches"] += 1
+    return int(result.split()[-1])
+
+
+async def _fill_batch(pool: asyncpg.Pool, rows: list[asyncpg.Record], failed: list[int]) -> int:
+    try:
+        return await _fill(pool, rows)
+    except Exception:
+        if len(rows) == 1:
+            failed.append(rows[0]["id"])
+            _stats["rows_failed"] += 1
+            logger.warning("Embedding pending memory %d failed", rows[0]["id"], exc_info=True)
+            return 0
+    # Find the rows that fail on their own, so the rest still get through
+    filled = 0
+    for row in rows:
+        filled += await _fill_batch(pool, [row], failed)
+    return filled
+
+
+async def drain() -> int:
+    """Embed every pending row. Returns the number of rows filled in."""
+    pool = await get_pool()
+    batch_size = max(1, settings.embed_worker_batch_size)
+    limit = batch_size * max(1, settings.embed_workers)
+    failed: list[int] = []
+    total = 0
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(_FETCH_SQL, limit, failed)
+        if not rows:
+            break
+        batches = [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+        filled = await asyncio.gather(*(_fill_batch(pool, b, failed) for b in batches))
+        total += sum(filled)
+        if len(rows) < limit:
+            break
+    _stats["passes"] += 1
+    _stats["rows_embedded"] += total
+    embedded_rows.inc(amount=total)
+    return total
+
+
+async def _worker_loop() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), settings.embed_worker_interval)
+        except TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            await drain()
+        except Exception:
+            _stats["errors"] += 1
+            logger.exception("Failed to embed pending memories")
+            # Don't spin on a dead backend while writes keep waking us
+            await asyncio.sleep(settings.embed_worker_interval)
+
+
+async def start() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_worker_loop())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return {"write_behind": settings.write_behind, **_stats}
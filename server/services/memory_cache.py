@@ -0,0 +1,101 @@
+"""In-process read-through cache for exact-key lookups.
+
+Entries are keyed by (user_id, key) and never outlive the memory's own
+expires_at. Every write path in memory_service invalidates the affected keys.
+
+A reader takes generation() before its database read and passes it to put().
+If the key was invalidated in between, the row it read may predate a write
+that has since committed, so put() drops it instead of caching a stale value.
+Invalidation stamps are kept for the most recent keys only; a key whose stamp
+has aged out is treated as invalidated at the newest forgotten stamp.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from server.config import settings
+from server.models import MemoryItem
+
+
+class MemoryCache:
+    """LRU cache of MemoryItem by (user_id, key) with a TTL capped at expires_at."""
+
+    # Invalidation stamps kept, at least; more if the cache itself is larger
+    min_stamps = 1024
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], tuple[float, MemoryItem]] = OrderedDict()
+        # Generation at which each recently invalidated key was last invalidated
+        self._invalidated: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self._generation = 0
+        self._forgotten = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, user_id: str, key: str) -> MemoryItem | None:
+        ident = (user_id, key)
+        entry = self._entries.get(ident)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[ident]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(ident)
+        self.hits += 1
+        return entry[1].model_copy()
+
+    def generation(self) -> int:
+        """Token to take before reading a row that will be passed to put()."""
+        return self._generation
+
+    def put(self, item: MemoryItem, expires_at: datetime | None, generation: int | None = None) -> None:
+        if self.max_size <= 0:
+            return
+        ident = (item.user_id, item.key)
+        if generation is not None and self._invalidated.get(ident, self._forgotten) > generation:
+            self.stale_puts += 1
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at.timestamp())
+        self._entries[ident] = (deadline, item.model_copy())
+        self._entries.move_to_end(ident)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str, key: str) -> None:
+        ident = (user_id, key)
+        self._generation += 1
+        self._invalidated[ident] = self._generation
+        self._invalidated.move_to_end(ident)
+        while len(self._invalidated) > max(self.max_size, self.min_stamps):
+            _, forgotten = self._invalidated.popitem(last=False)
+            self._forgotten = max(self._forgotten, forgotten)
+        if self._entries.pop(ident, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._invalidated.clear()
+        self._generation += 1
+        self._forgotten = self._generation
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "stale_puts": self.stale_puts,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+cache = MemoryCache(settings.memory_cache_size, settings.memory_cache_ttl)
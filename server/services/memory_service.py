@@ -1,13 +1,105 @@
+import asyncio
+import functools
+import hashlib
+import logging
 import re
+import time
 from datetime import datetime, timedelta, timezone
 
 import asyncpg
 import numpy as np
+from pgvector import Vector
 
+from server import metrics, migrations
 from server.config import settings
-from server.db import get_pool
-from server.embeddings import embed
-from server.models import MemoryItem
+from server.db import acquire, get_embedding_dim
+from server.embeddings import embed, embed_batch, model_id
+from server.models import MemoryItem, MemorySetBatchItem, MemorySetRequest, RecallTarget
+from server.services import embed_worker, search_planner, slow_search, touch_service
+from server.services.memory_cache import cache as memory_cache
+
+logger = logging.getLogger(__name__)
+
+_UPSERT_SQL = """
+    INSERT INTO memories (
+        key, value, scope, user_id, tags, tags_search, embedding, search_text, expires_at,
+        content_hash, embed_model
+    )
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+    ON CONFLICT (key, user_id) DO UPDATE SET
+        value = EXCLUDED.value,
+        scope = EXCLUDED.scope,
+        tags = EXCLUDED.tags,
+        tags_search = EXCLUDED.tags_search,
+        embedding = EXCLUDED.embedding,
+        search_text = EXCLUDED.search_text,
+        expires_at = EXCLUDED.expires_at,
+        content_hash = EXCLUDED.content_hash,
+        embed_model = EXCLUDED.embed_model,
+        last_used_at = NOW()
+"""
+
+# Used when the search text is unchanged: refresh everything except the embedding
+# and search_text, so the HNSW and GIN indexes are left alone.
+_UPDATE_UNCHANGED_SQL = """
+    UPDATE memories SET
+        value = $3,
+        scope = $4,
+        tags = $5,
+        tags_search = $6,
+        expires_at = $7,
+        last_used_at = NOW()
+    WHERE key = $1 AND user_id = $2 AND content_hash = $8 AND embed_model = $9
+"""
+
+
+# Write-behind: store the row without an embedding for embed_worker to fill in.
+# If the search text and model are unchanged the existing embedding is kept.
+_UPSERT_PENDING_SQL = """
+    INSERT INTO memories (
+        key, value, scope, user_id, tags, tags_search, embedding, search_text, expires_at,
+        content_hash, embed_model
+    )
+    VALUES ($1, $2, $3, $4, $5, $6, NULL, $7, $8, $9, '')
+    ON CONFLICT (key, user_id) DO UPDATE SET
+        value = EXCLUDED.value,
+        scope = EXCLUDED.scope,
+        tags = EXCLUDED.tags,
+        tags_search = EXCLUDED.tags_search,
+        search_text = EXCLUDED.search_text,
+        expires_at = EXCLUDED.expires_at,
+        last_used_at = NOW(),
+        embedding = CASE
+            WHEN memories.content_hash = EXCLUDED.content_hash AND memories.embed_model = $10
+            THEN memories.embedding
+        END,
+        embed_model = CASE
+            WHEN memories.content_hash = EXCLUDED.content_hash AND memories.embed_model = $10
+            THEN memories.embed_model
+            ELSE ''
+        END,
+        content_hash = EXCLUDED.content_hash
+    RETURNING embedding IS NULL AS pending
+"""
+
+
+# Nearest other row of the same user and scope, if it is at least $5 similar
+# and the key being written is new. $1 is the new row's embedding.
+_DUPLICATE_SQL = """
+    SELECT key FROM (
+        SELECT key, embedding <=> $1::vector::{column_type} AS distance
+        FROM memories
+        WHERE user_id = $2 AND scope = $3 AND key <> $4
+          AND embedding IS NOT NULL
+          AND (expires_at IS NULL OR expires_at > NOW())
+        ORDER BY embedding <=> $1::vector::{column_type}
+        LIMIT 1
+    ) nearest
+    WHERE 1 - distance >= $5
+      AND NOT EXISTS (SELECT 1 FROM memories WHERE key = $4 AND user_id = $2)
+"""
+
+_dedup_stats = {"probes": 0, "merged": 0}
 
 
 def _expand_key(key: str) -> str:
@@ -30,6 +122,17 @@ def _build_search_text(key: str, value: str, tags: str) -> str:
     return " ".join(parts)
 
 
+def _content_hash(search_text: str) -> str:
+    return hashlib.sha256(search_text.encode()).hexdigest()
+
+
+def _expires_at(expiration_days: int) -> datetime | None:
+    """0 = never expires."""
+    if expiration_days and expiration_days > 0:
+        return datetime.now(timezone.utc) + timedelta(days=expiration_days)
+    return None
+
+
 async def memory_set(
     key: str,
     value: str,
@@ -38,143 +141,734 @@ async def memory_set(
     tags: str = "",
     tags_search: str = "",
     expiration_days: int = 180,
+    write_behind: bool | None = None,
+    force_new: bool = False,
 ) -> str:
-    """Store or update a memory with its embedding."""
-    pool = await get_pool()
+    """Store or update a memory with its embedding. Returns the key it was stored under.
+
+    If the stored row already has the same search text and embed model, the
+    existing embedding is kept and Ollama is not called. With write_behind
+    (default settings.write_behind) the row is stored at once without an
+    embedding, and embed_worker adds it in the background.
+
+    A new key whose embedding is at least settings.dedup_threshold similar to
+    another memory of the same user and scope is merged into that memory
+    instead: the existing key takes the new value and tags. force_new turns
+    this off. Write-behind rows have no embedding yet, so they are left to
+    consolidate_service.
+    """
     search_text = _build_search_text(key, value, tags)
-    embedding = await embed(search_text)
+    content_hash = _content_hash(search_text)
+    embed_model = model_id()
+    expires_at = _expires_at(expiration_days)
 
-    # 0 = never expires
-    expires_at = None
-    if expiration_days and expiration_days > 0:
-        expires_at = datetime.now(timezone.utc) + timedelta(days=expiration_days)
+    if settings.write_behind if write_behind is None else write_behind:
+        async with acquire() as conn:
+            pending = await conn.fetchval(
+                _UPSERT_PENDING_SQL,
+                key,
+                value,
+                scope,
+                user_id,
+                tags,
+                tags_search,
+                search_text,
+                expires_at,
+                content_hash,
+                embed_model,
+            )
+        memory_cache.invalidate(user_id, key)
+        if pending:
+            embed_worker.notify()
+        return key
 
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO memories (key, value, scope, user_id, tags, tags_search, embedding, search_text, expires_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-            ON CONFLICT (key, user_id) DO UPDATE SET
-                value = EXCLUDED.value,
-                scope = EXCLUDED.scope,
-                tags = EXCLUDED.tags,
-                tags_search = EXCLUDED.tags_search,
-                embedding = EXCLUDED.embedding,
-                search_text = EXCLUDED.search_text,
-                expires_at = EXCLUDED.expires_at,
-                last_used_at = NOW()
-            """,
+    async with acquire() as conn:
+        result = await conn.execute(
+            _UPDATE_UNCHANGED_SQL,
             key,
+            user_id,
             value,
             scope,
-            user_id,
             tags,
             tags_search,
-            embedding,
-            search_text,
             expires_at,
+            content_hash,
+            embed_model,
         )
+    if result == "UPDATE 1":
+        memory_cache.invalidate(user_id, key)
+        return key
+
+    with metrics.stage("embed"):
+        embedding = await embed(search_text)
+    if not force_new and settings.dedup_threshold > 0:
+        duplicate = await _find_duplicate(key, scope, user_id, embedding)
+        if duplicate is not None:
+            logger.info("Merging new memory %r into near-duplicate %r", key, duplicate)
+            key = duplicate
+            search_text = _build_search_text(key, value, tags)
+            content_hash = _content_hash(search_text)
+            with metrics.stage("embed"):
+                embedding = await embed(search_text)
+    for attempt in range(2):
+        try:
+            async with acquire() as conn:
+                await conn.execute(
+                    _UPSERT_SQL,
+                    key,
+                    value,
+                    scope,
+                    user_id,
+                    tags,
+                    tags_search,
+                    embedding,
+                    search_text,
+                    expires_at,
+                    content_hash,
+                    embed_model,
+                )
+            break
+        except asyncpg.DataError:
+            if attempt or not _dim_changed([embedding]):
+                raise
+            # A re-index swapped the column while this write was embedding;
+            # the full vector is cached, so this is only a truncation
+            embedding = await embed(search_text)
+    memory_cache.invalidate(user_id, key)
     return key
 
 
+def _dim_changed(vectors: list[np.ndarray]) -> bool:
+    """True if the embedding column changed dimension since vectors were made."""
+    dim = get_embedding_dim()
+    return any(len(v) != dim for v in vectors)
+
+
+async def _find_duplicate(
+    key: str, scope: str, user_id: str, embedding: np.ndarray
+) -> str | None:
+    """Key of an existing memory the new key near-duplicates, or None."""
+    column_type, _, _ = migrations.storage_spec(settings.vector_storage, get_embedding_dim())
+    try:
+        async with acquire() as conn:
+            duplicate = await conn.fetchval(
+                _DUPLICATE_SQL.format(column_type=column_type),
+                Vector(embedding),
+                user_id,
+                scope,
+                key,
+                settings.dedup_threshold,
+            )
+    except asyncpg.DataError:
+        if not _dim_changed([embedding]):
+            raise
+        # Mid re-index swap; store without merging, memory_set re-embeds
+        return None
+    _dedup_stats["probes"] += 1
+    if duplicate is not None:
+        _dedup_stats["merged"] += 1
+    return duplicate
+
+
+def dedup_stats() -> dict:
+    return {"threshold": settings.dedup_threshold, **_dedup_stats}
+
+
+async def memory_set_many(items: list[MemorySetRequest]) -> list[MemorySetBatchItem]:
+    """Store or update many memories at once.
+
+    Items whose search text and embed model match the stored row keep their
+    embedding. The rest are embedded in chunks via embed_batch. All writes go out
+    as executemany calls in one transaction. Returns a status per input item, in
+    input order. If the same (key, user_id) appears more than once, the last
+    occurrence wins and earlier ones are reported as skipped.
+    """
+    results = [
+        MemorySetBatchItem(key=item.key, user_id=item.user_id, status="ok") for item in items
+    ]
+    last_index = {(item.key, item.user_id): i for i, item in enumerate(items)}
+    pending = []
+    for i, item in enumerate(items):
+        if last_index[(item.key, item.user_id)] != i:
+            results[i].status = "skipped"
+            results[i].detail = "superseded by a later item with the same key"
+        else:
+            pending.append(i)
+
+    embed_model = model_id()
+    search_texts = {i: _build_search_text(items[i].key, items[i].value, items[i].tags) for i in pending}
+    hashes = {i: _content_hash(text) for i, text in search_texts.items()}
+
+    async with acquire() as conn:
+        existing = await conn.fetch(
+            """
+            SELECT m.key, m.user_id, m.content_hash, m.embed_model
+            FROM memories m
+            JOIN unnest($1::text[], $2::text[]) AS k(key, user_id)
+              ON m.key = k.key AND m.user_id = k.user_id
+            """,
+            [items[i].key for i in pending],
+            [items[i].user_id for i in pending],
+        )
+    stored = {(r["key"], r["user_id"]): (r["content_hash"], r["embed_model"]) for r in existing}
+    unchanged = {
+        i for i in pending
+        if stored.get((items[i].key, items[i].user_id)) == (hashes[i], embed_model)
+    }
+    to_embed = [i for i in pending if i not in unchanged]
+
+    embeddings: dict[int, np.ndarray] = {}
+    chunk_size = max(1, settings.set_batch_chunk_size)
+    for start in range(0, len(to_embed), chunk_size):
+        chunk = to_embed[start : start + chunk_size]
+        try:
+            with metrics.stage("embed"):
+                vectors = await embed_batch([search_texts[i] for i in chunk], cache=False)
+        except Exception as e:
+            logger.warning("embed_batch failed for %d items: %s", len(chunk), e)
+            for i in chunk:
+                results[i].status = "error"
+                results[i].detail = f"embedding failed: {e}"
+            continue
+        embeddings.update(zip(chunk, vectors))
+
+    upserts = []
+    for i, vec in embeddings.items():
+        item = items[i]
+        upserts.append((
+            item.key,
+            item.value,
+            item.scope,
+            item.user_id,
+            item.tags,
+            item.tags_search,
+            vec,
+            search_texts[i],
+            _expires_at(item.expiration_days),
+            hashes[i],
+            embed_model,
+        ))
+    updates = []
+    for i in sorted(unchanged):
+        item = items[i]
+        updates.append((
+            item.key,
+            item.user_id,
+            item.value,
+            item.scope,
+            item.tags,
+            item.tags_search,
+            _expires_at(item.expiration_days),
+            hashes[i],
+            embed_model,
+        ))
+
+    written = [*embeddings, *unchanged]
+    if written:
+        try:
+            try:
+                await _write_many(upserts, updates)
+            except asyncpg.DataError:
+                if not _dim_changed(list(embeddings.values())):
+                    raise
+                # A re-index swapped the column while this batch was embedding
+                vectors = await embed_batch([search_texts[i] for i in embeddings], cache=False)
+                upserts = [(*u[:6], v, *u[7:]) for u, v in zip(upserts, vectors)]
+                await _write_many(upserts, updates)
+        except Exception as e:
+            logger.exception("memory_set_many write failed")
+            for i in written:
+                results[i].status = "error"
+                results[i].detail = f"write failed: {e}"
+        for i in written:
+            memory_cache.invalidate(items[i].user_id, items[i].key)
+    return results
+
+
+async def _write_many(upserts: list[tuple], updates: list[tuple]) -> None:
+    async with acquire() as conn:
+        async with conn.transaction():
+            if upserts:
+                await conn.executemany(_UPSERT_SQL, upserts)
+            if updates:
+                await conn.executemany(_UPDATE_UNCHANGED_SQL, updates)
+
+
 async def memory_get(key: str, user_id: str = "default") -> MemoryItem | None:
     """Retrieve a memory by exact key for a specific user."""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    item = memory_cache.get(user_id, key)
+    if item is not None:
+        touch_service.touch(user_id, [key])
+        return item
+
+    # A write committed after this point invalidates the key, so the row read
+    # below is not cached over it
+    generation = memory_cache.generation()
+    async with acquire() as conn:
         row = await conn.fetchrow(
             """
-            SELECT key, value, scope, user_id, tags, tags_search
+            SELECT key, value, scope, user_id, tags, tags_search, expires_at
             FROM memories
             WHERE key = $1 AND user_id = $2 AND (expires_at IS NULL OR expires_at > NOW())
             """,
             key,
             user_id,
         )
-        if row:
-            await conn.execute(
-                "UPDATE memories SET last_used_at = NOW() WHERE key = $1 AND user_id = $2",
-                key,
-                user_id,
+    if row:
+        touch_service.touch(user_id, [key])
+        item = MemoryItem(
+            key=row["key"],
+            value=row["value"],
+            scope=row["scope"],
+            user_id=row["user_id"],
+            tags=row["tags"],
+            tags_search=row["tags_search"],
+        )
+        memory_cache.put(item, row["expires_at"], generation)
+        return item
+    return None
+
+
+# Candidate selection and fusion for one search, run as a lateral subquery per
+# (embedding, query text) row q. The vector channel and the trigram channel
+# (GIN, via the % operator) each pick their own candidates. The union is scored
+# and fused, either by the weighted vec + trigram score or by reciprocal rank
+# fusion. A trigram depth of 0 gives pure vector retrieval with the trigram
+# score as a re-ranking boost only.
+#
+# The vector channel comes in two plans, chosen by search_planner: "ann" walks
+# the HNSW index with the user/scope filter applied during the scan, and "exact"
+# materializes the user's rows once per statement and brute-force sorts them.
+# _search_body() fills in the channel for the configured vector storage mode.
+# Rows still waiting for their embedding (write-behind) can only come in
+# through the trigram channel.
+#
+# The user/scope being searched is bound through plain parameters ({scope},
+# {user_id}, {limit}, {vector_depth}, {trigram_depth}), not lateral columns,
+# so the planner can still pick the HNSW index for it.
+_SEARCH_BODY_SQL = """
+        WITH vector_candidates AS (
+            SELECT id, row_number() OVER (ORDER BY distance) AS vec_rank
+            FROM (
+                {vector_channel}
+                LIMIT {vector_depth}
+            ) v
+        ),
+        trigram_candidates AS (
+            SELECT
+                m.id,
+                row_number() OVER (ORDER BY similarity(m.search_text, q.query) DESC) AS trgm_rank
+            FROM memories m
+            WHERE (m.expires_at IS NULL OR m.expires_at > NOW())
+              AND m.scope = {scope}
+              AND m.user_id = {user_id}
+              AND m.search_text % q.query
+            ORDER BY similarity(m.search_text, q.query) DESC
+            LIMIT {trigram_depth}
+        ),
+        scored AS (
+            SELECT
+                m.key, m.value, m.scope, m.user_id, m.tags, m.tags_search,
+                -- 0 for rows still waiting for their embedding (write-behind)
+                COALESCE(1 - (m.embedding <=> {qvec}), 0) AS vec_score,
+                similarity(m.search_text, q.query) AS trgm_score,
+                c.vec_rank,
+                c.trgm_rank
+            FROM (
+                SELECT COALESCE(v.id, t.id) AS id, v.vec_rank, t.trgm_rank
+                FROM vector_candidates v
+                FULL JOIN trigram_candidates t ON t.id = v.id
+            ) c
+            JOIN memories m ON m.id = c.id
+        )
+        SELECT
+            key, value, scope, user_id, tags, tags_search, vec_score, trgm_score,
+            CASE WHEN $11 = 'rrf'
+                THEN COALESCE(1.0 / ($12 + vec_rank), 0) + COALESCE(1.0 / ($12 + trgm_rank), 0)
+                ELSE vec_score + ($6 * trgm_score)
+            END AS combined_score
+        FROM scored
+        WHERE vec_score >= $7 OR trgm_score >= $8
+        ORDER BY combined_score DESC
+        LIMIT {limit}
+"""
+
+# One lateral subquery per (embedding, query text) pair, so a single statement
+# answers any number of searches of one user/scope.
+_SEARCH_SQL = """
+    {scope_rows}
+    SELECT q.idx, r.*
+    FROM unnest($1::vector[], $2::text[]) WITH ORDINALITY AS q(embedding, query, idx)
+    CROSS JOIN LATERAL ({body}) r
+    ORDER BY q.idx, r.combined_score DESC
+"""
+
+# One query against several user/scope targets: a UNION ALL branch per target,
+# each with its own planner path and parameter slots.
+_RECALL_SQL = """
+    {scope_rows}
+    SELECT r.*
+    FROM unnest($1::vector[], $2::text[]) AS q(embedding, query)
+    CROSS JOIN LATERAL ({branches}) r
+"""
+
+# Parameters shared by every search body: $1 embeddings, $2 queries, $6 trigram
+# weight, $7/$8 thresholds, $11 fusion, $12 rrf_k. The first target takes $3,
+# $4, $5, $9 and $10; further recall targets follow from $13, five apiece.
+_FIRST_SLOTS = (3, 4, 5, 9, 10)
+
+
+def _target_slots(k: int) -> dict[str, str]:
+    numbers = _FIRST_SLOTS if k == 0 else range(13 + 5 * (k - 1), 18 + 5 * (k - 1))
+    names = ("scope", "user_id", "limit", "vector_depth", "trigram_depth")
+    return {name: f"${n}" for name, n in zip(names, numbers)}
+
+
+def _search_body(path: str, storage: str, dim: int, k: int = 0) -> tuple[str, str]:
+    """The scope_rows CTE (or "") and lateral body for target k of a search."""
+    # Query vectors arrive as vector[]; compare in the column's own type
+    qvec = f"q.embedding::halfvec({dim})" if storage == "halfvec" else "q.embedding"
+    slots = _target_slots(k)
+    cte = "scope_rows" if k == 0 else f"scope_rows_{k}"
+    filters = f"""(m.expires_at IS NULL OR m.expires_at > NOW())
+                  AND m.scope = {slots["scope"]}
+                  AND m.user_id = {slots["user_id"]}
+                  AND m.embedding IS NOT NULL"""
+
+    if path == search_planner.EXACT:
+        scope_rows = f"""{cte} AS MATERIALIZED (
+        SELECT m.id, m.embedding
+        FROM memories m
+        WHERE {filters}
+    )"""
+        vector_channel = f"""
+                SELECT s.id, s.embedding <=> {qvec} AS distance
+                FROM {cte} s
+                ORDER BY distance"""
+    elif storage == "binary":
+        # Coarse Hamming-distance candidates from the bit index, re-ranked exactly
+        scope_rows = ""
+        vector_channel = f"""
+                SELECT id, distance FROM (
+                    SELECT m.id, m.embedding <=> {qvec} AS distance
+                    FROM memories m
+                    WHERE {filters}
+                    ORDER BY binary_quantize(m.embedding)::bit({dim})
+                        <~> binary_quantize({qvec})
+                    LIMIT {slots["vector_depth"]} * {int(settings.binary_rerank_factor)}
+                ) coarse
+                ORDER BY distance"""
+    else:
+        scope_rows = ""
+        vector_channel = f"""
+                SELECT m.id, m.embedding <=> {qvec} AS distance
+                FROM memories m
+                WHERE {filters}
+                ORDER BY m.embedding <=> {qvec}"""
+
+    body = _SEARCH_BODY_SQL.format(vector_channel=vector_channel, qvec=qvec, **slots)
+    return scope_rows, body
+
+
+def _with(ctes: list[str]) -> str:
+    ctes = [c for c in ctes if c]
+    return "\n    WITH " + ",\n    ".join(ctes) if ctes else ""
+
+
+@functools.cache
+def _search_sql(path: str, storage: str, dim: int) -> str:
+    """Render _SEARCH_SQL for a planner path, HAMEM_VECTOR_STORAGE mode and dimension."""
+    scope_rows, body = _search_body(path, storage, dim)
+    return _SEARCH_SQL.format(scope_rows=_with([scope_rows]), body=body)
+
+
+@functools.lru_cache(maxsize=64)
+def _recall_sql(paths: tuple[str, ...], storage: str, dim: int) -> str:
+    """Render _RECALL_SQL for the planner path of each target."""
+    parts = [_search_body(path, storage, dim, k) for k, path in enumerate(paths)]
+    branches = "\n        UNION ALL\n".join(
+        f"(SELECT {k + 1} AS target, b.* FROM ({body}) b)" for k, (_, body) in enumerate(parts)
+    )
+    return _RECALL_SQL.format(scope_rows=_with([cte for cte, _ in parts]), branches=branches)
+
+
+def _search_params(targets: list[tuple[str, str, int]]) -> list:
+    """Positional parameters $3.. for (scope, user_id, limit) targets, see _target_slots."""
+    trigram_factor = settings.trigram_depth_factor if settings.search_mode == "hybrid" else 0
+
+    def slot_values(scope: str, user_id: str, limit: int) -> list:
+        return [scope, user_id, limit, limit * settings.vector_depth_factor, limit * trigram_factor]
+
+    first = slot_values(*targets[0])
+    params = [
+        *first[:3],
+        settings.trigram_weight,
+        settings.vector_threshold,
+        settings.trigram_threshold,
+        *first[3:],
+        settings.search_fusion,
+        settings.rrf_k,
+    ]
+    for target in targets[1:]:
+        params.extend(slot_values(*target))
+    return params
+
+
+async def _search(
+    conn: asyncpg.Connection,
+    queries: list[str],
+    embeddings: list[np.ndarray],
+    scope: str,
+    user_id: str,
+    limit: int,
+) -> list[list[MemoryItem]]:
+    """Run hybrid search for every query in one round trip. Results are grouped per query."""
+    path = search_planner.choose_path(user_id, scope)
+    sql = _search_sql(path, settings.vector_storage, get_embedding_dim())
+    args = (
+        [Vector(e) for e in embeddings],
+        queries,
+        *_search_params([(scope, user_id, limit)]),
+    )
+    started = time.perf_counter()
+    rows = await conn.fetch(sql, *args)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    search_planner.record(path, elapsed_ms)
+    slow_search.observe(
+        sql, args, queries, elapsed_ms, kind="hybrid", path=path, storage=settings.vector_storage
+    )
+    return _group_results(rows, len(queries))
+
+
+def _group_results(rows: list[asyncpg.Record], n_groups: int, group: str = "idx") -> list[list[MemoryItem]]:
+    """MemoryItems per query (or recall target), numbered 1.. by the group column."""
+    grouped: list[list[MemoryItem]] = [[] for _ in range(n_groups)]
+    used_keys: dict[str, set[str]] = {}
+    for row in rows:
+        grouped[row[group] - 1].append(
+            MemoryItem(
+                key=row["key"],
+                value=row["value"],
+                scope=row["scope"],
+                user_id=row["user_id"],
+                tags=row["tags"],
+                tags_search=row["tags_search"],
+                score=round(float(row["combined_score"]), 4),
             )
-            return MemoryItem(**dict(row))
+        )
+        used_keys.setdefault(row["user_id"], set()).add(row["key"])
+
+    for user_id, keys in used_keys.items():
+        touch_service.touch(user_id, list(keys))
+    return grouped
+
+
+# Trigram-only search over the GIN index, used when the query embedding
+# doesn't arrive within the latency budget. $1 queries, $2 scope, $3 user_id,
+# $4 limit. Scores are trigram word similarity: how much of the query matches
+# some stretch of search_text, so a short question still finds a long memory.
+_LEXICAL_SEARCH_SQL = """
+    SELECT q.idx, r.*
+    FROM unnest($1::text[]) WITH ORDINALITY q(query, idx)
+    CROSS JOIN LATERAL (
+        SELECT key, value, scope, user_id, tags, tags_search,
+               word_similarity(q.query, search_text) AS combined_score
+        FROM memories
+        WHERE q.query <% search_text
+          AND (expires_at IS NULL OR expires_at > NOW())
+          AND scope = $2
+          AND user_id = $3
+        ORDER BY q.query <<-> search_text
+        LIMIT $4
+    ) r
+    ORDER BY q.idx, r.combined_score DESC
+"""
+
+_search_stats = {"searches": 0, "degraded": 0, "embed_timeouts": 0, "embed_errors": 0}
+
+
+async def _lexical_search(
+    conn: asyncpg.Connection,
+    queries: list[str],
+    scope: str,
+    user_id: str,
+    limit: int,
+) -> list[list[MemoryItem]]:
+    args = (queries, scope, user_id, limit)
+    started = time.perf_counter()
+    rows = await conn.fetch(_LEXICAL_SEARCH_SQL, *args)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    slow_search.observe(_LEXICAL_SEARCH_SQL, args, queries, elapsed_ms, kind="lexical")
+    return _group_results(rows, len(queries))
+
+
+async def _embed_within_budget(coro, budget_ms: float | None):
+    """Await a query embedding for at most budget_ms (0 = no limit).
+
+    Returns None if it times out or the backend fails. A timed-out request
+    keeps running in the background so its result still lands in the cache.
+    """
+    budget_ms = settings.search_budget_ms if budget_ms is None else budget_ms
+    task = asyncio.ensure_future(coro)
+    try:
+        with metrics.stage("embed"):
+            if budget_ms > 0:
+                return await asyncio.wait_for(asyncio.shield(task), budget_ms / 1000)
+            return await task
+    except TimeoutError:
+        _search_stats["embed_timeouts"] += 1
+        logger.warning("Query embedding exceeded %.0f ms budget, using lexical search", budget_ms)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    except Exception:
+        _search_stats["embed_errors"] += 1
+        logger.warning("Query embedding failed, using lexical search", exc_info=True)
     return None
 
 
+def search_stats() -> dict:
+    return dict(_search_stats)
+
+
+async def _search_across_swap(run, vectors: list[np.ndarray], reembed):
+    """Await run(vectors), re-embedding once if a re-index swap landed meanwhile.
+
+    A query embedded at the old dimension just before the swap no longer
+    matches the column afterwards.
+    """
+    try:
+        return await run(vectors)
+    except asyncpg.DataError:
+        if not _dim_changed(vectors):
+            raise
+    # The full vectors are cached, so this is only a truncation
+    return await run(await reembed())
+
+
 async def memory_search(
     query: str,
     scope: str = "user",
     user_id: str = "default",
     limit: int = 5,
-) -> list[MemoryItem]:
-    """Hybrid vector + trigram search, scoped to a specific user."""
-    pool = await get_pool()
-    query_embedding = await embed(query)
+    budget_ms: float | None = None,
+) -> tuple[list[MemoryItem], bool]:
+    """Hybrid vector + trigram search, scoped to a specific user.
 
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            WITH vector_results AS (
-                SELECT
-                    key, value, scope, user_id, tags, tags_search,
-                    1 - (embedding <=> $1) AS vec_score,
-                    similarity(search_text, $2) AS trgm_score
-                FROM memories
-                WHERE (expires_at IS NULL OR expires_at > NOW())
-                  AND scope = $3
-                  AND user_id = $4
-                ORDER BY embedding <=> $1
-                LIMIT $5 * 3
-            )
-            SELECT *,
-                   vec_score + ($6 * trgm_score) AS combined_score
-            FROM vector_results
-            WHERE vec_score >= $7 OR trgm_score >= $8
-            ORDER BY combined_score DESC
-            LIMIT $5
-            """,
-            query_embedding,
-            query,
-            scope,
-            user_id,
-            limit,
-            settings.trigram_weight,
-            settings.vector_threshold,
-            settings.trigram_threshold,
+    If the query embedding takes longer than budget_ms (default
+    settings.search_budget_ms), falls back to trigram-only search.
+    Returns (results, degraded).
+    """
+    query_embedding = await _embed_within_budget(embed(query), budget_ms)
+
+    _search_stats["searches"] += 1
+    if query_embedding is None:
+        _search_stats["degraded"] += 1
+        async with acquire() as conn:
+            results = await _lexical_search(conn, [query], scope, user_id, limit)
+        return results[0], True
+
+    async def run(vectors: list[np.ndarray]) -> list[list[MemoryItem]]:
+        async with acquire() as conn:
+            return await _search(conn, [query], vectors, scope, user_id, limit)
+
+    async def reembed() -> list[np.ndarray]:
+        return [await embed(query)]
+
+    results = await _search_across_swap(run, [query_embedding], reembed)
+    return results[0], False
+
+
+async def memory_search_many(
+    queries: list[str],
+    scope: str = "user",
+    user_id: str = "default",
+    limit: int = 5,
+    budget_ms: float | None = None,
+) -> tuple[list[list[MemoryItem]], bool]:
+    """Run several searches with one embedding request and one SQL statement.
+
+    Falls back to trigram-only search like memory_search. Returns (results, degraded).
+    """
+    query_embeddings = await _embed_within_budget(embed_batch(queries), budget_ms)
+
+    _search_stats["searches"] += 1
+    if query_embeddings is None:
+        _search_stats["degraded"] += 1
+        async with acquire() as conn:
+            return await _lexical_search(conn, queries, scope, user_id, limit), True
+
+    async def run(vectors: list[np.ndarray]) -> list[list[MemoryItem]]:
+        async with acquire() as conn:
+            return await _search(conn, queries, vectors, scope, user_id, limit)
+
+    results = await _search_across_swap(run, query_embeddings, lambda: embed_batch(queries))
+    return results, False
+
+
+async def memory_recall(
+    query: str,
+    targets: list[RecallTarget],
+    limit: int | None = None,
+    budget_ms: float | None = None,
+) -> tuple[list[MemoryItem], bool]:
+    """Search several (user_id, scope) targets with one embedding and one SQL statement.
+
+    Each target returns up to its own limit, scored like memory_search and
+    multiplied by its weight. The lists are merged into one ranking of at most
+    limit items (default: the sum of the target limits). A memory found through
+    more than one target is listed once, with its best score. Falls back to
+    trigram-only search like memory_search. Returns (results, degraded).
+    """
+    query_embedding = await _embed_within_budget(embed(query), budget_ms)
+
+    async def run(vectors: list[np.ndarray]) -> list[list[MemoryItem]]:
+        paths = tuple(search_planner.choose_path(t.user_id, t.scope) for t in targets)
+        sql = _recall_sql(paths, settings.vector_storage, get_embedding_dim())
+        args = (
+            [Vector(v) for v in vectors],
+            [query],
+            *_search_params([(t.scope, t.user_id, t.limit) for t in targets]),
         )
+        async with acquire() as conn:
+            started = time.perf_counter()
+            rows = await conn.fetch(sql, *args)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        slow_search.observe(sql, args, [query], elapsed_ms, kind="recall")
+        return _group_results(rows, len(targets), group="target")
 
-        results = []
-        keys_to_update = []
-        for row in rows:
-            results.append(
-                MemoryItem(
-                    key=row["key"],
-                    value=row["value"],
-                    scope=row["scope"],
-                    user_id=row["user_id"],
-                    tags=row["tags"],
-                    tags_search=row["tags_search"],
-                    score=round(float(row["combined_score"]), 4),
-                )
-            )
-            keys_to_update.append(row["key"])
+    async def reembed() -> list[np.ndarray]:
+        return [await embed(query)]
 
-        if keys_to_update:
-            await conn.execute(
-                "UPDATE memories SET last_used_at = NOW() WHERE key = ANY($1) AND user_id = $2",
-                keys_to_update,
-                user_id,
-            )
+    _search_stats["searches"] += 1
+    if query_embedding is None:
+        _search_stats["degraded"] += 1
+        async with acquire() as conn:
+            # Rare fallback path: one GIN lookup per target
+            grouped = [
+                (await _lexical_search(conn, [query], t.scope, t.user_id, t.limit))[0]
+                for t in targets
+            ]
+    else:
+        grouped = await _search_across_swap(run, [query_embedding], reembed)
 
-    return results
+    best: dict[tuple[str, str], MemoryItem] = {}
+    for t, items in zip(targets, grouped):
+        for item in items:
+            item.score = round((item.score or 0.0) * t.weight, 4)
+            current = best.get((item.user_id, item.key))
+            if current is None or item.score > current.score:
+                best[(item.user_id, item.key)] = item
+    ranked = sorted(best.values(), key=lambda item: item.score, reverse=True)
+    limit = sum(t.limit for t in targets) if limit is None else limit
+    return ranked[:limit], query_embedding is None
 
 
 async def memory_forget(key: str, user_id: str = "default") -> bool:
     """Delete a memory by key for a specific user. Returns True if found and deleted."""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire() as conn:
         result = await conn.execute(
             "DELETE FROM memories WHERE key = $1 AND user_id = $2",
             key,
             user_id,
         )
+    memory_cache.invalidate(user_id, key)
     return result == "DELETE 1"
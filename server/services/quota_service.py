@@ -0,0 +1,197 @@
+"""Per-user and per-scope row quotas with least-recently-used eviction.
+
+Search cost and index size grow with every stored row, and some users
+accumulate thousands of memories. Every quota_interval seconds this task
+finds the users (and user/scope pairs) holding more live rows than their cap
+with one GROUP BY each, then evicts the rows with the oldest last_used_at
+until they fit, quota_batch_size rows per statement. Nothing is checked on
+the write path.
+
+Scope caps are enforced before the per-user cap, so a user over both only
+loses what the stricter limit requires. With quota_archive set, evicted rows
+are copied into memories_archive (without their embedding) instead of being
+dropped outright.
+"""
+
+import asyncio
+import logging
+
+from server import metrics
+from server.config import settings
+from server.db import get_pool
+from server.services import touch_service
+from server.services.memory_cache import cache as memory_cache
+
+logger = logging.getLogger(__name__)
+
+_USERS_OVER_SQL = """
+    SELECT user_id, NULL::text AS scope, $1::int AS cap
+    FROM memories
+    WHERE (expires_at IS NULL OR expires_at > NOW())
+      AND ($2::text[] IS NULL OR user_id = ANY($2))
+    GROUP BY user_id
+    HAVING count(*) > $1
+"""
+
+_SCOPES_OVER_SQL = """
+    SELECT m.user_id, m.scope, l.cap
+    FROM memories m
+    JOIN unnest($1::text[], $2::int[]) AS l(scope, cap) ON m.scope = l.scope
+    WHERE (m.expires_at IS NULL OR m.expires_at > NOW())
+      AND ($3::text[] IS NULL OR m.user_id = ANY($3))
+    GROUP BY m.user_id, m.scope, l.cap
+    HAVING count(*) > l.cap
+"""
+
+# Targets are (user_id, scope, cap); a NULL scope caps all of the user's rows.
+# Rows are ranked newest-first within each target and everything past the cap
+# goes, at most $4 rows per statement. $5 copies them to memories_archive.
+_EVICT_SQL = """
+    WITH ranked AS (
+        SELECT m.id, l.cap,
+               row_number() OVER (
+                   PARTITION BY l.user_id, l.scope
+                   ORDER BY m.last_used_at DESC, m.id DESC
+               ) AS rank
+        FROM memories m
+        JOIN unnest($1::text[], $2::text[], $3::int[]) AS l(user_id, scope, cap)
+          ON m.user_id = l.user_id AND (l.scope IS NULL OR m.scope = l.scope)
+        WHERE m.expires_at IS NULL OR m.expires_at > NOW()
+    ),
+    victims AS (
+        SELECT id FROM ranked WHERE rank > cap LIMIT $4
+    ),
+    evicted AS (
+        DELETE FROM memories m USING victims v
+        WHERE m.id = v.id
+        RETURNING m.id, m.key, m.value, m.scope, m.user_id, m.tags,
+                  m.created_at, m.last_used_at, m.expires_at
+    ),
+    archived AS (
+        INSERT INTO memories_archive
+            (id, key, value, scope, user_id, tags, created_at, last_used_at, expires_at)
+        SELECT id, key, value, scope, user_id, tags, created_at, last_used_at, expires_at
+        FROM evicted
+        WHERE $5::boolean
+        ON CONFLICT (id) DO NOTHING
+    )
+    SELECT key, user_id FROM evicted
+"""
+
+evicted_rows = metrics.Counter(
+    "hamem_quota_evicted_rows_total",
+    "Memories evicted for exceeding a row quota, by which limit was hit",
+    ("limit",),
+)
+
+_task: asyncio.Task | None = None
+_stats = {"passes": 0, "rows_evicted": 0, "rows_archived": 0, "errors": 0, "last_pass_targets": 0}
+
+
+def parse_scope_limits(spec: str) -> dict[str, int]:
+    """Parse "scope=cap,scope=cap" into a dict. Raises ValueError on bad entries."""
+    limits = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        scope, sep, cap = part.partition("=")
+        if not sep or not scope.strip():
+            raise ValueError(f"Invalid quota scope limit {part.strip()!r}, expected scope=count")
+        limits[scope.strip()] = int(cap)
+    return limits
+
+
+async def _evict(conn, targets: list, limit: str) -> int:
+    """Evict rows past the cap of each target. Returns the number of rows removed."""
+    batch_size = max(1, settings.quota_batch_size)
+    args = (
+        [t["user_id"] for t in targets],
+        [t["scope"] for t in targets],
+        [t["cap"] for t in targets],
+        batch_size,
+        settings.quota_archive,
+    )
+    total = 0
+    while True:
+        rows = await conn.fetch(_EVICT_SQL, *args)
+        for row in rows:
+            memory_cache.invalidate(row["user_id"], row["key"])
+        evicted_rows.inc(limit, amount=len(rows))
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+        # Let request traffic in between batches
+        await asyncio.sleep(0)
+
+
+async def enforce(user_ids: list[str] | None = None) -> int:
+    """Bring every user (or just user_ids) within quota. Returns rows evicted."""
+    scope_limits = parse_scope_limits(settings.quota_scope_limits)
+    if not scope_limits and settings.quota_max_rows_per_user <= 0:
+        return 0
+    # Buffered touches are part of the recency we rank by
+    await touch_service.flush()
+
+    pool = await get_pool()
+    total = 0
+    targets_seen = 0
+    async with pool.acquire() as conn:
+        if scope_limits:
+            targets = await conn.fetch(
+                _SCOPES_OVER_SQL, list(scope_limits), list(scope_limits.values()), user_ids
+            )
+            targets_seen += len(targets)
+            if targets:
+                total += await _evict(conn, targets, "scope")
+        if settings.quota_max_rows_per_user > 0:
+            targets = await conn.fetch(_USERS_OVER_SQL, settings.quota_max_rows_per_user, user_ids)
+            targets_seen += len(targets)
+            if targets:
+                total += await _evict(conn, targets, "user")
+
+    _stats["passes"] += 1
+    _stats["last_pass_targets"] = targets_seen
+    _stats["rows_evicted"] += total
+    if settings.quota_archive:
+        _stats["rows_archived"] += total
+    if total:
+        logger.info("Evicted %d memories over quota from %d users/scopes", total, targets_seen)
+    return total
+
+
+async def _enforce_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.quota_interval)
+        try:
+            await enforce()
+        except Exception:
+            _stats["errors"] += 1
+            logger.exception("Failed to enforce memory quotas")
+
+
+async def start() -> None:
+    global _task
+    # Fail at startup rather than on every pass if the limits don't parse
+    parse_scope_limits(settings.quota_scope_limits)
+    if _task is None and settings.quota_interval > 0:
+        _task = asyncio.create_task(_enforce_loop())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return {
+        "max_rows_per_user": settings.quota_max_rows_per_user,
+        "scope_limits": parse_scope_limits(settings.quota_scope_limits),
+        "archive": settings.quota_archive,
+        **_stats,
+    }
@@ -0,0 +1,101 @@
+"""Background deletion of expired memories.
+
+Reads already hide rows past expires_at, but until they are deleted they stay
+in the HNSW and GIN indexes and are still visited by every ANN walk. Every
+reap_interval seconds this task deletes them reap_batch_size rows at a time,
+found through the partial index on expires_at, so no single statement holds
+locks for long. After a large pass it runs VACUUM so the index entries are
+actually removed.
+"""
+
+import asyncio
+import logging
+import time
+
+from server import metrics
+from server.config import settings
+from server.db import get_pool
+from server.services.memory_cache import cache as memory_cache
+
+logger = logging.getLogger(__name__)
+
+_REAP_SQL = """
+    DELETE FROM memories
+    WHERE id IN (
+        SELECT id FROM memories
+        WHERE expires_at IS NOT NULL AND expires_at <= NOW()
+        ORDER BY expires_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING key, user_id
+"""
+
+reaped_rows = metrics.Counter("hamem_reaped_rows_total", "Expired memories deleted", ())
+reap_batch_seconds = metrics.Histogram("hamem_reap_batch_seconds", "Time per reaper DELETE batch", ())
+
+_task: asyncio.Task | None = None
+_stats = {"passes": 0, "rows_reaped": 0, "batches": 0, "vacuums": 0, "errors": 0, "last_pass_rows": 0}
+
+
+async def reap() -> int:
+    """Delete every expired memory in batches. Returns the number of rows deleted."""
+    pool = await get_pool()
+    batch_size = max(1, settings.reap_batch_size)
+    total = 0
+    while True:
+        started = time.perf_counter()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(_REAP_SQL, batch_size)
+        reap_batch_seconds.observe(time.perf_counter() - started)
+        _stats["batches"] += 1
+        for row in rows:
+            memory_cache.invalidate(row["user_id"], row["key"])
+        reaped_rows.inc(amount=len(rows))
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+        # Let request traffic in between batches
+        await asyncio.sleep(0)
+
+    _stats["passes"] += 1
+    _stats["rows_reaped"] += total
+    _stats["last_pass_rows"] = total
+    if settings.reap_vacuum_threshold > 0 and total >= settings.reap_vacuum_threshold:
+        async with pool.acquire() as conn:
+            await conn.execute("VACUUM (ANALYZE) memories")
+        _stats["vacuums"] += 1
+    if total:
+        logger.info("Reaped %d expired memories", total)
+    return total
+
+
+async def _reap_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.reap_interval)
+        try:
+            await reap()
+        except Exception:
+            _stats["errors"] += 1
+            logger.exception("Failed to reap expired memories")
+
+
+async def start() -> None:
+    global _task
+    if _task is None and settings.reap_interval > 0:
+        _task = asyncio.create_task(_reap_loop())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,237 @@
+"""Online migration of stored embeddings to a new HAMEM_EMBED_DIM.
+
+The existing column keeps serving reads and writes while vectors at the new
+dimension are written to a shadow column, embedding_next. Shrinking truncates
+the stored vectors in SQL: a Matryoshka prefix of a prefix is still a prefix, so
+nothing needs re-embedding. Growing re-embeds search_text. A trigger clears
+embedding_next whenever a row's embedding changes, so rows written during the
+backfill are picked up again. Once every row is filled, the new ANN index is
+built CONCURRENTLY and the columns are swapped in one short transaction, which
+first fills in the rows written since the backfill while writers are locked out.
+When growing, that fill calls the embedding backend, so it is capped at one
+batch of reindex_batch_size rows. With more stragglers than that, the swap
+gives up the lock, backfills them outside it and tries again.
+"""
+
+import asyncio
+import logging
+
+import asyncpg
+from pgvector import Vector
+
+from server import db, embeddings, migrations
+from server.config import settings
+from server.db import get_pool
+
+logger = logging.getLogger(__name__)
+
+NEXT_COLUMN = "embedding_next"
+NEXT_INDEX = "idx_memories_embedding_next"
+
+_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION memories_reset_embedding_next() RETURNS trigger AS $$
+BEGIN
+    IF NEW.embedding IS DISTINCT FROM OLD.embedding THEN
+        NEW.embedding_next := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS memories_reset_embedding_next ON memories;
+CREATE TRIGGER memories_reset_embedding_next
+    BEFORE UPDATE OF embedding ON memories
+    FOR EACH ROW EXECUTE FUNCTION memories_reset_embedding_next();
+"""
+
+_PENDING = "embedding_next IS NULL AND embedding IS NOT NULL"
+
+_task: asyncio.Task | None = None
+_state = {
+    "state": "idle", "from_dim": None, "to_dim": None, "rows_done": 0, "rows_total": 0,
+    "swap_retries": 0,
+}
+
+
+async def _column_type(conn: asyncpg.Connection, column: str) -> str | None:
+    return await conn.fetchval(
+        """
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'memories'::regclass AND attname = $1 AND NOT attisdropped
+        """,
+        column,
+    )
+
+
+async def _prepare(conn: asyncpg.Connection, column_type: str) -> None:
+    """Create the shadow column and trigger, discarding leftovers from an older target."""
+    existing = await _column_type(conn, NEXT_COLUMN)
+    if existing is not None and existing != column_type:
+        await conn.execute(f"ALTER TABLE memories DROP COLUMN {NEXT_COLUMN}")
+    await conn.execute(f"ALTER TABLE memories ADD COLUMN IF NOT EXISTS {NEXT_COLUMN} {column_type}")
+    await conn.execute(_TRIGGER_SQL)
+
+
+async def _truncate_rows(conn: asyncpg.Connection, dim: int, column_type: str, limit: int | None) -> int:
+    result = await conn.execute(
+        f"""
+        UPDATE memories
+        SET {NEXT_COLUMN} = l2_normalize(subvector(embedding::vector, 1, $1))::{column_type}
+        WHERE id IN (SELECT id FROM memories WHERE {_PENDING} LIMIT $2)
+        """,
+        dim,
+        limit,
+    )
+    return int(result.split()[-1])
+
+
+async def _reembed_rows(conn: asyncpg.Connection, dim: int, column_type: str, limit: int) -> int:
+    rows = await conn.fetch(
+        f"SELECT id, search_text, content_hash FROM memories WHERE {_PENDING} ORDER BY id LIMIT $1",
+        limit,
+    )
+    if not rows:
+        return 0
+    vectors = await embeddings.embed_batch([r["search_text"] for r in rows], cache=False, dim=dim)
+    # Rows rewritten since they were read keep a NULL and come round again
+    await conn.execute(
+        f"""
+        UPDATE memories m SET {NEXT_COLUMN} = t.embedding::{column_type}
+        FROM unnest($1::bigint[], $2::text[], $3::vector[]) AS t(id, content_hash, embedding)
+        WHERE m.id = t.id AND m.content_hash = t.content_hash
+        """,
+        [r["id"] for r in rows],
+        [r["content_hash"] for r in rows],
+        [Vector(v) for v in vectors],
+    )
+    return len(rows)
+
+
+async def _backfill(pool: asyncpg.Pool, source_dim: int, dim: int, column_type: str) -> None:
+    while True:
+        async with pool.acquire() as conn:
+            if dim < source_dim:
+                done = await _truncate_rows(conn, dim, column_type, settings.reindex_batch_size)
+            else:
+                done = await _reembed_rows(conn, dim, column_type, settings.reindex_batch_size)
+        if not done:
+            return
+        _state["rows_done"] += done
+
+
+async def _swap(conn: asyncpg.Connection, source_dim: int, dim: int, column_type: str, index_name: str) -> bool:
+    """Replace embedding with embedding_next.
+
+    Returns False, without changing anything, if too many rows were written
+    since the backfill to re-embed them while writers wait.
+    """
+    async with conn.transaction():
+        # Blocks writers (not readers) while the last stragglers are filled in
+        await conn.execute("LOCK TABLE memories IN SHARE ROW EXCLUSIVE MODE")
+        if dim < source_dim:
+            await _truncate_rows(conn, dim, column_type, None)
+        else:
+            pending = await conn.fetchval(f"SELECT count(*) FROM memories WHERE {_PENDING}")
+            if pending > settings.reindex_batch_size:
+                return False
+            if pending:
+                _state["rows_done"] += await _reembed_rows(conn, dim, column_type, pending)
+        await conn.execute("DROP TRIGGER IF EXISTS memories_reset_embedding_next ON memories")
+        await conn.execute("DROP FUNCTION IF EXISTS memories_reset_embedding_next()")
+        for name in migrations.EMBEDDING_INDEXES:
+            await conn.execute(f"DROP INDEX IF EXISTS {name}")
+        await conn.execute("ALTER TABLE memories DROP COLUMN embedding")
+        await conn.execute(f"ALTER TABLE memories RENAME COLUMN {NEXT_COLUMN} TO embedding")
+        # Partial indexes on the old column went with it
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_memories_pending_embedding ON memories (id) "
+            "WHERE embedding IS NULL"
+        )
+        await conn.execute(f"ALTER INDEX {NEXT_INDEX} RENAME TO {index_name}")
+        await migrations.record_index_definition(
+            conn, index_name, migrations.storage_spec(settings.vector_storage, dim)[2]
+        )
+        # Switch before commit: writers blocked on the lock resume against the new column
+        db.set_embedding_dim(dim)
+        embeddings.set_output_dim(dim)
+    return True
+
+
+async def reindex(source_dim: int, dim: int) -> None:
+    """Migrate every stored embedding from source_dim to dim."""
+    column_type, index_name, index_def = migrations.storage_spec(
+        settings.vector_storage, dim, NEXT_COLUMN
+    )
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await _prepare(conn, column_type)
+        _state["rows_total"] = await conn.fetchval(
+            "SELECT count(*) FROM memories WHERE embedding IS NOT NULL"
+        )
+        _state["rows_done"] = _state["rows_total"] - await conn.fetchval(
+            f"SELECT count(*) FROM memories WHERE {_PENDING}"
+        )
+
+    _state["state"] = "backfilling"
+    await _backfill(pool, source_dim, dim, column_type)
+    _state["state"] = "indexing"
+    async with pool.acquire() as conn:
+        await migrations.build_index(conn, NEXT_INDEX, f"memories {index_def}")
+    while True:
+        # Catch up on rows written meanwhile, so few are left for the swap
+        _state["state"] = "backfilling"
+        await _backfill(pool, source_dim, dim, column_type)
+        _state["state"] = "swapping"
+        async with pool.acquire() as conn:
+            try:
+                if await _swap(conn, source_dim, dim, column_type, index_name):
+                    break
+            except BaseException:
+                db.set_embedding_dim(source_dim)
+                embeddings.set_output_dim(source_dim)
+                raise
+        _state["swap_retries"] += 1
+    _state["state"] = "done"
+    logger.info("Re-indexed %d embeddings from %d to %d dimensions", _state["rows_total"], source_dim, dim)
+
+
+async def _run(source_dim: int, dim: int) -> None:
+    try:
+        await reindex(source_dim, dim)
+    except asyncio.CancelledError:
+        _state["state"] = "interrupted"
+        raise
+    except Exception:
+        _state["state"] = "failed"
+        logger.exception("Embedding re-index from %d to %d dimensions failed", source_dim, dim)
+
+
+async def start() -> None:
+    """Start migrating to settings.embed_dim if the stored dimension differs.
+
+    Until the migration finishes, embeddings are produced at the old dimension
+    so searches and writes keep working against the old column.
+    """
+    global _task
+    source_dim = db.get_embedding_dim()
+    if _task is not None or source_dim == settings.embed_dim:
+        return
+    embeddings.set_output_dim(source_dim)
+    _state.update(from_dim=source_dim, to_dim=settings.embed_dim)
+    _task = asyncio.create_task(_run(source_dim, settings.embed_dim))
+
+
+async def stop() -> None:
+    """Cancel a running migration; the next startup resumes where it left off."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return dict(_state)
@@ -0,0 +1,112 @@
+"""Chooses between exact and HNSW vector search per (user_id, scope).
+
+For a user/scope with few rows, a brute-force scan over just those rows is fast
+and returns exact neighbours. An HNSW walk filtered on user_id/scope can instead
+come back short when most of the graph belongs to other users. Larger groups use
+the filtered HNSW path with iterative scans (see hnsw_* settings).
+
+Row counts are cached in-process. A background task reloads them every
+planner_refresh_interval seconds with a single GROUP BY, so searches only
+read the cache and never wait on the count. Until the first load every
+group counts as empty and gets the exact path.
+"""
+
+import asyncio
+import logging
+import time
+
+from server.config import settings
+from server.db import get_pool
+
+logger = logging.getLogger(__name__)
+
+EXACT = "exact"
+ANN = "ann"
+
+_counts: dict[tuple[str, str], int] = {}
+_loaded_at = 0.0
+_task: asyncio.Task | None = None
+_stats = {path: {"searches": 0, "total_ms": 0.0, "max_ms": 0.0} for path in (EXACT, ANN)}
+_refresh_stats = {"refreshes": 0, "refresh_errors": 0}
+
+
+async def refresh() -> None:
+    """Reload the per-user/scope row counts."""
+    global _counts, _loaded_at
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT user_id, scope, count(*) AS n
+            FROM memories
+            WHERE expires_at IS NULL OR expires_at > NOW()
+            GROUP BY user_id, scope
+            """
+        )
+    _counts = {(r["user_id"], r["scope"]): r["n"] for r in rows}
+    _loaded_at = time.monotonic()
+    _refresh_stats["refreshes"] += 1
+
+
+def row_count(user_id: str, scope: str) -> int:
+    return _counts.get((user_id, scope), 0)
+
+
+def choose_path(user_id: str, scope: str) -> str:
+    return EXACT if row_count(user_id, scope) < settings.exact_search_threshold else ANN
+
+
+def record(path: str, elapsed_ms: float) -> None:
+    stat = _stats[path]
+    stat["searches"] += 1
+    stat["total_ms"] += elapsed_ms
+    stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+
+
+async def _refresh_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.planner_refresh_interval)
+        try:
+            await refresh()
+        except Exception:
+            _refresh_stats["refresh_errors"] += 1
+            logger.exception("Failed to refresh search planner row counts")
+
+
+async def start() -> None:
+    global _task
+    if _task is None:
+        try:
+            await refresh()
+        except Exception:
+            _refresh_stats["refresh_errors"] += 1
+            logger.exception("Failed to load search planner row counts")
+        _task = asyncio.create_task(_refresh_loop())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return {
+        "exact_threshold": settings.exact_search_threshold,
+        "tracked_groups": len(_counts),
+        "counts_age_s": round(time.monotonic() - _loaded_at, 1) if _loaded_at else None,
+        **_refresh_stats,
+        **{
+            path: {
+                "searches": s["searches"],
+                "avg_ms": round(s["total_ms"] / s["searches"], 3) if s["searches"] else 0.0,
+                "max_ms": round(s["max_ms"], 3),
+            }
+            for path, s in _stats.items()
+        },
+    }
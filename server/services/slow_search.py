@@ -0,0 +1,164 @@
+"""Opt-in sampler that captures EXPLAIN plans for slow searches.
+
+When a search statement takes longer than slow_search_ms, a sampled fraction
+of them (slow_search_sample_rate) is re-run in the background under
+EXPLAIN (ANALYZE, BUFFERS) with the same parameters. The plan is kept in a
+ring buffer of the last slow_search_buffer_size captures, served by
+GET /admin/slow_searches. The request that triggered the capture is not
+delayed, but the capture runs the search a second time.
+
+Query text is personal data, so it never enters the buffer. Query parameters
+are replaced by their length and embeddings by their dimension. In the plan,
+every string constant is redacted unless it is cast to a numeric, boolean or
+time type, since Postgres prints constants SQL-escaped ('' for ') or quoted as
+array elements and a plain substring match would miss them. Query text left
+anywhere else in a plan string is replaced as well.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import re
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+from pgvector import Vector
+
+from server.config import settings
+from server.db import get_pool
+
+logger = logging.getLogger(__name__)
+
+REDACTED = "<redacted>"
+_MAX_PLAN_STRING = 512
+
+# A SQL string constant as EXPLAIN prints it, with the type it is cast to
+_CONSTANT = re.compile(r"'(?:[^']|'')*'(?:::([a-z ]+))?")
+# Casts whose constants can't hold query text and help read the plan
+_KEPT_TYPES = (
+    "double precision", "numeric", "real", "integer", "bigint", "smallint",
+    "boolean", "interval", "timestamp", "date", "regclass", "oid",
+)
+
+_buffer: deque[dict] = deque(maxlen=max(1, settings.slow_search_buffer_size))
+_tasks: set[asyncio.Task] = set()
+_stats = {"slow": 0, "captured": 0, "capture_errors": 0}
+
+
+def _describe_param(value, queries: list[str]):
+    if isinstance(value, Vector):
+        return f"<vector dim={value.dimensions()}>"
+    if isinstance(value, np.ndarray):
+        return f"<vector dim={len(value)}>"
+    if isinstance(value, list):
+        if value and isinstance(value[0], (Vector, np.ndarray)):
+            return [_describe_param(v, queries) for v in value]
+        if value == queries:
+            return [f"{REDACTED} ({len(q)} chars)" for q in queries]
+    return value
+
+
+def _redact_constant(match: re.Match) -> str:
+    cast = match.group(1)
+    if cast and cast.startswith(_KEPT_TYPES):
+        return match.group(0)
+    return f"'{REDACTED}'" + (f"::{cast}" if cast else "")
+
+
+def _scrub(node, queries: list[str]):
+    """Strip string constants, query text and oversized literals from a JSON plan."""
+    if isinstance(node, dict):
+        return {k: _scrub(v, queries) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_scrub(v, queries) for v in node]
+    if isinstance(node, str):
+        node = _CONSTANT.sub(_redact_constant, node)
+        for q in queries:
+            for form in (q, q.replace("'", "''"), json.dumps(q)[1:-1]):
+                if form and form in node:
+                    node = node.replace(form, REDACTED)
+        if len(node) > _MAX_PLAN_STRING:
+            node = node[:_MAX_PLAN_STRING] + "…"
+    return node
+
+
+def _summarize(plan: dict) -> dict:
+    """Pull out what usually explains a slow search: which indexes ran and whether pages came from disk."""
+    indexes: list[str] = []
+    node_types: list[str] = []
+
+    def walk(node: dict) -> None:
+        node_types.append(node.get("Node Type", ""))
+        if "Index Name" in node:
+            indexes.append(node["Index Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    root = plan["Plan"]
+    walk(root)
+    return {
+        "planning_ms": plan.get("Planning Time"),
+        "execution_ms": plan.get("Execution Time"),
+        "indexes_used": sorted(set(indexes)),
+        "seq_scans": node_types.count("Seq Scan"),
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+    }
+
+
+async def _capture(sql: str, args: tuple, queries: list[str], info: dict) -> None:
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            raw = await conn.fetchval("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, *args)
+        plan = json.loads(raw)[0] if isinstance(raw, str) else raw[0]
+        _buffer.append({
+            **info,
+            **_summarize(plan),
+            "params": [_describe_param(a, queries) for a in args],
+            "plan": _scrub(plan, queries),
+        })
+        _stats["captured"] += 1
+    except Exception:
+        _stats["capture_errors"] += 1
+        logger.exception("Failed to capture EXPLAIN for slow search")
+
+
+def observe(sql: str, args: tuple, queries: list[str], elapsed_ms: float, **info) -> None:
+    """Report a finished search statement; captures its plan if slow and sampled.
+
+    info holds extra context stored with the capture (planner path etc.).
+    """
+    if settings.slow_search_ms <= 0 or elapsed_ms < settings.slow_search_ms:
+        return
+    _stats["slow"] += 1
+    if random.random() >= settings.slow_search_sample_rate:
+        return
+    info = {
+        "captured_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_ms": round(elapsed_ms, 3),
+        **info,
+    }
+    task = asyncio.create_task(_capture(sql, args, queries, info))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def entries() -> list[dict]:
+    """Captured plans, newest first."""
+    return list(reversed(_buffer))
+
+
+def clear() -> None:
+    _buffer.clear()
+
+
+def stats() -> dict:
+    return {
+        "threshold_ms": settings.slow_search_ms,
+        "sample_rate": settings.slow_search_sample_rate,
+        "buffered": len(_buffer),
+        **_stats,
+    }
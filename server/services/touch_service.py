@@ -0,0 +1,93 @@
+"""Write-behind buffer for last_used_at updates.
+
+Reads record which memories they returned here instead of issuing an UPDATE.
+A background task writes the buffered touches back as one bulk UPDATE every
+touch_flush_interval seconds, and once more on shutdown.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from server.config import settings
+from server.db import get_pool
+
+logger = logging.getLogger(__name__)
+
+_pending: dict[tuple[str, str], datetime] = {}
+_task: asyncio.Task | None = None
+_stats = {"flushes": 0, "rows_flushed": 0, "flush_errors": 0}
+
+
+def touch(user_id: str, keys: list[str]) -> None:
+    """Record that these memories were just used."""
+    now = datetime.now(timezone.utc)
+    for key in keys:
+        _pending[(key, user_id)] = now
+
+
+async def flush() -> int:
+    """Write buffered touches to the database. Returns the number of keys written."""
+    global _pending
+    if not _pending:
+        return 0
+    batch, _pending = _pending, {}
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE memories m
+                SET last_used_at = GREATEST(m.last_used_at, t.used_at)
+                FROM unnest($1::text[], $2::text[], $3::timestamptz[]) AS t(key, user_id, used_at)
+                WHERE m.key = t.key AND m.user_id = t.user_id
+                """,
+                [k for k, _ in batch],
+                [u for _, u in batch],
+                list(batch.values()),
+            )
+    except Exception:
+        # Put the batch back (newer touches win) so the next flush retries it
+        for ident, used_at in batch.items():
+            if ident not in _pending or _pending[ident] < used_at:
+                _pending[ident] = used_at
+        _stats["flush_errors"] += 1
+        raise
+    _stats["flushes"] += 1
+    _stats["rows_flushed"] += len(batch)
+    return len(batch)
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.touch_flush_interval)
+        try:
+            await flush()
+        except Exception:
+            logger.exception("Failed to flush last_used_at touches")
+
+
+async def start() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_flush_loop())
+
+
+async def stop() -> None:
+    """Cancel the background task and write whatever is still buffered."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    try:
+        await flush()
+    except Exception:
+        logger.exception("Failed to flush last_used_at touches on shutdown")
+
+
+def stats() -> dict:
+    return {**_stats, "pending": len(_pending)}
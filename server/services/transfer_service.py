@@ -0,0 +1,304 @@
+"""Streaming NDJSON export and import of memories, embeddings included.
+
+Export walks memories with a server-side cursor and yields one JSON object per
+line, so memory use doesn't grow with the store. Embeddings are sent as base64
+of their little-endian float32 bytes, about a third the size of a JSON float
+list and exact.
+
+Import reads the same format line by line and writes transfer_chunk_size rows
+at a time: COPY into a temporary table, then one INSERT ... ON CONFLICT into
+memories. Embeddings are reused as they are when the row's embed_model and
+dimension match this server's; only the other rows are re-embedded.
+"""
+
+import base64
+import json
+import logging
+from collections.abc import AsyncIterable, AsyncIterator
+from datetime import datetime
+
+import numpy as np
+from pgvector import Vector
+
+from server import embeddings, migrations
+from server.config import settings
+from server.db import get_embedding_dim, get_pool
+from server.services.memory_cache import cache as memory_cache
+from server.services.memory_service import _build_search_text, _content_hash
+
+logger = logging.getLogger(__name__)
+
+_EXPORT_COLUMNS = (
+    "key", "value", "scope", "user_id", "tags", "tags_search",
+    "created_at", "last_used_at", "expires_at", "embed_model",
+)
+
+_STAGING_SQL = """
+    CREATE TEMP TABLE memories_import (
+        seq             BIGINT,
+        key             TEXT,
+        value           TEXT,
+        scope           TEXT,
+        user_id         TEXT,
+        tags            TEXT,
+        tags_search     TEXT,
+        embedding       vector,
+        search_text     TEXT,
+        created_at      TIMESTAMPTZ,
+        last_used_at    TIMESTAMPTZ,
+        expires_at      TIMESTAMPTZ,
+        content_hash    TEXT,
+        embed_model     TEXT
+    ) ON COMMIT DROP
+"""
+
+# Later lines win when a chunk holds the same (key, user_id) twice
+_MERGE_SQL = """
+    INSERT INTO memories (
+        key, value, scope, user_id, tags, tags_search, embedding, search_text,
+        created_at, last_used_at, expires_at, content_hash, embed_model
+    )
+    SELECT DISTINCT ON (key, user_id)
+        key, value, scope, user_id, tags, tags_search, embedding::{column_type}, search_text,
+        COALESCE(created_at, NOW()), COALESCE(last_used_at, NOW()), expires_at,
+        content_hash, embed_model
+    FROM memories_import
+    ORDER BY key, user_id, seq DESC
+    ON CONFLICT (key, user_id) DO UPDATE SET
+        value = EXCLUDED.value,
+        scope = EXCLUDED.scope,
+        tags = EXCLUDED.tags,
+        tags_search = EXCLUDED.tags_search,
+        embedding = EXCLUDED.embedding,
+        search_text = EXCLUDED.search_text,
+        created_at = EXCLUDED.created_at,
+        last_used_at = EXCLUDED.last_used_at,
+        expires_at = EXCLUDED.expires_at,
+        content_hash = EXCLUDED.content_hash,
+        embed_model = EXCLUDED.embed_model
+"""
+
+_MAX_REPORTED_ERRORS = 20
+
+
+def encode_embedding(vec) -> str:
+    if isinstance(vec, Vector):
+        vec = vec.to_numpy()
+    return base64.b64encode(np.asarray(vec, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_embedding(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").astype(np.float32)
+
+
+def _timestamp(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+async def export_lines(
+    user_id: str | None = None, scope: str | None = None
+) -> AsyncIterator[bytes]:
+    """Yield every memory (optionally one user's, or one scope) as an NDJSON line."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            cursor = conn.cursor(
+                f"""
+                SELECT {", ".join(_EXPORT_COLUMNS)}, embedding::vector AS embedding
+                FROM memories
+                WHERE ($1::text IS NULL OR user_id = $1) AND ($2::text IS NULL OR scope = $2)
+                ORDER BY id
+                """,
+                user_id,
+                scope,
+                prefetch=max(1, settings.transfer_chunk_size),
+            )
+            async for row in cursor:
+                record = {name: row[name] for name in _EXPORT_COLUMNS}
+                for name in ("created_at", "last_used_at", "expires_at"):
+                    if record[name] is not None:
+                        record[name] = record[name].isoformat()
+                vec = row["embedding"]
+                record["embedding"] = encode_embedding(vec) if vec is not None else None
+                yield json.dumps(record, ensure_ascii=False).encode() + b"\n"
+
+
+async def _lines(body: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines without holding more than one line."""
+    pending = b""
+    async for chunk in body:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def _text(data: dict, name: str, default: str = "", nullable: bool = True) -> str:
+    """A string field of an import line; missing, empty or (if nullable) null gives default."""
+    if name not in data or data[name] == "" or (nullable and data[name] is None):
+        return default
+    value = data[name]
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+
+def _parse(line: bytes) -> dict:
+    """One import line as a row. Anything that would fail the chunk's COPY raises ValueError."""
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    key, value = data.get("key"), data.get("value")
+    if not isinstance(key, str) or not key or not isinstance(value, str):
+        raise ValueError("key and value must be non-empty strings")
+    tags = data.get("tags") or ""
+    if isinstance(tags, list):
+        tags = ", ".join(str(t) for t in tags)
+    elif not isinstance(tags, str):
+        raise ValueError("tags must be a string or a list")
+    embedding = _text(data, "embedding")
+    vector = decode_embedding(embedding) if embedding else None
+    if vector is not None and not np.isfinite(vector).all():
+        raise ValueError("embedding has non-finite values")
+    row = build_row(
+        key,
+        value,
+        scope=_text(data, "scope", "user", nullable=False),
+        user_id=_text(data, "user_id", "default", nullable=False),
+        tags=tags,
+        tags_search=_text(data, "tags_search"),
+        embedding=vector,
+        embed_model=_text(data, "embed_model"),
+        created_at=_timestamp(_text(data, "created_at")),
+        last_used_at=_timestamp(_text(data, "last_used_at")),
+        expires_at=_timestamp(_text(data, "expires_at")),
+    )
+    # Postgres text can't hold NUL, which JSON allows
+    for name in ("key", "value", "scope", "user_id", "tags", "tags_search", "embed_model"):
+        if "\x00" in row[name]:
+            raise ValueError(f"{name} must not contain NUL characters")
+    return row
+
+
+def build_row(
+    key: str,
+    value: str,
+    *,
+    scope: str = "user",
+    user_id: str = "default",
+    tags: str = "",
+    tags_search: str = "",
+    embedding: np.ndarray | None = None,
+    embed_model: str = "",
+    created_at: datetime | None = None,
+    last_used_at: datetime | None = None,
+    expires_at: datetime | None = None,
+) -> dict:
+    """A row as write_rows() takes it; search_text and content_hash are derived here."""
+    search_text = _build_search_text(key, value, tags)
+    return {
+        "key": key,
+        "value": value,
+        "scope": scope,
+        "user_id": user_id,
+        "tags": tags,
+        "tags_search": tags_search,
+        "embedding": embedding,
+        "search_text": search_text,
+        "created_at": created_at,
+        "last_used_at": last_used_at,
+        "expires_at": expires_at,
+        "content_hash": _content_hash(search_text),
+        "embed_model": embed_model,
+    }
+
+
+async def write_rows(rows: list[dict], stats: dict, first_seq: int = 0) -> None:
+    """Upsert rows from build_row() with one COPY, embedding those that need it.
+
+    Adds to stats["imported"] and stats["reembedded"].
+    """
+    model, dim = embeddings.model_id(), get_embedding_dim()
+    stale = [
+        r for r in rows
+        if r["embed_model"] != model or r["embedding"] is None or len(r["embedding"]) != dim
+    ]
+    if stale:
+        vectors = await embeddings.embed_batch([r["search_text"] for r in stale], cache=False)
+        for row, vec in zip(stale, vectors):
+            row["embedding"] = vec
+            row["embed_model"] = model
+        stats["reembedded"] += len(stale)
+
+    records = [
+        (
+            first_seq + i, r["key"], r["value"], r["scope"], r["user_id"], r["tags"],
+            r["tags_search"], r["embedding"], r["search_text"], r["created_at"],
+            r["last_used_at"], r["expires_at"], r["content_hash"], r["embed_model"],
+        )
+        for i, r in enumerate(rows)
+    ]
+    column_type, _, _ = migrations.storage_spec(settings.vector_storage, dim)
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(_STAGING_SQL)
+            await conn.copy_records_to_table("memories_import", records=records)
+            await conn.execute(_MERGE_SQL.format(column_type=column_type))
+    for r in rows:
+        memory_cache.invalidate(r["user_id"], r["key"])
+    stats["imported"] += len(rows)
+
+
+async def import_lines(body: AsyncIterable[bytes], defer_index: bool = False) -> dict:
+    """Import NDJSON memories from a byte stream. Malformed lines are skipped and reported.
+
+    Inserting into the HNSW index row by row dominates the cost of a large
+    import. With defer_index the ANN index is dropped first and rebuilt in one
+    pass at the end, which is many times faster but leaves vector search
+    without an index until then, so it is meant for restores.
+    """
+    stats = {"imported": 0, "reembedded": 0, "skipped": 0, "errors": []}
+    if defer_index:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            for name in migrations.EMBEDDING_INDEXES:
+                await conn.execute(f"DROP INDEX IF EXISTS {name}")
+        try:
+            await _import(body, stats)
+        finally:
+            async with pool.acquire() as conn:
+                await migrations.apply_vector_storage(conn, settings.vector_storage)
+    else:
+        await _import(body, stats)
+    logger.info(
+        "Imported %d memories (%d re-embedded, %d lines skipped)",
+        stats["imported"], stats["reembedded"], stats["skipped"],
+    )
+    return stats
+
+
+async def _import(body: AsyncIterable[bytes], stats: dict) -> None:
+    chunk_size = max(1, settings.transfer_chunk_size)
+    chunk: list[dict] = []
+    first_seq = 0
+    line_no = 0
+    async for line in _lines(body):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            chunk.append(_parse(line))
+        except (ValueError, KeyError, TypeError) as e:
+            stats["skipped"] += 1
+            if len(stats["errors"]) < _MAX_REPORTED_ERRORS:
+                stats["errors"].append(f"line {line_no}: {e}")
+            continue
+        if len(chunk) >= chunk_size:
+            await write_rows(chunk, stats, first_seq)
+            first_seq += len(chunk)
+            chunk = []
+    if chunk:
+        await write_rows(chunk, stats, first_seq)
@@ -0,0 +1,45 @@
+"""Tests for the interactive/bulk admission lanes."""
+
+import asyncio
+
+import pytest
+
+from server.services.admission import BULK, INTERACTIVE, AdmissionController, Overloaded
+
+
+@pytest.mark.asyncio
+async def test_admission_prioritizes_interactive_and_sheds_load():
+    controller = AdmissionController(max_concurrent=1, bulk_max_concurrent=1, queue_size=1, queue_timeout=0.2)
+    order = []
+    release = asyncio.Event()
+
+    async def run(lane, name):
+        async with controller.slot(lane):
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.create_task(run(BULK, "bulk-1"))
+    await asyncio.sleep(0)
+    queued_bulk = asyncio.create_task(run(BULK, "bulk-2"))
+    queued_interactive = asyncio.create_task(run(INTERACTIVE, "interactive"))
+    await asyncio.sleep(0)
+
+    # Bulk queue (size 1) is full
+    with pytest.raises(Overloaded) as exc:
+        await controller._acquire(BULK)
+    assert exc.value.status_code == 429 and exc.value.retry_after >= 1
+
+    release.set()
+    await asyncio.gather(first, queued_bulk, queued_interactive)
+    assert order == ["bulk-1", "interactive", "bulk-2"]
+
+    # A request that waits past queue_timeout gets a 503
+    release.clear()
+    holder = asyncio.create_task(run(INTERACTIVE, "holder"))
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded) as exc:
+        await controller._acquire(INTERACTIVE)
+    assert exc.value.status_code == 503
+    release.set()
+    await holder
+    assert controller.stats()["interactive"]["active"] == 0
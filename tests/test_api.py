@@ -1,5 +1,8 @@
 """Integration tests for the HTTP API endpoints."""
 
+import asyncio
+from unittest.mock import patch
+
 import pytest
 
 
@@ -12,6 +15,19 @@ async def test_health(client):
     assert "checks" in data
 
 
+@pytest.mark.asyncio
+async def test_metrics(client):
+    await client.post("/memory/search", json={"query": "metrics probe", "user_id": "metrics_user"})
+    resp = await client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    body = resp.text
+    for stage in ("embed", "pool_wait", "query", "serialize"):
+        assert f'hamem_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'hamem_requests_total{endpoint="/memory/search",status="200"' in body
+    assert "hamem_pool_in_use " in body
+
+
 @pytest.mark.asyncio
 async def test_set_and_get(client):
     # Set
@@ -58,6 +74,302 @@ async def test_search(client):
     await client.post("/memory/forget", json={"key": "favorite_color"})
 
 
+@pytest.mark.asyncio
+async def test_set_batch(client):
+    resp = await client.post("/memory/set_batch", json={"items": [
+        {"key": "batch_color", "value": "green", "tags": "preference"},
+        {"key": "batch_city", "value": "Boise"},
+        {"key": "batch_color", "value": "red", "tags": "preference"},
+    ]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["status"] == "ok"
+    assert [r["status"] for r in data["results"]] == ["skipped", "ok", "ok"]
+
+    resp = await client.post("/memory/get", json={"key": "batch_color"})
+    assert resp.json()["memory"]["value"] == "red"
+
+    for key in ("batch_color", "batch_city"):
+        await client.post("/memory/forget", json={"key": key})
+
+
+@pytest.mark.asyncio
+async def test_search_batch(client):
+    await client.post("/memory/set", json={"key": "batch_search_pet", "value": "Rex the dog"})
+
+    resp = await client.post("/memory/search_batch", json={
+        "queries": ["batch search pet Rex", "batch search pet dog"],
+        "limit": 3,
+    })
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["status"] == "ok"
+    assert [g["query"] for g in data["results"]] == ["batch search pet Rex", "batch search pet dog"]
+    for group in data["results"]:
+        assert any(r["key"] == "batch_search_pet" for r in group["results"])
+
+    await client.post("/memory/forget", json={"key": "batch_search_pet"})
+
+
+@pytest.mark.asyncio
+async def test_search_batch_empty_query_rejected(client):
+    resp = await client.post("/memory/search_batch", json={"queries": []})
+    assert resp.status_code == 422
+
+    resp = await client.post("/memory/search_batch", json={"queries": ["ok", "  "]})
+    assert resp.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_recall_merges_targets(client):
+    memories = [
+        ("recall_alice", "user", "alice_coffee", "Alice takes her coffee black"),
+        ("recall_alice", "user", "alice_wifi", "the wifi password is hunter2"),
+        ("recall_house", "household", "coffee_machine", "the coffee machine is in the kitchen"),
+        ("recall_house", "household", "house_wifi", "the wifi password is hunter2"),
+    ]
+    for user_id, scope, key, value in memories:
+        await client.post("/memory/set", json={
+            "key": key, "value": value, "scope": scope, "user_id": user_id,
+        })
+
+    resp = await client.post("/memory/recall", json={
+        "query": "coffee and the wifi password",
+        "targets": [
+            {"user_id": "recall_alice", "scope": "user", "limit": 5},
+            {"user_id": "recall_house", "scope": "household", "limit": 5, "weight": 0.5},
+        ],
+    })
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["status"] == "ok"
+    keys = [r["key"] for r in data["results"]]
+    assert "alice_coffee" in keys and "coffee_machine" in keys
+    # Distinct memories are kept even when their values match
+    assert "alice_wifi" in keys and "house_wifi" in keys
+    assert len(keys) == len(set(keys))
+    scores = [r["score"] for r in data["results"]]
+    assert scores == sorted(scores, reverse=True)
+
+    resp = await client.post("/memory/recall", json={
+        "query": "coffee",
+        "targets": [{"user_id": "recall_alice", "limit": 1}],
+    })
+    assert [r["key"] for r in resp.json()["results"]] == ["alice_coffee"]
+
+    # Targets listed twice still return each memory once
+    target = {"user_id": "recall_alice", "scope": "user", "limit": 5}
+    resp = await client.post("/memory/recall", json={
+        "query": "coffee", "targets": [target, {**target, "weight": 2.0}],
+    })
+    keys = [r["key"] for r in resp.json()["results"]]
+    assert len(keys) == len(set(keys))
+
+    resp = await client.post("/memory/recall", json={"query": "coffee", "targets": []})
+    assert resp.status_code == 422
+    resp = await client.post("/memory/recall", json={"query": "coffee", "targets": [target] * 17})
+    assert resp.status_code == 422
+
+    for user_id, _, key, _ in memories:
+        await client.post("/memory/forget", json={"key": key, "user_id": user_id})
+
+
+@pytest.mark.asyncio
+async def test_search_falls_back_when_embedding_is_slow(client):
+    await client.post("/memory/set", json={
+        "key": "garage_code",
+        "value": "garage door code is 4417",
+        "tags": "garage door",
+    })
+
+    async def slow_embed(text):
+        await asyncio.sleep(1)
+
+    with patch("server.services.memory_service.embed", slow_embed):
+        resp = await client.post("/memory/search", json={
+            "query": "garage door code",
+            "budget_ms": 50,
+        })
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["degraded"] is True
+    assert data["results"][0]["key"] == "garage_code"
+
+    await client.post("/memory/forget", json={"key": "garage_code"})
+
+
+@pytest.mark.asyncio
+async def test_degraded_search_matches_short_query_in_long_memory(client):
+    user = "degraded_long_user"
+    await client.post("/memory/set", json={
+        "key": "alarm_details",
+        "value": (
+            "the alarm panel is in the hallway next to the coat rack, the installer "
+            "was Northside Security and the garage door code is 4417"
+        ),
+        "tags": "security house",
+        "user_id": user,
+    })
+
+    async def slow_embed(text):
+        await asyncio.sleep(1)
+
+    with patch("server.services.memory_service.embed", slow_embed):
+        resp = await client.post("/memory/search", json={
+            "query": "what is the garage door code",
+            "user_id": user,
+            "budget_ms": 50,
+        })
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["degraded"] is True
+    assert [r["key"] for r in data["results"]] == ["alarm_details"]
+
+    await client.post("/memory/forget", json={"key": "alarm_details", "user_id": user})
+
+
+@pytest.mark.asyncio
+async def test_slow_search_capture_is_redacted(client, monkeypatch):
+    from server.config import settings
+    from server.services import slow_search
+
+    monkeypatch.setattr(settings, "slow_search_ms", 0.001)
+    monkeypatch.setattr(settings, "slow_search_sample_rate", 1.0)
+    slow_search.clear()
+    resp = await client.post("/memory/search", json={"query": "private slow query text"})
+    assert resp.status_code == 200
+    await asyncio.gather(*slow_search._tasks)
+
+    resp = await client.get("/admin/slow_searches")
+    assert resp.status_code == 200
+    data = resp.json()
+    entry = data["entries"][0]
+    assert entry["kind"] == "hybrid"
+    assert entry["execution_ms"] is not None
+    assert "plan" in entry
+    assert "private slow query text" not in resp.text
+
+
+@pytest.mark.asyncio
+async def test_slow_search_capture_redacts_escaped_query(client, monkeypatch):
+    from server.config import settings
+    from server.services import slow_search
+
+    query = "what's my wife's name"
+    monkeypatch.setattr(settings, "slow_search_ms", 0.001)
+    monkeypatch.setattr(settings, "slow_search_sample_rate", 1.0)
+    slow_search.clear()
+    resp = await client.post("/memory/search", json={"query": query})
+    assert resp.status_code == 200
+    await asyncio.gather(*slow_search._tasks)
+    resp = await client.get("/admin/slow_searches")
+    assert "wife" not in resp.text
+
+    # EXPLAIN prints constants SQL-escaped and array-quoted
+    plan = {
+        "Filter": "(search_text % 'what''s my wife''s name'::text)",
+        "Index Cond": "(key = ANY ('{\"what''s my wife''s name\"}'::text[]))",
+        "Recheck Cond": "(vec_score >= '0.35'::double precision)",
+    }
+    scrubbed = slow_search._scrub(plan, [query])
+    assert "wife" not in str(scrubbed)
+    assert scrubbed["Recheck Cond"] == plan["Recheck Cond"]
+
+
+@pytest.mark.asyncio
+async def test_export_import_round_trip(client):
+    import json
+
+    user = "transfer_user"
+    await client.post("/memory/set", json={"key": "car_color", "value": "red", "user_id": user})
+    await client.post("/memory/set", json={"key": "pet_name", "value": "Rex", "user_id": user})
+
+    resp = await client.get("/memory/export", params={"user_id": user})
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(r["key"] for r in lines) == ["car_color", "pet_name"]
+    assert all(isinstance(r["embedding"], str) for r in lines)
+
+    for r in lines:
+        await client.post("/memory/forget", json={"key": r["key"], "user_id": user})
+    lines[1]["embed_model"] = "some-other-model"
+    body = "\n".join(json.dumps(r) for r in lines) + "\n{not json\n"
+    resp = await client.post("/memory/import", content=body)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["status"], data["imported"], data["reembedded"], data["skipped"]) == ("partial", 2, 1, 1)
+    assert data["errors"][0].startswith("line 3:")
+
+    resp = await client.post("/memory/get", json={"key": "car_color", "user_id": user})
+    assert resp.json()["memory"]["value"] == "red"
+    resp = await client.post("/memory/search", json={"query": "what pet do I have", "user_id": user})
+    assert "pet_name" in [r["key"] for r in resp.json()["results"]]
+
+    for r in lines:
+        await client.post("/memory/forget", json={"key": r["key"], "user_id": user})
+
+
+@pytest.mark.asyncio
+async def test_import_skips_lines_with_wrong_types(client, monkeypatch):
+    import json
+
+    from server.config import settings
+
+    user = "typed_import_user"
+    lines = [
+        {"key": "good_one", "value": "kept", "user_id": user},
+        {"key": "bad_scope", "value": "x", "scope": 5, "user_id": user},
+        {"key": "null_user", "value": "x", "user_id": None},
+        {"key": "bad_tags", "value": "x", "tags": {"a": 1}, "user_id": user},
+        {"key": "nul_value", "value": "a\u0000b", "user_id": user},
+        {"key": "good_two", "value": "kept too", "user_id": user},
+    ]
+    body = "\n".join(json.dumps(r) for r in lines)
+    resp = await client.post("/memory/import", content=body)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["status"], data["imported"], data["skipped"]) == ("partial", 2, 4)
+    assert [e.split(":")[0] for e in data["errors"]] == ["line 2", "line 3", "line 4", "line 5"]
+    for key in ("good_one", "good_two"):
+        resp = await client.post("/memory/get", json={"key": key, "user_id": user})
+        assert resp.json()["status"] == "ok"
+
+    # Dropping the ANN index mid-import needs the server's consent
+    resp = await client.post("/memory/import", params={"defer_index": "true"}, content=body)
+    assert resp.status_code == 403
+    monkeypatch.setattr(settings, "import_allow_defer_index", True)
+    resp = await client.post("/memory/import", params={"defer_index": "true"}, content=body)
+    assert resp.status_code == 200
+
+    for key in ("good_one", "good_two"):
+        await client.post("/memory/forget", json={"key": key, "user_id": user})
+
+
+@pytest.mark.asyncio
+async def test_export_rejected_when_bulk_lane_is_full(client, monkeypatch):
+    from server.services import admission
+
+    full = admission.AdmissionController(
+        max_concurrent=1, bulk_max_concurrent=0, queue_size=0, queue_timeout=1.0
+    )
+    monkeypatch.setattr(admission, "controller", full)
+    resp = await client.get("/memory/export")
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"]
+
+    # Single writes run in the interactive lane and still get through
+    resp = await client.post("/memory/set", json={"key": "lane_probe", "value": "x"})
+    assert resp.status_code == 200
+    await client.post("/memory/forget", json={"key": "lane_probe"})
+
+    monkeypatch.setattr(
+        admission, "controller", admission.AdmissionController(1, 1, 0, 1.0)
+    )
+    resp = await client.get("/memory/export", params={"user_id": "nobody_exports"})
+    assert resp.status_code == 200
+    assert admission.controller.stats()["bulk"]["active"] == 0
+
+
 @pytest.mark.asyncio
 async def test_forget(client):
     await client.post("/memory/set", json={"key": "to_delete", "value": "gone"})
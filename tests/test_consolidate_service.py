@@ -0,0 +1,67 @@
+"""Tests for near-duplicate merging on write and background consolidation."""
+
+import pytest
+
+from server.config import settings
+from server.db import get_pool
+from server.services import consolidate_service
+from server.services.memory_service import memory_get, memory_set
+
+
+async def _keys(user: str) -> list[str]:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT key FROM memories WHERE user_id = $1 ORDER BY key", user)
+    return [r["key"] for r in rows]
+
+
+@pytest.mark.asyncio
+async def test_near_duplicate_merges_unless_force_new(services, monkeypatch):
+    monkeypatch.setattr(settings, "dedup_threshold", 0.5)
+    user = "dedup_write_test"
+    try:
+        assert await memory_set("wife_name", "Sarah", user_id=user) == "wife_name"
+        assert await memory_set("spouse_name", "Sarah Jane", user_id=user) == "wife_name"
+        assert await _keys(user) == ["wife_name"]
+        assert (await memory_get("wife_name", user_id=user)).value == "Sarah Jane"
+
+        # Other scopes and force_new are never merged
+        await memory_set("spouse_name", "Sarah", scope="session", user_id=user)
+        await memory_set("spouse_name", "Sarah", user_id=user, force_new=True)
+        assert await _keys(user) == ["spouse_name", "wife_name"]
+    finally:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+
+
+@pytest.mark.asyncio
+async def test_consolidate_keeps_most_recently_used(services, monkeypatch):
+    monkeypatch.setattr(settings, "dedup_threshold", 0.5)
+    monkeypatch.setattr(settings, "dedup_archive", True)
+    user = "dedup_batch_test"
+    pool = await get_pool()
+    try:
+        await memory_set("wife_name", "Sarah", user_id=user, force_new=True)
+        await memory_set("spouse_name", "Sarah", user_id=user, force_new=True)
+        await memory_set("favourite_colour", "green", user_id=user, force_new=True)
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE memories SET last_used_at = NOW() - interval '1 day'
+                WHERE user_id = $1 AND key = 'spouse_name'
+                """,
+                user,
+            )
+
+        assert await consolidate_service.consolidate([user]) == 1
+        assert await _keys(user) == ["favourite_colour", "wife_name"]
+        async with pool.acquire() as conn:
+            archived = await conn.fetchval(
+                "SELECT key FROM memories_archive WHERE user_id = $1", user
+            )
+        assert archived == "spouse_name"
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+            await conn.execute("DELETE FROM memories_archive WHERE user_id = $1", user)
@@ -0,0 +1,47 @@
+"""Tests for write-behind memory_set and the background embed worker."""
+
+import pytest
+
+from server.db import get_pool
+from server.services import embed_worker
+from server.services.memory_service import memory_get, memory_search, memory_set
+
+
+@pytest.mark.asyncio
+async def test_write_behind_row_is_visible_then_embedded(services):
+    user = "write_behind_test"
+    pool = await get_pool()
+    try:
+        await memory_set(
+            "favourite_tea", "Earl Grey with lemon", user_id=user, write_behind=True
+        )
+        item = await memory_get("favourite_tea", user_id=user)
+        assert item is not None and item.value == "Earl Grey with lemon"
+        async with pool.acquire() as conn:
+            assert await conn.fetchval(
+                "SELECT embedding IS NULL FROM memories WHERE user_id = $1", user
+            )
+
+        # Pending rows are found through the trigram channel
+        results, _ = await memory_search("Earl Grey with lemon", user_id=user)
+        assert [r.key for r in results] == ["favourite_tea"]
+
+        assert await embed_worker.drain() >= 1
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT embedding IS NULL AS pending, embed_model FROM memories WHERE user_id = $1",
+                user,
+            )
+        assert not row["pending"] and row["embed_model"]
+
+        # Rewriting the same text keeps the embedding and leaves nothing pending
+        await memory_set(
+            "favourite_tea", "Earl Grey with lemon", user_id=user, write_behind=True
+        )
+        async with pool.acquire() as conn:
+            assert not await conn.fetchval(
+                "SELECT embedding IS NULL FROM memories WHERE user_id = $1", user
+            )
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
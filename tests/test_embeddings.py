@@ -1,9 +1,15 @@
 """Test embedding quality and similarity thresholds."""
 
+import asyncio
+from unittest.mock import patch
+
+import httpx
 import numpy as np
 import pytest
 
-from server.embeddings import embed
+from server.config import settings
+from server.embedding_backends import HashingBackend, OllamaBackend, onnx_model_id
+from server.embeddings import EmbedBatcher, EmbeddingCache, _truncate, embed
 
 
 def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
@@ -13,7 +19,7 @@ def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
 @pytest.mark.asyncio
 async def test_embedding_dimension(services):
     vec = await embed("test text")
-    assert vec.shape == (768,)
+    assert vec.shape == (settings.embed_dim,)
 
 
 @pytest.mark.asyncio
@@ -40,3 +46,141 @@ async def test_unrelated_concepts_low_similarity(services):
     vec2 = await embed("quantum mechanics wave function collapse")
     sim = cosine_sim(vec1, vec2)
     assert sim < 0.5, f"Expected < 0.5 for unrelated, got {sim}"
+
+
+def test_cache_normalizes_text():
+    cache = EmbeddingCache(max_size=10, ttl=60)
+    cache.put("m", "Where do I  park", np.ones(4, dtype=np.float32))
+    assert cache.get("m", "where do i park") is not None
+    assert cache.get("other-model", "where do i park") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_lru_eviction_and_ttl():
+    cache = EmbeddingCache(max_size=2, ttl=60)
+    cache.put("m", "a", np.ones(4, dtype=np.float32))
+    cache.put("m", "b", np.ones(4, dtype=np.float32))
+    cache.get("m", "a")  # 'b' is now least recently used
+    cache.put("m", "c", np.ones(4, dtype=np.float32))
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") is not None
+    assert cache.stats()["evictions"] == 1
+
+    cache.put("m", "old", np.ones(4, dtype=np.float32), expires_at=1.0)
+    assert cache.get("m", "old") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_cache_save_and_load(tmp_path):
+    cache = EmbeddingCache(max_size=10, ttl=60)
+    vec = np.arange(4, dtype=np.float32)
+    cache.put("m", "my location", vec)
+    path = tmp_path / "cache.npz"
+    assert cache.save(path) == 1
+
+    warm = EmbeddingCache(max_size=10, ttl=60)
+    assert warm.load(path) == 1
+    np.testing.assert_array_equal(warm.get("m", "my location"), vec)
+
+
+@pytest.mark.asyncio
+async def test_batcher_coalesces_concurrent_calls():
+    calls = []
+
+    async def fake_request(texts):
+        calls.append(texts)
+        return [np.full(4, len(t), dtype=np.float32) for t in texts]
+
+    batcher = EmbedBatcher(window=0.01, max_size=8)
+    with patch("server.embeddings._request_embeddings", fake_request):
+        a, b, c = await asyncio.gather(
+            batcher.submit("where do I park"),
+            batcher.submit("Where do I park"),
+            batcher.submit("wife name"),
+        )
+    assert calls == [["where do I park", "wife name"]]
+    assert a is b
+    assert c[0] == len("wife name")
+    assert batcher.stats()["deduplicated"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batcher_fails_every_caller_on_short_response():
+    class ShortBackend:
+        async def embed(self, texts):
+            return [np.ones(4, dtype=np.float32)]
+
+    batcher = EmbedBatcher(window=0.01, max_size=8)
+    with patch("server.embeddings._backend", ShortBackend()):
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                batcher.submit("porch light"),
+                batcher.submit("garden hose"),
+                return_exceptions=True,
+            ),
+            timeout=1,
+        )
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_truncate_renormalizes_prefix():
+    vec = np.array([3.0, 4.0, 12.0], dtype=np.float32)
+    vec /= np.linalg.norm(vec)
+    head = _truncate(vec, 2)
+    assert np.allclose(head, [0.6, 0.8])
+    assert _truncate(vec, 3) is vec
+    with pytest.raises(ValueError):
+        _truncate(vec, 4)
+
+
+@pytest.mark.asyncio
+async def test_hashing_backend_is_deterministic():
+    backend = HashingBackend(dim=64)
+    a, b, c = await backend.embed(["where do I park", "Where do I park", "wife name"])
+    assert a.shape == (64,) and a.dtype == np.float32
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert np.array_equal(a, b)
+    assert cosine_sim(a, c) < 0.5
+
+
+@pytest.mark.asyncio
+async def test_ollama_backend_fails_over_and_spreads_load():
+    hits = {"a": 0, "b": 0}
+
+    def handler(host):
+        async def respond(request):
+            hits[host] += 1
+            if host == "a":
+                return httpx.Response(503)
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={"embeddings": [[1.0, 0.0]]})
+        return respond
+
+    backend = OllamaBackend(["http://a", "http://b"], "nomic-embed-text", eject_seconds=60)
+    for endpoint, host in zip(backend.endpoints, ("a", "b")):
+        endpoint.client = httpx.AsyncClient(
+            base_url=endpoint.url, transport=httpx.MockTransport(handler(host))
+        )
+    vec = (await backend.embed(["x"]))[0]
+    assert vec.tolist() == [1.0, 0.0]
+    # "a" failed once and was ejected, so later requests all go to "b"
+    await asyncio.gather(*(backend.embed(["y"]) for _ in range(3)))
+    assert hits == {"a": 1, "b": 4}
+    stats = backend.stats()["endpoints"]
+    assert stats["http://a"]["ejected"] and stats["http://a"]["failures"] == 1
+    assert stats["http://b"]["requests"] == 4
+    await backend.close()
+
+
+def test_onnx_model_id_tracks_file_contents(tmp_path):
+    first, second = tmp_path / "a", tmp_path / "b"
+    for directory, weights in ((first, b"weights v1"), (second, b"weights v2")):
+        directory.mkdir()
+        (directory / "model.onnx").write_bytes(weights)
+        (directory / "tokenizer.json").write_text("{}")
+
+    ids = [onnx_model_id(str(d / "model.onnx"), str(d / "tokenizer.json")) for d in (first, second)]
+    assert all(i.startswith("onnx:model.onnx:") for i in ids)
+    assert ids[0] != ids[1]
+    assert onnx_model_id(str(first / "model.onnx"), str(first / "tokenizer.json")) == ids[0]
@@ -0,0 +1,87 @@
+"""Tests for the /memory/get read-through cache."""
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+from server.db import get_pool
+from server.models import MemoryItem
+from server.services import memory_service
+from server.services.memory_cache import MemoryCache
+
+
+def _item(key: str, value: str = "v") -> MemoryItem:
+    return MemoryItem(key=key, value=value, scope="user", user_id="u", tags="", tags_search="")
+
+
+def test_memory_cache_hit_and_invalidate():
+    cache = MemoryCache(max_size=10, ttl=60)
+    cache.put(_item("k"), expires_at=None)
+    assert cache.get("u", "k").value == "v"
+    cache.invalidate("u", "k")
+    assert cache.get("u", "k") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_memory_cache_respects_expires_at():
+    cache = MemoryCache(max_size=10, ttl=60)
+    cache.put(_item("k"), expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    assert cache.get("u", "k") is None
+
+
+def test_memory_cache_drops_put_after_invalidation():
+    cache = MemoryCache(max_size=10, ttl=60)
+    generation = cache.generation()
+    cache.invalidate("u", "k")
+    cache.put(_item("k", "old"), expires_at=None, generation=generation)
+    assert cache.get("u", "k") is None
+    assert cache.stats()["stale_puts"] == 1
+
+    # Other keys, and reads started after the invalidation, are still cached
+    cache.put(_item("other"), expires_at=None, generation=generation)
+    cache.put(_item("k", "new"), expires_at=None, generation=cache.generation())
+    assert cache.get("u", "other").value == "v"
+    assert cache.get("u", "k").value == "new"
+
+
+def test_memory_cache_forgotten_stamps_stay_conservative():
+    cache = MemoryCache(max_size=1, ttl=60)
+    generation = cache.generation()
+    for i in range(MemoryCache.min_stamps + 1):
+        cache.invalidate("u", f"k{i}")
+    # k0's own stamp has aged out; it still counts as invalidated after the read
+    cache.put(_item("k0"), expires_at=None, generation=generation)
+    assert cache.get("u", "k0") is None
+
+
+@pytest.mark.asyncio
+async def test_get_racing_a_set_does_not_cache_the_old_value(services):
+    user = "cache_race_test"
+    real_acquire = memory_service.acquire
+    raced = False
+
+    @asynccontextmanager
+    async def acquire_then_write():
+        nonlocal raced
+        async with real_acquire() as conn:
+            yield conn
+        if not raced:
+            # The get has read the old row; a set commits before it is cached
+            raced = True
+            await memory_service.memory_set("front_door", "blue", user_id=user)
+
+    pool = await get_pool()
+    try:
+        await memory_service.memory_set("front_door", "red", user_id=user)
+        memory_service.memory_cache.invalidate(user, "front_door")
+        with patch.object(memory_service, "acquire", acquire_then_write):
+            item = await memory_service.memory_get("front_door", user_id=user)
+        assert raced and item.value == "red"
+        assert (await memory_service.memory_get("front_door", user_id=user)).value == "blue"
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+        memory_service.memory_cache.invalidate(user, "front_door")
@@ -1,5 +1,7 @@
 """Unit tests for memory_service logic."""
 
+from unittest.mock import patch
+
 import pytest
 
 from server.services.memory_service import _build_search_text, _expand_key
@@ -34,3 +36,153 @@ def test_build_search_text_no_tags():
     assert "pet name" in result
     assert "pet_name" in result
     assert "Rex" in result
+
+
+@pytest.mark.asyncio
+async def test_unchanged_set_reuses_embedding(services):
+    from server.db import get_pool
+    from server.services import memory_service
+
+    user = "reuse_embedding_test"
+    select = "SELECT embedding::text, search_text FROM memories WHERE user_id = $1"
+    pool = await get_pool()
+    try:
+        await memory_service.memory_set("boiler_service", "every October", user_id=user)
+        async with pool.acquire() as conn:
+            before = await conn.fetchrow(select, user)
+
+        with patch.object(memory_service, "embed", wraps=memory_service.embed) as embed:
+            await memory_service.memory_set("boiler_service", "every October", user_id=user)
+            embed.assert_not_called()
+            async with pool.acquire() as conn:
+                assert await conn.fetchrow(select, user) == before
+
+            # Tags are part of the search text, so changing them re-embeds
+            await memory_service.memory_set(
+                "boiler_service", "every October", user_id=user, tags="heating"
+            )
+            embed.assert_called_once()
+        async with pool.acquire() as conn:
+            after = await conn.fetchrow(select, user)
+        assert after["search_text"] != before["search_text"]
+        assert after["embedding"] != before["embedding"]
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+
+
+@pytest.mark.asyncio
+async def test_set_retries_after_dimension_change(services):
+    """A write embedded at the old dimension before a re-index swap is re-embedded."""
+    import numpy as np
+
+    from server.db import get_embedding_dim, get_pool
+    from server.services import memory_service
+
+    user = "dim_race_test"
+    real_embed = memory_service.embed
+    calls = []
+
+    async def embed_across_swap(text):
+        calls.append(text)
+        if len(calls) == 1:
+            stale = np.ones(get_embedding_dim() * 2, dtype=np.float32)
+            return stale / np.linalg.norm(stale)
+        return await real_embed(text)
+
+    pool = await get_pool()
+    try:
+        with patch.object(memory_service, "embed", embed_across_swap):
+            await memory_service.memory_set("porch_light", "on at sunset", user_id=user)
+        assert len(calls) == 2
+        async with pool.acquire() as conn:
+            assert await conn.fetchval(
+                "SELECT vector_dims(embedding) FROM memories WHERE user_id = $1", user
+            ) == get_embedding_dim()
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+
+
+def _unit(dim: int, cos: float, axis: int):
+    """A unit vector with cosine similarity cos to the first axis."""
+    import numpy as np
+
+    v = np.zeros(dim, dtype=np.float32)
+    v[0] = cos
+    v[axis] = (1 - cos * cos) ** 0.5
+    return v
+
+
+async def _search_lexical_only_hit(monkeypatch, mode: str, fusion: str):
+    """Search for a row that only the trigram channel can find.
+
+    Twelve filler rows are closer to the query vector than the target row, so
+    with limit 3 it falls outside the vector channel's top 9. The fillers stay
+    below vector_threshold and share no trigrams with the query, so only rows
+    found some other way can be returned.
+    """
+    from server.config import settings
+    from server.db import get_embedding_dim, get_pool
+    from server.services import memory_service
+
+    monkeypatch.setattr(settings, "search_mode", mode)
+    monkeypatch.setattr(settings, "search_fusion", fusion)
+    monkeypatch.setattr(settings, "vector_depth_factor", 3)
+    monkeypatch.setattr(settings, "trigram_depth_factor", 3)
+
+    user = "hybrid_channel_test"
+    query = "kettle descaling schedule"
+    dim = get_embedding_dim()
+
+    async def fake_embed(text):
+        if text == query:
+            return _unit(dim, 1.0, 1)
+        if "filler" in text:
+            return _unit(dim, 0.345, 2 + int(text.split()[-1]))
+        return _unit(dim, 0.3, 100)
+
+    pool = await get_pool()
+    try:
+        with patch.object(memory_service, "embed", fake_embed):
+            for i in range(12):
+                await memory_service.memory_set(f"filler_note_{i}", f"nothing {i}", user_id=user)
+            await memory_service.memory_set(
+                "kettle_descaling_schedule", "first Sunday of the month", user_id=user
+            )
+            results, degraded = await memory_service.memory_search(query, user_id=user, limit=3)
+        assert not degraded
+        async with pool.acquire() as conn:
+            trgm = await conn.fetchval(
+                "SELECT similarity(search_text, $2) FROM memories WHERE user_id = $1 AND key = $3",
+                user, query, "kettle_descaling_schedule",
+            )
+        return results, trgm
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+
+
+@pytest.mark.asyncio
+async def test_hybrid_weighted_returns_trigram_only_hit(services, monkeypatch):
+    from server.config import settings
+
+    results, trgm = await _search_lexical_only_hit(monkeypatch, "hybrid", "weighted")
+    assert [r.key for r in results] == ["kettle_descaling_schedule"]
+    assert results[0].score == pytest.approx(0.3 + settings.trigram_weight * trgm, abs=1e-3)
+
+
+@pytest.mark.asyncio
+async def test_hybrid_rrf_returns_trigram_only_hit(services, monkeypatch):
+    from server.config import settings
+
+    results, _ = await _search_lexical_only_hit(monkeypatch, "hybrid", "rrf")
+    assert [r.key for r in results] == ["kettle_descaling_schedule"]
+    # Ranked first by the trigram channel and absent from the vector channel
+    assert results[0].score == pytest.approx(1 / (settings.rrf_k + 1), abs=1e-4)
+
+
+@pytest.mark.asyncio
+async def test_vector_mode_excludes_trigram_only_hit(services, monkeypatch):
+    results, _ = await _search_lexical_only_hit(monkeypatch, "vector", "weighted")
+    assert results == []
@@ -0,0 +1,99 @@
+"""Tests for the resumable SQLite to PostgreSQL migration script."""
+
+import json
+import sqlite3
+
+import pytest
+
+from migration import migrate_sqlite
+from server import embeddings
+from server.db import get_pool
+
+
+def _make_sqlite(path, rows: int) -> None:
+    db = sqlite3.connect(path)
+    db.execute(
+        """
+        CREATE TABLE mem (
+            key TEXT PRIMARY KEY, value TEXT, scope TEXT, tags TEXT, tags_search TEXT,
+            created_at TEXT, last_used_at TEXT, expires_at TEXT
+        )
+        """
+    )
+    db.executemany(
+        "INSERT INTO mem VALUES (?, ?, 'user', '', '', '2024-01-01T00:00:00', NULL, NULL)",
+        [(f"sqlite_fact_{i}", f"fact number {i}") for i in range(rows)],
+    )
+    db.commit()
+    db.close()
+
+
+def test_checkpoint_advances_over_contiguous_chunks(tmp_path):
+    path = tmp_path / "memory.db.checkpoint.json"
+    checkpoint = migrate_sqlite.Checkpoint.load(path, restart=False)
+    for seq, last_rowid in enumerate((3, 6, 9)):
+        checkpoint.issued(seq, last_rowid)
+
+    # Chunk 1 finishing first can't move the checkpoint past unfinished chunk 0
+    checkpoint.completed(1, 3)
+    assert json.loads(path.read_text()) == {"last_rowid": 0, "migrated": 0}
+    checkpoint.completed(0, 3)
+    assert json.loads(path.read_text()) == {"last_rowid": 6, "migrated": 6}
+    checkpoint.completed(2, 3)
+    assert json.loads(path.read_text()) == {"last_rowid": 9, "migrated": 9}
+
+    resumed = migrate_sqlite.Checkpoint.load(path, restart=False)
+    assert (resumed.rowid, resumed.migrated) == (9, 9)
+    assert migrate_sqlite.Checkpoint.load(path, restart=True).rowid == 0
+
+
+@pytest.mark.asyncio
+async def test_interrupted_migration_resumes_without_duplicates(services, tmp_path, monkeypatch):
+    # The session fixture owns the pool and embedding client
+    async def noop():
+        pass
+
+    monkeypatch.setattr(migrate_sqlite, "init_pool", noop)
+    monkeypatch.setattr(migrate_sqlite, "close_pool", noop)
+    monkeypatch.setattr(embeddings, "init_client", noop)
+    monkeypatch.setattr(embeddings, "close_client", noop)
+
+    user = "sqlite_migration_test"
+    sqlite_path = tmp_path / "memory.db"
+    checkpoint_path = tmp_path / "memory.db.checkpoint.json"
+    _make_sqlite(sqlite_path, rows=10)
+    write_rows = migrate_sqlite.write_rows
+    written: list[str] = []
+
+    async def write_then_fail(rows, stats):
+        if len(written) == 6:
+            raise RuntimeError("connection lost")
+        await write_rows(rows, stats)
+        written.extend(r["key"] for r in rows)
+
+    pool = await get_pool()
+    try:
+        monkeypatch.setattr(migrate_sqlite, "write_rows", write_then_fail)
+        with pytest.raises(ExceptionGroup):
+            await migrate_sqlite.migrate(str(sqlite_path), user, 3, 1, checkpoint_path, False)
+        assert json.loads(checkpoint_path.read_text()) == {"last_rowid": 6, "migrated": 6}
+
+        # The re-run starts after the last completed chunk
+        async def record(rows, stats):
+            await write_rows(rows, stats)
+            written.extend(r["key"] for r in rows)
+
+        monkeypatch.setattr(migrate_sqlite, "write_rows", record)
+        await migrate_sqlite.migrate(str(sqlite_path), user, 3, 2, checkpoint_path, False)
+        assert sorted(written) == sorted(f"sqlite_fact_{i}" for i in range(10))
+        assert not checkpoint_path.exists()
+
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT count(*) AS n, count(DISTINCT key) AS keys FROM memories WHERE user_id = $1",
+                user,
+            )
+        assert (row["n"], row["keys"]) == (10, 10)
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
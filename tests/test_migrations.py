@@ -0,0 +1,128 @@
+"""Tests for the versioned schema migrations."""
+
+import pytest
+
+from server import migrations
+from server.config import settings
+from server.db import get_pool
+
+
+@pytest.mark.asyncio
+async def test_schema_is_current_after_startup(services):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        assert await migrations.current_version(conn) == migrations.LATEST_VERSION
+        assert await migrations.pending(conn) == []
+        # Re-running is a no-op
+        assert await migrations.upgrade(conn) == []
+
+
+@pytest.mark.asyncio
+async def test_hnsw_parameter_change_rebuilds_index(services, monkeypatch):
+    pool = await get_pool()
+    _, index_name, _ = migrations.storage_spec(settings.vector_storage, 1)
+    async with pool.acquire() as conn:
+        monkeypatch.setattr(settings, "hnsw_ef_construction", 32)
+        assert any(index_name in p for p in await migrations.pending(conn))
+        await migrations.upgrade(conn)
+        assert await migrations.pending(conn) == []
+        definition = await conn.fetchval(
+            "SELECT obj_description(to_regclass($1), 'pg_class')", index_name
+        )
+        assert "ef_construction=32" in definition
+
+        monkeypatch.undo()
+        await migrations.upgrade(conn)
+        assert await migrations.pending(conn) == []
+
+
+@pytest.mark.asyncio
+async def test_backfill_lets_unchanged_writes_skip_embedding(services):
+    from unittest.mock import patch
+
+    from server.services.memory_service import _build_search_text, memory_set
+
+    user = "legacy_backfill_test"
+    search_text = _build_search_text("legacy_fact", "tea, no sugar", "")
+    pool = await get_pool()
+    backfill = next(m for m in migrations.MIGRATIONS if m.version == 6)
+    try:
+        await memory_set("legacy_fact", "tea, no sugar", user_id=user)
+        async with pool.acquire() as conn:
+            # As written before content_hash and embed_model were tracked
+            await conn.execute(
+                "UPDATE memories SET embed_model = '', content_hash = '' WHERE user_id = $1", user
+            )
+            for step in backfill.steps:
+                await conn.execute(migrations.render_step(step))
+            row = await conn.fetchrow(
+                "SELECT search_text, embed_model FROM memories WHERE user_id = $1", user
+            )
+        assert row["search_text"] == search_text
+        assert row["embed_model"] == settings.embed_model
+
+        with patch("server.services.memory_service.embed") as embed:
+            await memory_set("legacy_fact", "tea, no sugar", user_id=user)
+        embed.assert_not_called()
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+
+
+@pytest.mark.asyncio
+async def test_vector_storage_round_trip(services, monkeypatch):
+    import numpy as np
+
+    from server.services.memory_service import memory_search, memory_set
+
+    user = "storage_round_trip_test"
+    facts = {
+        "spare_key": "the spare key is under the flower pot",
+        "wifi_password": "the wifi password is hunter2",
+        "bin_day": "the bins go out on thursday",
+    }
+    select = "SELECT key, embedding::vector AS embedding FROM memories WHERE user_id = $1"
+
+    def as_array(v):
+        return np.asarray(v.to_numpy() if hasattr(v, "to_numpy") else v, dtype=np.float32)
+
+    # Only the vector channel, and always through the ANN index being tested
+    monkeypatch.setattr(settings, "search_mode", "vector")
+    monkeypatch.setattr(settings, "exact_search_threshold", 0)
+    pool = await get_pool()
+    try:
+        for key, value in facts.items():
+            await memory_set(key, value, user_id=user)
+        async with pool.acquire() as conn:
+            total = await conn.fetchval("SELECT count(*) FROM memories")
+            original = {r["key"]: as_array(r["embedding"]) for r in await conn.fetch(select, user)}
+
+        for mode in ("halfvec", "binary", "vector"):
+            async with pool.acquire() as conn:
+                await migrations.apply_vector_storage(conn, mode)
+                monkeypatch.setattr(settings, "vector_storage", mode)
+                assert await migrations.pending(conn) == []
+                column_type, index_name, _ = migrations.storage_spec(
+                    mode, await migrations.column_dim(conn)
+                )
+                assert await conn.fetchval(
+                    "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                    "WHERE attrelid = 'memories'::regclass AND attname = 'embedding'"
+                ) == column_type
+                for name in migrations.EMBEDDING_INDEXES:
+                    exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name)
+                    assert exists == (name == index_name)
+
+                assert await conn.fetchval("SELECT count(*) FROM memories") == total
+                rows = {r["key"]: as_array(r["embedding"]) for r in await conn.fetch(select, user)}
+            assert rows.keys() == original.keys()
+            for key, embedding in rows.items():
+                # halfvec keeps about three significant digits
+                np.testing.assert_allclose(embedding, original[key], atol=1e-3)
+
+            results, _ = await memory_search("where is the spare key", user_id=user, limit=1)
+            assert [r.key for r in results] == ["spare_key"], mode
+    finally:
+        async with pool.acquire() as conn:
+            await migrations.apply_vector_storage(conn, "vector")
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
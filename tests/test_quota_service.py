@@ -0,0 +1,56 @@
+"""Tests for per-user and per-scope row quotas."""
+
+import pytest
+
+from server.config import settings
+from server.db import get_pool
+from server.services import quota_service
+from server.services.memory_service import memory_set
+
+
+@pytest.mark.asyncio
+async def test_quota_evicts_least_recently_used(services, monkeypatch):
+    monkeypatch.setattr(settings, "quota_max_rows_per_user", 3)
+    monkeypatch.setattr(settings, "quota_scope_limits", "session=1")
+    monkeypatch.setattr(settings, "quota_archive", True)
+    user = "quota_test"
+    for i in range(4):
+        await memory_set(f"quota_user_{i}", f"fact number {i}", user_id=user)
+    await memory_set("quota_session_a", "first session note", scope="session", user_id=user)
+    await memory_set("quota_session_b", "second session note", scope="session", user_id=user)
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        # quota_user_0 was used most recently, quota_user_1 least recently
+        await conn.execute(
+            """
+            UPDATE memories SET last_used_at = NOW() - make_interval(hours => t.age)
+            FROM unnest($1::text[], $2::int[]) AS t(key, age)
+            WHERE memories.key = t.key AND memories.user_id = $3
+            """,
+            ["quota_user_0", "quota_user_1", "quota_user_2", "quota_user_3",
+             "quota_session_a", "quota_session_b"],
+            [1, 6, 5, 4, 3, 2],
+            user,
+        )
+
+    try:
+        assert await quota_service.enforce([user]) == 3
+        async with pool.acquire() as conn:
+            kept = await conn.fetch("SELECT key FROM memories WHERE user_id = $1 ORDER BY key", user)
+            archived = await conn.fetch(
+                "SELECT key FROM memories_archive WHERE user_id = $1 ORDER BY key", user
+            )
+        assert [r["key"] for r in kept] == ["quota_session_b", "quota_user_0", "quota_user_3"]
+        assert [r["key"] for r in archived] == ["quota_session_a", "quota_user_1", "quota_user_2"]
+        assert await quota_service.enforce([user]) == 0
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+            await conn.execute("DELETE FROM memories_archive WHERE user_id = $1", user)
+
+
+def test_parse_scope_limits():
+    assert quota_service.parse_scope_limits(" user=2000, session=200 ,") == {"user": 2000, "session": 200}
+    with pytest.raises(ValueError):
+        quota_service.parse_scope_limits("session")
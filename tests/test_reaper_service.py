@@ -0,0 +1,30 @@
+"""Tests for the expired-memory reaper."""
+
+import pytest
+
+from server.db import get_pool
+from server.services import reaper_service
+from server.services.memory_cache import cache as memory_cache
+from server.services.memory_service import memory_forget, memory_get, memory_set
+
+
+@pytest.mark.asyncio
+async def test_reap_deletes_only_expired_rows(services):
+    await memory_set("reap_expired", "old value", user_id="reap_test")
+    await memory_set("reap_live", "current value", user_id="reap_test")
+    assert await memory_get("reap_expired", user_id="reap_test") is not None
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE memories SET expires_at = NOW() - interval '1 day' WHERE key = $1 AND user_id = $2",
+            "reap_expired",
+            "reap_test",
+        )
+
+    assert await reaper_service.reap() >= 1
+    assert memory_cache.get("reap_test", "reap_expired") is None
+    async with pool.acquire() as conn:
+        keys = await conn.fetch("SELECT key FROM memories WHERE user_id = $1", "reap_test")
+    assert [r["key"] for r in keys] == ["reap_live"]
+
+    await memory_forget("reap_live", user_id="reap_test")
@@ -0,0 +1,100 @@
+"""End-to-end test of the online embedding dimension migration."""
+
+import asyncio
+
+import pytest
+
+from server import db, embeddings, migrations
+from server.config import settings
+from server.db import get_pool
+from server.services import reindex_service
+from server.services.memory_service import memory_search, memory_set
+
+
+async def _search_until(done: asyncio.Event, user: str, errors: list) -> int:
+    """Search continuously while the migration runs; returns searches made."""
+    searches = 0
+    while not done.is_set():
+        try:
+            results, _ = await memory_search("where is the spare key", user_id=user, limit=1)
+            if [r.key for r in results] != ["spare_key"]:
+                errors.append([r.key for r in results])
+        except Exception as e:
+            errors.append(e)
+        searches += 1
+        await asyncio.sleep(0)
+    return searches
+
+
+async def _migrate(source_dim: int, dim: int, user: str) -> None:
+    done = asyncio.Event()
+    errors: list = []
+    searcher = asyncio.create_task(_search_until(done, user, errors))
+    try:
+        await reindex_service.reindex(source_dim, dim)
+    finally:
+        done.set()
+    assert await searcher > 0
+    assert errors == []
+
+
+@pytest.mark.asyncio
+async def test_dimension_change_keeps_search_working(services, monkeypatch):
+    user = "reindex_e2e_test"
+    source_dim = db.get_embedding_dim()
+    small_dim = source_dim // 2
+    pool = await get_pool()
+    real_swap = reindex_service._swap
+    batch_size = settings.reindex_batch_size
+    swaps = []
+
+    async def swap_after_late_writes(conn, *args):
+        # Leave more stragglers than one batch on the first grow attempt
+        source, target = args[:2]
+        if target > source and swaps.count(False) == 0:
+            monkeypatch.setattr(settings, "reindex_batch_size", 2)
+            async with pool.acquire() as other:
+                await other.execute(
+                    f"UPDATE memories SET {reindex_service.NEXT_COLUMN} = NULL "
+                    "WHERE id IN (SELECT id FROM memories WHERE embedding IS NOT NULL LIMIT 3)"
+                )
+        swapped = await real_swap(conn, *args)
+        swaps.append(swapped)
+        monkeypatch.setattr(settings, "reindex_batch_size", batch_size)
+        return swapped
+
+    monkeypatch.setattr(reindex_service, "_swap", swap_after_late_writes)
+    try:
+        await memory_set("spare_key", "the spare key is under the flower pot", user_id=user)
+        await memory_set("bin_day", "the bins go out on thursday", user_id=user)
+
+        monkeypatch.setattr(settings, "embed_dim", small_dim)
+        await _migrate(source_dim, small_dim, user)
+        async with pool.acquire() as conn:
+            assert await migrations.column_dim(conn) == small_dim
+            assert await migrations.pending(conn) == []
+        assert db.get_embedding_dim() == small_dim
+        await memory_set("gate_code", "the side gate code is 1234", user_id=user)
+        results, _ = await memory_search("side gate code", user_id=user, limit=1)
+        assert [r.key for r in results] == ["gate_code"]
+
+        monkeypatch.setattr(settings, "embed_dim", source_dim)
+        retries = reindex_service.stats()["swap_retries"]
+        await _migrate(small_dim, source_dim, user)
+        assert swaps == [True, False, True]
+        assert reindex_service.stats()["swap_retries"] == retries + 1
+        async with pool.acquire() as conn:
+            assert await migrations.column_dim(conn) == source_dim
+            assert await migrations.pending(conn) == []
+            assert not await conn.fetchval(
+                "SELECT count(*) FROM memories WHERE embedding IS NULL AND embed_model <> ''"
+            )
+        results, _ = await memory_search("side gate code", user_id=user, limit=1)
+        assert [r.key for r in results] == ["gate_code"]
+    finally:
+        if db.get_embedding_dim() != source_dim:
+            monkeypatch.undo()
+            await reindex_service.reindex(db.get_embedding_dim(), source_dim)
+        embeddings.set_output_dim(source_dim)
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
@@ -0,0 +1,63 @@
+"""Tests for the exact/HNSW search path choice."""
+
+import asyncio
+
+import pytest
+
+from server.config import settings
+from server.db import get_pool
+from server.services import search_planner
+from server.services.memory_service import memory_search, memory_set
+
+
+async def _cleanup(user: str) -> None:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM memories WHERE user_id = $1", user)
+
+
+@pytest.mark.asyncio
+async def test_exact_below_threshold_hnsw_above(services, monkeypatch):
+    user = "planner_path_test"
+    try:
+        for key in ("shed_key", "bike_lock", "gate_code"):
+            await memory_set(key, f"{key} is under the mat", user_id=user)
+        await search_planner.refresh()
+
+        monkeypatch.setattr(settings, "exact_search_threshold", 4)
+        assert search_planner.choose_path(user, "user") == search_planner.EXACT
+        monkeypatch.setattr(settings, "exact_search_threshold", 3)
+        assert search_planner.choose_path(user, "user") == search_planner.ANN
+
+        # Both plans answer the search, and each is counted under its own path
+        for threshold, path in ((4, search_planner.EXACT), (3, search_planner.ANN)):
+            monkeypatch.setattr(settings, "exact_search_threshold", threshold)
+            before = search_planner.stats()[path]["searches"]
+            results, _ = await memory_search("where is the bike lock", user_id=user, limit=1)
+            assert [r.key for r in results] == ["bike_lock"]
+            assert search_planner.stats()[path]["searches"] == before + 1
+    finally:
+        await _cleanup(user)
+
+
+@pytest.mark.asyncio
+async def test_counts_refresh_in_background(services, monkeypatch):
+    user = "planner_refresh_test"
+    monkeypatch.setattr(settings, "planner_refresh_interval", 0.2)
+    try:
+        await memory_set("first_key", "one", user_id=user)
+        await search_planner.start()
+        assert search_planner.row_count(user, "user") == 1
+
+        # Searches read the cached count until the next background refresh
+        await memory_set("second_key", "two", user_id=user)
+        assert search_planner.row_count(user, "user") == 1
+        refreshes = search_planner.stats()["refreshes"]
+        for _ in range(50):
+            if search_planner.stats()["refreshes"] > refreshes:
+                break
+            await asyncio.sleep(0.05)
+        assert search_planner.row_count(user, "user") == 2
+    finally:
+        await search_planner.stop()
+        await _cleanup(user)
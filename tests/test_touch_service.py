@@ -0,0 +1,39 @@
+"""Tests for the buffered last_used_at writer."""
+
+import pytest
+
+from server.db import get_pool
+from server.services import touch_service
+from server.services.memory_service import memory_forget, memory_get, memory_set
+
+
+@pytest.mark.asyncio
+async def test_touches_are_buffered_until_flush(services):
+    await memory_set("touch_test_key", "value", user_id="touch_test")
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE memories SET last_used_at = '2000-01-01' WHERE key = $1 AND user_id = $2",
+            "touch_test_key",
+            "touch_test",
+        )
+
+    assert await memory_get("touch_test_key", user_id="touch_test") is not None
+    async with pool.acquire() as conn:
+        before = await conn.fetchval(
+            "SELECT last_used_at FROM memories WHERE key = $1 AND user_id = $2",
+            "touch_test_key",
+            "touch_test",
+        )
+    assert before.year == 2000
+
+    assert await touch_service.flush() >= 1
+    async with pool.acquire() as conn:
+        after = await conn.fetchval(
+            "SELECT last_used_at FROM memories WHERE key = $1 AND user_id = $2",
+            "touch_test_key",
+            "touch_test",
+        )
+    assert after > before
+
+    await memory_forget("touch_test_key", user_id="touch_test")